@@ -1,15 +1,41 @@
 # app.py  
 # Importing Libraries
 import streamlit as st
-from langchain_ibm import WatsonxLLM
-from ibm_watson_machine_learning.metanames import GenTextParamsMetaNames as GenParams
 from datetime import datetime, timedelta
-from fpdf import FPDF
+import hashlib
 import json
 import os
 import random
+import re
+import secrets
+import time
+import uuid
 import plotly.express as px
 import pandas as pd
+import numpy as np
+from bulk_import import import_episodes, import_metrics
+from chat_memory import ConversationMemory, build_summary_prompt
+from downsample import downsample_frame
+from exports import EXPORT_FORMATS, StoredHistory, export_metrics
+from figure_cache import FigureCache
+from health_db import HealthDB
+from health_events import EPISODE, EpisodeProjection, EventLog, MetricProjection, history_entries
+from health_report import (
+    SUMMARY_FALLBACK, TREND_WINDOW, ReportCache, content_key, is_usable_summary, render_pdf, report_content,
+    summary_prompt
+)
+from llm_backends import MockBackend
+from llm_cache import ResponseCache
+from llm_config import DEFAULT_GEN_PARAMS, MODEL_MAP
+from jobs import JobManager
+from llm_service import ClientPool, ModelService, ModelUnavailableError
+from metrics_store import EPOCH, METRICS, MetricStore, format_timestamp, to_timestamp
+from rate_limit import RateLimiter
+from report_charts import ChartCache, chart_specs
+from reference_ranges import (
+    STATUS_HIGH, STATUS_LOW, STATUS_NORMAL, age_group_for, classify_store, patient_conditions, reference_ranges
+)
+from resilience import CircuitBreaker, ResiliencePolicy
 
 # Page config
 st.set_page_config(
@@ -98,81 +124,616 @@ page = st.sidebar.selectbox(
     ["Profile", "Chat", "Symptoms", "Treatment", "Diseases", "Reports", "Settings"]
 )
 
-# Initialize Session State Variables
+# Starter readings shown on the dashboard before anything is logged
+DEFAULT_METRICS = {
+    "heart_rates": 72,
+    "glucose_levels": 90,
+    "blood_pressure_systolic": 120,
+    "blood_pressure_diastolic": 80,
+    "peak_flow": 400,
+    "hba1c": 5.7
+}
+
+# Accepted range per metric; shared by the manual inputs and bulk import
+METRIC_INPUT_RANGES = {
+    "heart_rates": (40, 140),
+    "glucose_levels": (50, 300),
+    "blood_pressure_systolic": (90, 200),
+    "blood_pressure_diastolic": (60, 130),
+    "peak_flow": (100, 800),
+    "hba1c": (4.0, 12.0)
+}
+
+def default_metric_store():
+    store = MetricStore()
+    today = datetime.now().date()
+    for metric, value in DEFAULT_METRICS.items():
+        store.append(metric, today, value)
+    return store
+
+def stored_history():
+    """The session user's stored readings and episodes in the history window, replayed after a reset."""
+    return history_entries(get_health_db(), st.session_state.user_id, history_start())
+
+def new_event_log(initial_store=default_metric_store):
+    """
+    A session's event log with the views the pages read: "metrics" (the
+    MetricStore behind the dashboard, exports and AI prompts) and "episodes"
+    (the disease logs).
+    """
+    return EventLog({"metrics": MetricProjection(initial_store), "episodes": EpisodeProjection()}, history=stored_history)
+
+def get_metric_store():
+    return st.session_state.health_events["metrics"].store
+
+def episode_log(log_key):
+    return st.session_state.health_events["episodes"].logs[log_key]
+
+def episode_log_version(log_key):
+    return st.session_state.health_events["episodes"].versions[log_key]
+
+def series_frame(series, column, start=None, end=None, freq=None):
+    """
+    DataFrame of one metric series with a datetime "Date" column.
+    :param start: (float) Range start in seconds since EPOCH (None = unbounded).
+    :param end: (float) Exclusive range end (None = unbounded).
+    :param freq: (str) "D" or "W" to plot daily or weekly means instead of raw readings.
+    """
+    if freq:
+        aggregated = series.aggregate(freq, start, end)
+        timestamps, values = aggregated["start"], aggregated["mean"]
+    else:
+        timestamps, values = series.query(start, end)
+    return pd.DataFrame({
+        "Date": pd.to_datetime(np.array(timestamps), unit="s"),
+        column: np.array(values),
+    })
+
+# Date range presets shared by the chart selectors; values are days back from today
+DATE_RANGE_PRESETS = {"All time": None, "Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90}
+
+def date_range_selector(key, on_change=None):
+    """
+    Preset or custom date range picker.
+    :param key: (str) Widget key prefix, unique per page.
+    :param on_change: (callable) Optional callback when either widget changes.
+    :return: (tuple) (start, end) in seconds since EPOCH, end exclusive; None means unbounded.
+    """
+    today = datetime.now().date()
+    choice = st.selectbox("Date Range", [*DATE_RANGE_PRESETS, "Custom"], key=f"{key}_range", on_change=on_change)
+    if choice != "Custom":
+        days = DATE_RANGE_PRESETS[choice]
+        return (None if days is None else to_timestamp(today - timedelta(days=days - 1))), None
+    picked = st.date_input("From / To", value=(today - timedelta(days=29), today), key=f"{key}_dates", on_change=on_change)
+    if not picked:
+        # The range was cleared; show the default until a new one is picked
+        picked = (today - timedelta(days=29), today)
+    elif len(picked) < 2:
+        # Only the first day is picked so far
+        return to_timestamp(picked[0]), None
+    return to_timestamp(picked[0]), to_timestamp(picked[1] + timedelta(days=1))
+
+# Trends are read from each series' rolling statistics (see health_report.TREND_WINDOW)
+TREND_ARROWS = {"up": "↑", "down": "↓", "flat": "-"}
+
+def trend_arrow(series):
+    """Direction of the least-squares fit over the last TREND_WINDOW readings."""
+    return TREND_ARROWS[series.stats.window(TREND_WINDOW).trend()]
+
+def rolling_average(series):
+    """Mean of the last TREND_WINDOW readings, rounded for display."""
+    mean = series.stats.window(TREND_WINDOW).mean
+    return "N/A" if mean is None else round(mean, 1)
+
+# Reference ranges follow the profile's age and the patient's conditions
+STATUS_LABELS = {
+    None: ("⚠️ No Data", "gray"),
+    STATUS_NORMAL: ("✅ Normal", "green"),
+    STATUS_LOW: ("⚠️ Low", "red"),
+    STATUS_HIGH: ("⚠️ High", "red")
+}
+
+def logged_episode_logs():
+    """Names of the disease logs holding at least one episode."""
+    return [log for log, records in st.session_state.health_events["episodes"].logs.items() if records]
+
+def get_range_results():
+    """
+    Classify every metric series against the patient's reference ranges.
+    Recomputed only when the data, age group or conditions change; the status
+    cards, chart bands, PDF and AI prompt all read this one result.
+    :return: (dict) Metric id -> RangeResult.
+    """
+    store = get_metric_store()
+    age_group = age_group_for(st.session_state.profile_data.get("age"))
+    conditions = patient_conditions(st.session_state.profile_data.get("medical_history", ""), logged_episode_logs())
+    key = (store.version, age_group, conditions)
+    cached = st.session_state.get("range_results")
+    if cached is None or cached[0] != key:
+        cached = (key, classify_store(store, reference_ranges(age_group, conditions)))
+        st.session_state.range_results = cached
+    return cached[1]
+
+def time_in_range(result):
+    return "N/A" if result.time_in_range is None else f"{result.time_in_range:.0%}"
+
+# Initialize Session State Variables: key -> zero-argument factory, so the
+# objects are only built for a new session rather than on every rerun
 DEFAULT_SESSION_STATE = {
-    "profile_complete": False,
-    "profile_data": {},
-    "messages": [],
-    "health_data": {},
-    "language": "en",
-    "glucose_log": [],
-    "bp_log": [],
-    "asthma_log": [],
-    "analytics_data": {
-        "dates": [datetime.now().strftime("%Y-%m-%d")],
-        "heart_rates": [72],
-        "glucose_levels": [90],
-        "blood_pressure_systolic": [120],
-        "blood_pressure_diastolic": [80],
-        "peak_flow": [400],
-        "hba1c": [5.7]
-    }
+    "session_id": lambda: str(uuid.uuid4()),
+    "profile_complete": lambda: False,
+    "profile_data": dict,
+    "messages": list,
+    "chat_memory": ConversationMemory,
+    "health_data": dict,
+    "language": lambda: "en",
+    # Every logged reading and episode; the Reports and Diseases views are projections of it
+    "health_events": new_event_log,
+    "symptom_counts": dict,
+    "figure_cache": FigureCache
 }
 
 # Ensure all default keys exist in session state
-for key, default_value in DEFAULT_SESSION_STATE.items():
+for key, factory in DEFAULT_SESSION_STATE.items():
     if key not in st.session_state:
-        st.session_state[key] = default_value
+        st.session_state[key] = factory()
 
 # Reset Profile Function
 def reset_profile():
     st.session_state.profile_complete = False
     st.session_state.profile_data = {}
     st.session_state.messages = []
-    st.session_state.glucose_log = []
-    st.session_state.bp_log = []
-    st.session_state.asthma_log = []
+    st.session_state.chat_memory.clear()
+    reset_chat_view()
+    st.session_state.health_events = new_event_log()
     st.session_state.health_data = {}
-    st.session_state.analytics_data = {
-        "heart_rates": [72], 
-        "glucose_levels": [90], 
-        "dates": [datetime.now().strftime("%Y-%m-%d")]
-    }
+    st.session_state.symptom_counts = {}
+    get_health_db().clear(st.session_state.user_id)
     st.rerun()
 
+# Duplicate-submission guard (double clicks, resubmitting the same inputs)
+SUBMISSION_WINDOW_SECONDS = 10
+
+def is_duplicate_submission(form, signature):
+    """Return True if this session completed the same form with identical inputs moments ago."""
+    previous = st.session_state.get("recent_submissions", {}).get(form)
+    return (
+        previous is not None
+        and previous[0] == hash(signature)
+        and time.time() - previous[1] < SUBMISSION_WINDOW_SECONDS
+    )
+
+def record_submission(form, signature):
+    """Remember a completed submission so an immediate repeat can be dropped."""
+    st.session_state.setdefault("recent_submissions", {})[form] = (hash(signature), time.time())
+
+# Settings come from st.secrets, then environment variables, then the default
+def get_setting(name, default=None):
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        # No secrets file (e.g. CI); fall back to the environment
+        pass
+    return os.environ.get(name, default)
+
+# Model backend: "watsonx" (default) or "mock" for offline runs and load tests
+LLM_BACKEND = str(get_setting("LLM_BACKEND", "watsonx")).lower()
+
+# Durable storage: a new session loads only the recent window it displays
+HISTORY_DAYS = int(get_setting("HISTORY_DAYS", 90))
+CHAT_HISTORY_LIMIT = int(get_setting("CHAT_HISTORY_LIMIT", 50))
+# Chat turns shown at first and added by each "Load earlier messages"
+CHAT_PAGE_SIZE = int(get_setting("CHAT_PAGE_SIZE", 20))
+DISEASE_LOGS = ("glucose_log", "bp_log", "asthma_log")
+
+@st.cache_resource
+def get_health_db():
+    return HealthDB(get_setting("HEALTH_DB_PATH", ".cache/health.sqlite3"))
+
+# URL ids must look like the random tokens issued below (older sessions used
+# 32-character uuid hex), so "?uid=alice" cannot name someone's data
+USER_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_-]{32,128}")
+
+def auth_configured():
+    """True when Streamlit authentication ([auth] in secrets.toml) is set up."""
+    try:
+        return "auth" in st.secrets
+    except Exception:
+        # No secrets file
+        return False
+
+def get_user_id():
+    """
+    The id the user's stored data is keyed on.
+
+    With authentication configured the id is derived from the signed-in
+    account and the URL plays no part. Otherwise it is an unguessable random
+    token kept in the URL (?uid=...) so a reload or bookmark restores the data.
+    In that mode the link is the only credential: anyone who has it (browser
+    history, a shared screenshot, proxy logs) can read and change the data,
+    so deployments holding real health data should configure authentication.
+    """
+    if auth_configured():
+        if not st.user.is_logged_in:
+            st.info("🔒 Log in to load your health data.")
+            st.button("Log in", on_click=st.login)
+            st.stop()
+        account = f"{st.user.get('iss', '')}|{st.user.get('sub') or st.user.get('email')}"
+        return "acct-" + hashlib.sha256(account.encode("utf-8")).hexdigest()
+    user_id = st.query_params.get("uid")
+    if not user_id or not USER_TOKEN_PATTERN.fullmatch(user_id):
+        user_id = secrets.token_urlsafe(32)
+        st.query_params["uid"] = user_id
+    return user_id
+
+def history_start():
+    return datetime.now().date() - timedelta(days=HISTORY_DAYS)
+
+def in_loaded_history(start):
+    """Whether a range starting at `start` (seconds since EPOCH, None = unbounded) lies inside the session's history window."""
+    return start is not None and start >= to_timestamp(history_start())
+
+def stored_history_key(*view):
+    """Cache key for data read from the database: changes with the session's data and with imports older than its window."""
+    return view + (st.session_state.get("history_imports", 0),)
+
+def range_metric_store(start, end):
+    """
+    The readings the Reports charts show for [start, end). Ranges inside the
+    loaded window use the session store; older ones replay the stored history
+    through the same event projection, so readings logged as episodes are
+    included. Series whose session data has not changed are kept, so their
+    cached figures stay valid.
+    """
+    store = get_metric_store()
+    if in_loaded_history(start):
+        return store
+    key = stored_history_key(start, end)
+    cached = st.session_state.get("range_metric_store")
+    if cached is None or cached[0] != key or cached[1] != store.version:
+        events = EventLog({"metrics": MetricProjection()})
+        events.append(history_entries(
+            get_health_db(),
+            st.session_state.user_id,
+            None if start is None else EPOCH + timedelta(seconds=start),
+            None if end is None else EPOCH + timedelta(seconds=end),
+        ))
+        history = events["metrics"].store
+        if cached is not None and cached[0] == key:
+            for metric, old_version, new_version in zip(METRICS, cached[1], store.version):
+                if old_version == new_version:
+                    history.series[metric] = cached[2][metric]
+        cached = (key, store.version, history)
+        st.session_state.range_metric_store = cached
+    history = cached[2]
+    # Users with nothing stored yet keep seeing the placeholder readings
+    if not any(len(series) for series in history.series.values()):
+        return store
+    return history
+
+def range_episode_log(log_key, start):
+    """A disease log's records from `start` on; like range_metric_store, older ranges are read from the database."""
+    records = episode_log(log_key)
+    if in_loaded_history(start):
+        return records
+    key = stored_history_key(log_key, start, episode_log_version(log_key))
+    cached = st.session_state.get("range_episode_log")
+    if cached is None or cached[0] != key:
+        since = None if start is None else format_timestamp(start)
+        cached = (key, get_health_db().load_episodes(st.session_state.user_id, log_key, since) or records)
+        st.session_state.range_episode_log = cached
+    return cached[1]
+
+def load_user_session(user_id):
+    """Populate a fresh session with the user's profile and recent history."""
+    db = get_health_db()
+    profile = db.load_profile(user_id)
+    if profile:
+        st.session_state.profile_data = profile
+        st.session_state.profile_complete = True
+    
+    # Replay the history window into a fresh event log in time order
+    entries = history_entries(db, user_id, history_start())
+    # Placeholder readings are only shown to users with no history yet
+    st.session_state.health_events = new_event_log(MetricStore if entries else default_metric_store)
+    st.session_state.health_events.append(entries)
+    
+    st.session_state.messages = [tuple(turn) for turn in db.load_messages(user_id, CHAT_HISTORY_LIMIT)]
+    for _, role, content in st.session_state.messages:
+        st.session_state.chat_memory.add(role, content)
+    reset_chat_view()
+    st.session_state.user_id = user_id
+
+def reset_chat_view():
+    st.session_state.chat_window = CHAT_PAGE_SIZE
+    # Message id -> rendered bubble HTML for the turns on screen
+    st.session_state.chat_html = {}
+
+def chat_bubble_html(role, message):
+    if role == "user":
+        return f'<div class="user-bubble"><strong>You:</strong><br>{message}</div>'
+    return f'<div class="bot-bubble"><strong>Assistant:</strong><br>{message}</div>'
+
+def chat_transcript(window):
+    """
+    The newest `window` (id, role, content) chat turns, oldest first.
+    Served from the in-memory recent transcript; only a window reaching past it reads the database.
+    :return: (list, bool) The turns and whether older turns exist.
+    """
+    messages = st.session_state.messages
+    if window < len(messages):
+        return messages[-window:], True
+    if len(messages) < CHAT_HISTORY_LIMIT:
+        # The recent transcript is the whole history
+        return messages, False
+    turns = get_health_db().load_messages(st.session_state.user_id, window + 1)
+    return turns[-window:], len(turns) > window
+
+if "user_id" not in st.session_state:
+    load_user_session(get_user_id())
+
+def log_metrics(readings):
+    """
+    Record readings in the session's event log and the database.
+    :param readings: (list) (metric id, date, value) tuples.
+    """
+    st.session_state.health_events.add_readings(readings)
+    get_health_db().add_metrics(
+        st.session_state.user_id,
+        [(metric, to_timestamp(when), float(value)) for metric, when, value in readings]
+    )
+
+# Charts: long histories are downsampled before Plotly serializes them, and
+# large traces switch to WebGL
+CHART_MAX_POINTS = int(get_setting("CHART_MAX_POINTS", 1000))
+WEBGL_THRESHOLD = int(get_setting("WEBGL_THRESHOLD", 1500))
+
+def line_chart(df, x, y, color=None, **kwargs):
+    """
+    px.line with at most about CHART_MAX_POINTS points per line (LTTB).
+    :param df: (pd.DataFrame) Data sorted or unsorted by x.
+    :param x: (str) Date column.
+    :param y: (str | list) Value column(s).
+    :param color: (str) Optional long-format grouping column; each group is downsampled on its own.
+    """
+    columns = [y] if isinstance(y, str) else list(y)
+    if color is None:
+        df = downsample_frame(df, x, columns, CHART_MAX_POINTS)
+    else:
+        df = pd.concat([
+            downsample_frame(group, x, columns, CHART_MAX_POINTS)
+            for _, group in df.groupby(color, sort=False)
+        ])
+    render_mode = "webgl" if len(df) * len(columns) > WEBGL_THRESHOLD else "auto"
+    return px.line(df, x=x, y=y, color=color, render_mode=render_mode, **kwargs)
+
+def get_figure(key, build):
+    """
+    Serve a figure from the session's figure cache, building it only on a miss.
+    :param key: (tuple) Chart name plus the data version(s) it plots and any display options.
+    :param build: (callable) Builds the figure.
+    """
+    return st.session_state.figure_cache.get(key + (CHART_MAX_POINTS, WEBGL_THRESHOLD), build)
+
+def log_episodes(log_key, records):
+    """Append disease episode records to the session's event log and the database."""
+    st.session_state.health_events.add_episodes(log_key, records)
+    get_health_db().add_episodes(st.session_state.user_id, log_key, records)
+
+def import_metric_file(uploaded):
+    """
+    Bulk-import readings from a device export into the database, and append
+    the ones inside the history window to the session's event log.
+    :return: (dict) Import report (rows, imported, invalid, duplicates).
+    """
+    db = get_health_db()
+    user_id = st.session_state.user_id
+    readings, report = import_metrics(
+        uploaded,
+        uploaded.name,
+        METRIC_INPUT_RANGES,
+        existing_timestamps=lambda metric, start, end: db.metric_timestamps(user_id, metric, start, end)
+    )
+    if readings:
+        rows = [
+            (metric, ts, value)
+            for metric, (timestamps, values) in readings.items()
+            for ts, value in zip(timestamps.tolist(), values.tolist())
+        ]
+        db.add_metrics(user_id, rows)
+        st.session_state.history_imports = st.session_state.get("history_imports", 0) + 1
+        since = to_timestamp(history_start())
+        st.session_state.health_events.add_readings(row for row in rows if row[1] >= since)
+    return report
+
+def import_episode_file(uploaded, log_key, columns):
+    """Bulk-import disease episodes for one log; same flow as import_metric_file."""
+    db = get_health_db()
+    user_id = st.session_state.user_id
+    records, report = import_episodes(
+        uploaded,
+        uploaded.name,
+        columns,
+        text_columns=("triggers",) if log_key == "asthma_log" else (),
+        existing_records=db.load_episodes(user_id, log_key)
+    )
+    if records:
+        db.add_episodes(user_id, log_key, records)
+        st.session_state.history_imports = st.session_state.get("history_imports", 0) + 1
+        since = history_start().strftime("%Y-%m-%d")
+        st.session_state.health_events.add_episodes(log_key, [record for record in records if record["date"] >= since])
+    return report
+
+def show_import_report(report):
+    # A wide file holds several readings per row, so readings and rows are counted apart
+    st.success(
+        f"✅ Imported {report['imported']} readings from {report['rows']} rows "
+        f"({report['invalid']} invalid readings, {report['bad_dates']} rows with unreadable dates, "
+        f"{report['duplicates']} duplicate readings skipped)"
+    )
+
 # Load Watsonx credentials
 try:
-    credentials = {
-        "url": st.secrets["WATSONX_URL"],
-        "apikey": st.secrets["WATSONX_APIKEY"]
-    }
-    project_id = st.secrets["WATSONX_PROJECT_ID"]
-
-    # Update deprecated model ID to the new one
-    model_map = {
-        "chat": "ibm/granite-3-3-8b-instruct",
-        "symptoms": "ibm/granite-3-3-8b-instruct",
-        "treatment": "ibm/granite-3-3-8b-instruct",
-        "diseases": "ibm/granite-3-3-8b-instruct",
-        "reports": "ibm/granite-3-3-8b-instruct"
+    # Model ids and generation parameters are shared with batch_reports.py
+    model_map = MODEL_MAP
+
+    # Default per-task timeouts in seconds (override with LLM_TIMEOUT_<TASK>)
+    LLM_TIMEOUTS = {
+        "chat": 30,
+        "symptoms": 45,
+        "treatment": 60,
+        "diseases": 30,
+        "reports": 60,
     }
 
-    def get_llm(model_name):
-        return WatsonxLLM(
-            model_id=model_map[model_name],
-            url=credentials.get("url"),
-            apikey=credentials.get("apikey"),
-            project_id=project_id,
-            params={
-                GenParams.DECODING_METHOD: "greedy",
-                GenParams.TEMPERATURE: 1.2,
-                GenParams.MIN_NEW_TOKENS: 5,
-                GenParams.MAX_NEW_TOKENS: 300,
-                GenParams.STOP_SEQUENCES: ["Human:", "Observation"],
-            },
+    if LLM_BACKEND == "mock":
+        # Local deterministic stand-in; no network or credentials needed
+        @st.cache_resource
+        def get_client_pool():
+            return MockBackend(
+                model_map,
+                latency_ms_median=float(get_setting("MOCK_LATENCY_MS_MEDIAN", 400)),
+                latency_ms_p95=float(get_setting("MOCK_LATENCY_MS_P95", 1200)),
+                tokens_per_second=float(get_setting("MOCK_TOKENS_PER_SECOND", 40)),
+                error_rate=float(get_setting("MOCK_ERROR_RATE", 0.0)),
+                seed=get_setting("MOCK_SEED"),
+            )
+    else:
+        credentials = {
+            "url": st.secrets["WATSONX_URL"],
+            "apikey": st.secrets["WATSONX_APIKEY"]
+        }
+        project_id = st.secrets["WATSONX_PROJECT_ID"]
+
+        # One client pool per server process, warmed on the first script run
+        @st.cache_resource
+        def get_client_pool():
+            pool = ClientPool(credentials, project_id, model_map)
+            pool.warm(model_map.keys(), DEFAULT_GEN_PARAMS)
+            return pool
+
+    # Persistent response cache and rate limiter in front of the pool
+    @st.cache_resource
+    def get_model_service():
+        cache = ResponseCache(
+            get_setting("LLM_CACHE_PATH", ".cache/llm_responses.sqlite3"),
+            ttl=int(get_setting("LLM_CACHE_TTL", 86400)),
+            max_entries=int(get_setting("LLM_CACHE_MAX_ENTRIES", 5000)),
+        )
+        # Shared Watsonx budget across every session in this process
+        rate_limiter = RateLimiter(
+            requests_per_second=float(get_setting("LLM_RATE_RPS", 2)),
+            tokens_per_minute=float(get_setting("LLM_RATE_TPM", 60000)),
+            max_queue=int(get_setting("LLM_QUEUE_MAX", 50)),
+            max_wait=float(get_setting("LLM_QUEUE_MAX_WAIT", 20)),
+        )
+        # Per-task timeouts, retries on transient errors and a shared circuit breaker
+        resilience = ResiliencePolicy(
+            timeouts={task: float(get_setting(f"LLM_TIMEOUT_{task.upper()}", default)) for task, default in LLM_TIMEOUTS.items()},
+            max_retries=int(get_setting("LLM_MAX_RETRIES", 2)),
+            base_delay=float(get_setting("LLM_RETRY_BASE_DELAY", 0.5)),
+            breaker=CircuitBreaker(
+                failure_threshold=int(get_setting("LLM_BREAKER_THRESHOLD", 5)),
+                reset_timeout=float(get_setting("LLM_BREAKER_RESET", 30)),
+            ),
+        )
+        return ModelService(
+            get_client_pool(), DEFAULT_GEN_PARAMS, cache=cache, rate_limiter=rate_limiter, resilience=resilience
+        )
+
+    def invoke_llm(model_name, prompt, use_cache=True):
+        return get_model_service().invoke(
+            model_name, prompt, use_cache=use_cache, session_id=st.session_state.session_id
+        )
+
+    # Token streaming for the long-form pages (disable with LLM_STREAMING = false)
+    STREAMING_ENABLED = str(get_setting("LLM_STREAMING", True)).lower() not in ("false", "0", "no")
+
+    def stream_llm(model_name, prompt, placeholder, wrap=None, use_cache=True):
+        """
+        Render a model response into a placeholder as tokens arrive.
+        :param placeholder: Streamlit container from st.empty().
+        :param wrap: (callable) Optional HTML wrapper applied to the partial text.
+        :return: (str) The complete response.
+        """
+        service = get_model_service()
+        if not STREAMING_ENABLED:
+            text = service.invoke(model_name, prompt, use_cache=use_cache, session_id=st.session_state.session_id)
+            placeholder.markdown(wrap(text) if wrap else text, unsafe_allow_html=bool(wrap))
+            return text
+
+        text = ""
+        for chunk in service.stream(model_name, prompt, use_cache=use_cache, session_id=st.session_state.session_id):
+            text += chunk
+            placeholder.markdown(wrap(text) if wrap else text, unsafe_allow_html=bool(wrap))
+        return text
+
+    # Background jobs for the long generations so the page never blocks on them
+    JOB_POLL_SECONDS = float(get_setting("JOB_POLL_SECONDS", 1))
+
+    @st.cache_resource
+    def get_job_manager():
+        return JobManager(
+            max_workers=int(get_setting("JOB_WORKERS", 4)),
+            retention_seconds=int(get_setting("JOB_RETENTION_SECONDS", 3600)),
         )
-except KeyError:
-    st.warning("⚠️ Watsonx credentials missing.")
+
+    def submit_generation(model_name, prompt, fallback, validate=None):
+        """
+        Start a generation as this session's background job for `model_name`.
+        :param fallback: (str) Stored when the model returns nothing usable.
+        :param validate: (callable) Optional check on the final text; failing text is replaced by `fallback`.
+        :return: (Job) The submitted (or already running identical) job.
+        """
+        session_id = st.session_state.session_id
+        service = get_model_service()
+
+        def generate(job):
+            if STREAMING_ENABLED:
+                for chunk in service.stream(model_name, prompt, session_id=session_id):
+                    job.partial += chunk
+                text = job.partial.strip()
+            else:
+                text = service.invoke(model_name, prompt, session_id=session_id).strip()
+            return text if text and (validate is None or validate(text)) else fallback
+
+        return get_job_manager().submit(session_id, model_name, generate, signature=prompt)
+
+    def poll_generation(model_name):
+        """Fragment body: show live progress and trigger a full rerun once the job ends."""
+        job = get_job_manager().get(st.session_state.session_id, model_name)
+        if job is None or not job.active:
+            st.rerun()
+        st.info(f"⏳ {'Generating' if job.status == 'running' else 'Queued'}... {job.elapsed():.0f}s")
+        if job.partial:
+            st.markdown(job.partial)
+
+    def show_generation(model_name, result_key, heading, error_message):
+        """
+        Render this session's job for `model_name`: live progress while it runs,
+        then the stored result from st.session_state[result_key].
+        """
+        job = get_job_manager().get(st.session_state.session_id, model_name)
+        if job is not None and job.active:
+            st.markdown(heading)
+            st.fragment(poll_generation, run_every=JOB_POLL_SECONDS)(model_name)
+            return
+
+        # Collect a finished job exactly once
+        if job is not None and st.session_state.get(f"{result_key}_job_id") != job.id:
+            st.session_state[f"{result_key}_job_id"] = job.id
+            if job.status == "failed":
+                st.error(f"{error_message}: {job.error}")
+                return
+            st.session_state[result_key] = job.result
+            record_submission(model_name, job.signature)
+
+        if result_key in st.session_state:
+            st.markdown(heading)
+            st.markdown(st.session_state[result_key])
+except (KeyError, FileNotFoundError):
+    st.warning("⚠️ Watsonx credentials missing. Set LLM_BACKEND = \"mock\" to run offline.")
     st.stop()
 except Exception as e:
     st.error(f"🚨 Error initializing LLM: {str(e)}")
@@ -229,79 +790,33 @@ LANGUAGES = {
 }
 
 # Function to export data as PDF including user profile
+@st.cache_resource
+def get_report_cache():
+    return ReportCache()
+
+@st.cache_resource
+def get_chart_cache():
+    return ChartCache(get_setting("CHART_CACHE_DIR", ".cache/charts"))
+
 def export_health_report(ai_summary=None):
     """
-    Generate a PDF health report with analytics data and AI summary.
+    Prepare the PDF health report download. Only a small content snapshot is
+    taken here; the PDF is rendered when the download is requested (on the
+    server's request thread) and cached by the snapshot's hash, so an
+    unchanged report is served without rendering again. Trend charts come
+    from the chart cache, which redraws only charts whose data changed.
     :param ai_summary: (str) AI-generated health summary (optional).
-    :return: (bytes) PDF file content in bytes.
+    :return: (callable) Returns the PDF file content in bytes.
     """
-    # Initialize PDF object
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.set_font("Arial", size=12)
-    
-    # Add Title
-    pdf.set_font("Arial", style="B", size=16)
-    pdf.cell(0, 10, "HealthAI Report", ln=True, align="C")
-    pdf.ln(10)
-    
-    # Add Date
-    pdf.set_font("Arial", size=12)
-    pdf.cell(0, 10, f"Report Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", ln=True)
-    pdf.ln(5)
-    
-    # Add Profile Data (if available)
-    if "profile_data" in st.session_state and st.session_state.profile_complete:
-        profile_data = st.session_state.profile_data
-        pdf.set_font("Arial", style="B", size=14)
-        pdf.cell(0, 10, "Patient Profile", ln=True)
-        pdf.set_font("Arial", size=12)
-        pdf.cell(0, 10, f"Age: {profile_data.get('age', 'N/A')}", ln=True)
-        pdf.cell(0, 10, f"Gender: {profile_data.get('gender', 'N/A')}", ln=True)
-        pdf.cell(0, 10, f"Comorbidities: {profile_data.get('comorbidities', 'N/A')}", ln=True)
-        pdf.ln(5)
-    
-    # Add Latest Metrics
-    analytics_data = st.session_state.analytics_data
-    dates = analytics_data.get("dates", [])
-    heart_rates = analytics_data.get("heart_rates", [])
-    glucose_levels = analytics_data.get("glucose_levels", [])
-    bp_systolic = analytics_data.get("blood_pressure_systolic", [])
-    bp_diastolic = analytics_data.get("blood_pressure_diastolic", [])
-    peak_flow = analytics_data.get("peak_flow", [])
-    hba1c = analytics_data.get("hba1c", [])
-    
-    latest_date = dates[-1] if len(dates) > 0 else "N/A"
-    latest_hr = heart_rates[-1] if len(heart_rates) > 0 and isinstance(heart_rates[-1], (int, float)) else "N/A"
-    latest_glucose = glucose_levels[-1] if len(glucose_levels) > 0 and isinstance(glucose_levels[-1], (int, float)) else "N/A"
-    latest_peak = peak_flow[-1] if len(peak_flow) > 0 and isinstance(peak_flow[-1], (int, float)) else "N/A"
-    latest_hba1c = hba1c[-1] if len(hba1c) > 0 and isinstance(hba1c[-1], (int, float)) else "N/A"
-    
-    pdf.set_font("Arial", style="B", size=14)
-    pdf.cell(0, 10, "Latest Health Metrics", ln=True)
-    pdf.set_font("Arial", size=12)
-    pdf.cell(0, 10, f"Date: {latest_date}", ln=True)
-    pdf.cell(0, 10, f"Heart Rate: {latest_hr} bpm", ln=True)
-    pdf.cell(0, 10, f"Blood Glucose: {latest_glucose} mg/dL", ln=True)
-    pdf.cell(0, 10, f"Peak Flow: {latest_peak} L/min", ln=True)
-    pdf.cell(0, 10, f"HbA1c: {latest_hba1c} %", ln=True)
-    pdf.ln(5)
-    
-    # Add AI Summary (if available)
-    if ai_summary:
-        pdf.set_font("Arial", style="B", size=14)
-        pdf.cell(0, 10, "AI-Driven Health Summary", ln=True)
-        pdf.set_font("Arial", size=12)
-        pdf.multi_cell(0, 10, ai_summary)
-        pdf.ln(5)
-    
-    # Add Footer
-    pdf.set_font("Arial", size=10)
-    pdf.cell(0, 10, "This report is generated by HealthAI. For more details, consult your healthcare provider.", ln=True)
-    
-    # Return PDF as bytes
-    return pdf.output(dest="S").encode("latin-1")
+    profile = st.session_state.profile_data if st.session_state.profile_complete else None
+    store = get_metric_store()
+    range_results = get_range_results()
+    charts = chart_specs(store, range_results)
+    content = report_content(profile, store, range_results, ai_summary, charts)
+    key = content_key(content)
+    report_cache = get_report_cache()
+    chart_cache = get_chart_cache()
+    return lambda: report_cache.get(key, lambda: render_pdf(content, chart_cache.paths(charts)))
 
 # Pages
 if page == "Profile":
@@ -343,6 +858,7 @@ if page == "Profile":
                 "medical_history": medical_history
             }
             st.session_state.profile_complete = True
+            get_health_db().save_profile(st.session_state.user_id, st.session_state.profile_data)
             st.success("✅ Profile saved successfully!")
     
     # Reset Profile Button
@@ -380,91 +896,113 @@ elif page == "Chat":
     </p>
     """, unsafe_allow_html=True)
 
-    # Initialize chat history
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-
-    # Display chat messages
-    st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-    for role, message in st.session_state.messages:
-        if role == "user":
-            st.markdown(f'<div class="user-bubble"><strong>You:</strong><br>{message}</div>', unsafe_allow_html=True)
-        elif role == "assistant":
-            st.markdown(f'<div class="bot-bubble"><strong>Assistant:</strong><br>{message}</div>', unsafe_allow_html=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-
-    # Input area
-    st.markdown('<div class="input-container">', unsafe_allow_html=True)
-    user_input = st.text_input("Ask your question here:", placeholder="Type your query...", key="chat_input")
-    col1, col2 = st.columns([1, 6])
-
-    with col1:
-        send_button = st.button("Send", key="send_message")
-    with col2:
-        clear_button = st.button("Clear Chat", key="clear_chat")
-
-    st.markdown('</div>', unsafe_allow_html=True)
-
-    # Handle Send Button
-    if send_button and user_input.strip():
-        st.session_state.messages.append(("user", user_input))
-
-        try:
-            llm = get_llm("chat")
-            profile_info = json.dumps(st.session_state.profile_data) if st.session_state.profile_complete else "{}"
-
-            prompt = f"""
-You are a professional medical assistant AI creating a personalized, phase-wise treatment plan.
-Your goal is to provide a comprehensive, easy-to-follow guide tailored to the patient’s condition and background.
+    # The whole chat is one fragment: sending, paging and clearing rerun just the chat
+    def load_earlier_messages():
+        st.session_state.chat_window += CHAT_PAGE_SIZE
+    
+    @st.fragment(key="chat")
+    def chat():
+        """Transcript, input and export; the transcript is drawn last so it shows this run's changes."""
+        transcript_area = st.container()
+        
+        # Input area
+        st.markdown('<div class="input-container">', unsafe_allow_html=True)
+        user_input = st.text_input("Ask your question here:", placeholder="Type your query...", key="chat_input")
+        col1, col2 = st.columns([1, 6])
+        
+        with col1:
+            send_button = st.button("Send", key="send_message")
+        with col2:
+            clear_button = st.button("Clear Chat", key="clear_chat")
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Handle Send Button
+        if send_button and user_input.strip() and not is_duplicate_submission("chat", user_input):
+            try:
+                profile_info = json.dumps(st.session_state.profile_data) if st.session_state.profile_complete else "{}"
+                
+                # Fold turns that fell out of the recent window into the rolling summary
+                memory = st.session_state.chat_memory
+                memory.fold(lambda summary, turns: invoke_llm("chat", build_summary_prompt(summary, turns)))
+                
+                prompt = f"""
+You are a professional, empathetic medical assistant AI answering a patient's health questions.
 Guidelines:
 - Always state that this is not a substitute for professional medical advice.
 - Be empathetic and prioritize patient safety.
-- Include practical, realistic steps that the patient can implement.
+- Give practical, realistic steps that the patient can implement.
+- Use the earlier conversation for context and do not repeat previous answers verbatim.
 
 Patient Profile: {profile_info}
 
-Provide a detailed, phase-wise treatment plan including:
-### Phase 1: Immediate Actions
-- Specific medications (dosages and frequency).
-- Lifestyle modifications (diet, rest, activity).
-
-### Phase 2: Short-Term Goals (1-2 weeks)
-- Follow-up care recommendations.
-- Monitoring parameters (what to track daily or weekly).
-
-### Phase 3: Long-Term Management (Beyond 2 weeks)
-- Sustained lifestyle changes.
-- Potential complications to monitor.
-- Tips for managing flare-ups or setbacks.
+{memory.build_context()}
 
-Format your response clearly using markdown headers and bullet points.
-Answer:
+Human: {user_input}
+Assistant:
 """
-
-            with st.spinner("🧠 Generating response..."):
-                response = llm.invoke(prompt).strip() or "I'm unable to respond at this time."
-
-            st.session_state.messages.append(("assistant", response))
-            st.rerun()
-
-        except Exception as e:
-            st.error(f"🚨 Error generating response: {str(e)}")
-
-    # Clear chat button
-    if clear_button:
-        st.session_state.messages = []
-        st.success("Chat history cleared successfully!")
-
-    # Export chat log
-    if st.session_state.messages:
-        chat_log = "\n".join([f"{role.capitalize()}: {msg}" for role, msg in st.session_state.messages])
-        st.download_button(
-            label="Export Chat Log",
-            data=chat_log,
-            file_name="chat_log.txt",
-            mime="text/plain"
-        )
-
+                
+                response_area = st.empty()
+                response = stream_llm(
+                    "chat",
+                    prompt,
+                    response_area,
+                    wrap=lambda text: f'<div class="bot-bubble"><strong>Assistant:</strong><br>{text}</div>',
+                ).strip() or "I'm unable to respond at this time."
+                # The reply joins the transcript below instead of staying under the input
+                response_area.empty()
+                
+                # The question is stored together with its reply, so a failed send can be retried
+                # without leaving a second copy of it in the history
+                db = get_health_db()
+                for role, content in (("user", user_input), ("assistant", response)):
+                    st.session_state.messages.append((db.add_message(st.session_state.user_id, role, content), role, content))
+                # Only the recent transcript stays in memory; the full history is in the database
+                del st.session_state.messages[:-CHAT_HISTORY_LIMIT]
+                memory.add("user", user_input)
+                memory.add("assistant", response)
+                record_submission("chat", user_input)
+            
+            except ModelUnavailableError as e:
+                # Nothing was saved, so the same question can be sent again once the model is back
+                st.warning(str(e))
+            except Exception as e:
+                st.error(f"🚨 Error generating response: {str(e)}")
+        
+        # Clear chat button
+        if clear_button:
+            st.session_state.messages = []
+            st.session_state.chat_memory.clear()
+            reset_chat_view()
+            get_health_db().clear(st.session_state.user_id, ("messages",))
+            st.success("Chat history cleared successfully!")
+        
+        # Display the newest chat messages; older pages load on request
+        with transcript_area:
+            transcript, has_earlier = chat_transcript(st.session_state.chat_window)
+            if has_earlier:
+                st.button("⬆️ Load earlier messages", key="load_earlier", on_click=load_earlier_messages)
+            st.markdown('<div class="chat-container">', unsafe_allow_html=True)
+            # Rebuilt each run to hold only the bubbles on screen, so it never outgrows the window
+            rendered, st.session_state.chat_html = st.session_state.chat_html, {}
+            for message_id, role, message in transcript:
+                html = rendered.get(message_id) or chat_bubble_html(role, message)
+                st.session_state.chat_html[message_id] = html
+                st.markdown(html, unsafe_allow_html=True)
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Export chat log: the full history, read from storage only when downloaded
+        if st.session_state.messages:
+            db, user_id = get_health_db(), st.session_state.user_id
+            st.download_button(
+                label="Export Chat Log",
+                data=lambda: "\n".join(f"{role.capitalize()}: {msg}" for role, msg in db.iter_messages(user_id)),
+                file_name="chat_log.txt",
+                mime="text/plain"
+            )
+    
+    chat()
+    
     st.markdown('</div>', unsafe_allow_html=True)
 
 
@@ -510,7 +1048,6 @@ elif page == "Symptoms":
             st.error("❌ Please enter at least one symptom.")
         else:
             try:
-                llm = get_llm("symptoms")  # Make sure this function exists
                 profile_info = json.dumps(st.session_state.profile_data) if st.session_state.profile_complete else "{}"
 
                 prompt = f"""
@@ -541,18 +1078,19 @@ Please structure your response clearly with the following headings:
 Answer:
                 """
 
-                with st.spinner("🧠 Analyzing symptoms..."):
-                    response = llm.invoke(prompt).strip() or "I'm unable to analyze symptoms at this time."
-
-                st.markdown("### 🧠 Symptom Analysis")
-                st.markdown(response)
-
-                # Save analysis for export
-                st.session_state.symptom_analysis = response
+                # Runs in the background; the result is saved for export when it finishes
+                if not (is_duplicate_submission("symptoms", prompt) and "symptom_analysis" in st.session_state):
+                    submit_generation("symptoms", prompt, "I'm unable to analyze symptoms at this time.")
+                    # Feeds the symptom frequency chart on the Reports page
+                    for symptom in valid_symptoms:
+                        key = symptom.lower()
+                        st.session_state.symptom_counts[key] = st.session_state.symptom_counts.get(key, 0) + 1
 
             except Exception as e:
                 st.error(f"🚨 Error analyzing symptoms: {str(e)}")
 
+    show_generation("symptoms", "symptom_analysis", "### 🧠 Symptom Analysis", "🚨 Error analyzing symptoms")
+
     # Export Analysis Button
     if "symptom_analysis" in st.session_state:
         st.download_button(
@@ -601,7 +1139,6 @@ elif page == "Treatment":
             st.error("❌ Please enter a valid condition.")
         else:
             try:
-                llm = get_llm("treatment")
                 profile_name = st.session_state.profile_data.get("name", "Unknown")
 
                 prompt = f"""
@@ -644,15 +1181,20 @@ Output format:
 Answer:
                 """
 
-                with st.spinner("🧠 Generating treatment plan..."):
-                    response = llm.invoke(prompt).strip() or "I'm unable to generate a treatment plan at this time."
-
-                st.markdown(f"### 🩺 Personalized Treatment Plan for {profile_name}")
-                st.markdown(response)
+                # Runs in the background; the plan is saved for export when it finishes
+                if not (is_duplicate_submission("treatment", prompt) and "treatment_plan" in st.session_state):
+                    submit_generation("treatment", prompt, "I'm unable to generate a treatment plan at this time.")
 
             except Exception as e:
                 st.error(f"🚨 Error generating treatment plan: {str(e)}")
 
+    show_generation(
+        "treatment",
+        "treatment_plan",
+        f"### 🩺 Personalized Treatment Plan for {st.session_state.profile_data.get('name', 'Unknown')}",
+        "🚨 Error generating treatment plan"
+    )
+
     # Export Treatment Plan Button
     if "treatment_plan" in st.session_state:
         st.download_button(
@@ -675,157 +1217,307 @@ elif page == "Diseases":
     </p>
     """, unsafe_allow_html=True)
     
-    # Step 1: Select Condition
-    st.subheader("Step 1: Select Your Condition")
-    condition = st.selectbox(
-        "Condition",
-        ["Diabetes", "Hypertension", "Asthma"],
-        help="Choose the condition you want to manage."
-    )
-    
-    # Step 2: Log Episode Details
-    st.subheader("Step 2: Log Episode Details")
-    
-    if condition == "Diabetes":
-        glucose_level = st.number_input("Glucose Level (mg/dL)", min_value=50, max_value=400, step=1)
-        insulin_dose = st.number_input("Insulin Dose (units)", min_value=0, max_value=100, step=1)
-        episode_date = st.date_input("Date of Episode", value=datetime.today())
+    # Logging, reset and export rerun only this fragment; the chart controls only the nested one
+    @st.fragment(key="disease_log")
+    def disease_log():
+        """Steps 1-4 and the log export, drawn in order so the chart shows a just-logged episode."""
+        # Step 1: Select Condition
+        st.subheader("Step 1: Select Your Condition")
+        condition = st.selectbox(
+            "Condition",
+            ["Diabetes", "Hypertension", "Asthma"],
+            help="Choose the condition you want to manage."
+        )
         
-        if st.button("✅ Log Diabetes Episode"):
-            st.session_state.glucose_log.append({
-                "glucose_level": glucose_level,
-                "insulin_dose": insulin_dose,
-                "date": episode_date.strftime("%Y-%m-%d")
+        # Step 2: Log Episode Details
+        st.subheader("Step 2: Log Episode Details")
+        log_mode = st.radio(
+            "Logging Mode",
+            ["Single Episode", "Batch Back-fill"],
+            horizontal=True,
+            help="Back-fill several readings at once and get one consolidated AI review."
+        )
+        
+        if log_mode == "Batch Back-fill":
+            # Columns per condition: (label, min, max) matching the single-episode inputs
+            batch_columns = {
+                "Diabetes": {
+                    "glucose_level": ("Glucose Level (mg/dL)", 50, 400),
+                    "insulin_dose": ("Insulin Dose (units)", 0, 100),
+                },
+                "Hypertension": {
+                    "systolic": ("Systolic BP", 90, 200),
+                    "diastolic": ("Diastolic BP", 60, 130),
+                },
+                "Asthma": {
+                    "severity": ("Severity (1-10)", 1, 10),
+                    "peak_flow": ("Peak Flow (L/min)", 100, 800),
+                },
+            }[condition]
+            log_key = {"Diabetes": "glucose_log", "Hypertension": "bp_log", "Asthma": "asthma_log"}[condition]
+            
+            # One row per day for the past week; rows can be added or removed
+            batch_template = pd.DataFrame({
+                "date": [datetime.today().date() - timedelta(days=offset) for offset in range(6, -1, -1)],
+                **{column: pd.Series([None] * 7, dtype="float") for column in batch_columns},
             })
-            st.success(f"✅ Logged: Glucose {glucose_level} mg/dL, Insulin {insulin_dose} units on {episode_date.strftime('%Y-%m-%d')}")
+            if condition == "Asthma":
+                batch_template["triggers"] = ""
             
-            # Generate AI Health Advice
-            prompt = f"""
-            My glucose level is {glucose_level} mg/dL. I took {insulin_dose} units of insulin.
-            What does this mean? How should I adjust my insulin or diet?
-            Patient Profile: {json.dumps(st.session_state.profile_data)}
-            """
+            column_config = {"date": st.column_config.DateColumn("Date", required=True)}
+            for column, (label, min_value, max_value) in batch_columns.items():
+                column_config[column] = st.column_config.NumberColumn(label, min_value=min_value, max_value=max_value, step=1)
+            if condition == "Asthma":
+                column_config["triggers"] = st.column_config.TextColumn("Triggers")
             
-            try:
-                llm = get_llm("diseases")
-                advice = llm.invoke(prompt).strip()
-                st.markdown(f"🧠 **AI Health Advice:** {advice}")
-            except Exception as e:
-                st.error(f"🚨 Error generating health advice: {str(e)}")
-    
-    elif condition == "Hypertension":
-        systolic = st.number_input("Systolic BP", min_value=90, max_value=200, step=1)
-        diastolic = st.number_input("Diastolic BP", min_value=60, max_value=130, step=1)
-        episode_date = st.date_input("Date of Episode", value=datetime.today())
-        
-        if st.button("✅ Log Hypertension Episode"):
-            st.session_state.bp_log.append({
-                "systolic": systolic,
-                "diastolic": diastolic,
-                "date": episode_date.strftime("%Y-%m-%d")
-            })
-            st.success(f"✅ Logged: {systolic}/{diastolic} mmHg on {episode_date.strftime('%Y-%m-%d')}")
+            batch_df = st.data_editor(
+                batch_template,
+                num_rows="dynamic",
+                column_config=column_config,
+                hide_index=True,
+                key=f"batch_editor_{condition}"
+            )
             
-            # Generate AI Health Advice
-            prompt = f"""
-            My blood pressure is {systolic}/{diastolic} mmHg. What does that mean?
-            Patient Profile: {json.dumps(st.session_state.profile_data)}
-            """
+            if st.button(f"✅ Log {condition} Readings", key="log_batch"):
+                complete_rows = batch_df.dropna(subset=["date", *batch_columns])
+                
+                if complete_rows.empty:
+                    st.error("❌ Please enter at least one complete reading.")
+                else:
+                    records = []
+                    for row in complete_rows.itertuples(index=False):
+                        record = {column: int(getattr(row, column)) for column in batch_columns}
+                        if condition == "Asthma":
+                            record["triggers"] = row.triggers or ""
+                        record["date"] = pd.Timestamp(row.date).strftime("%Y-%m-%d")
+                        records.append(record)
+                    records.sort(key=lambda record: record["date"])
+                    log_episodes(log_key, records)
+                    st.success(f"✅ Logged {len(records)} {condition.lower()} readings from {records[0]['date']} to {records[-1]['date']}")
+                    
+                    # One consolidated AI review for the whole batch instead of one call per reading
+                    if condition == "Diabetes":
+                        reading_lines = [f"{r['date']}: glucose {r['glucose_level']} mg/dL, insulin {r['insulin_dose']} units" for r in records]
+                    elif condition == "Hypertension":
+                        reading_lines = [f"{r['date']}: {r['systolic']}/{r['diastolic']} mmHg" for r in records]
+                    else:
+                        reading_lines = [f"{r['date']}: severity {r['severity']}, peak flow {r['peak_flow']} L/min, triggers: {r['triggers'] or 'none'}" for r in records]
+                    
+                    # Keep the prompt bounded for very long back-fills
+                    summary_lines = []
+                    for column, (label, _, _) in batch_columns.items():
+                        values = [r[column] for r in records]
+                        summary_lines.append(f"{label}: min {min(values)}, max {max(values)}, average {round(sum(values) / len(values), 1)}")
+                    recent_lines = reading_lines[-30:]
+                    
+                    prompt = f"""
+                I logged {len(records)} {condition.lower()} readings between {records[0]['date']} and {records[-1]['date']}.
+                Summary: {'; '.join(summary_lines)}
+                Most recent readings:
+                {chr(10).join(recent_lines)}
+                Review these readings together. What patterns do you see, what do they mean, and what should I adjust?
+                Patient Profile: {json.dumps(st.session_state.profile_data)}
+                """
+                    
+                    try:
+                        with st.spinner("🧠 Reviewing your readings..."):
+                            advice = invoke_llm("diseases", prompt).strip()
+                        st.markdown(f"🧠 **AI Health Advice:** {advice}")
+                    except ModelUnavailableError as e:
+                        st.warning(str(e))
+                    except Exception as e:
+                        st.error(f"🚨 Error generating health advice: {str(e)}")
             
-            try:
-                llm = get_llm("diseases")
-                advice = llm.invoke(prompt).strip()
-                st.markdown(f"🧠 **AI Health Advice:** {advice}")
-            except Exception as e:
-                st.error(f"🚨 Error generating health advice: {str(e)}")
-    
-    elif condition == "Asthma":
-        triggers = st.text_area("Triggers Today (e.g., pollen, dust, exercise)")
-        severity = st.slider("Severity (1-10)", 1, 10, key="severity_slider")
-        peak_flow = st.number_input("Peak Flow (L/min)", min_value=100, max_value=800, step=1)
-        episode_date = st.date_input("Date of Episode", value=datetime.today())
+            # Device exports go straight to the database without an AI review
+            episodes_file = st.file_uploader(
+                f"Or import {condition.lower()} readings from a device export (CSV, JSON or JSON Lines)",
+                type=["csv", "json", "jsonl"],
+                key=f"episodes_file_{condition}"
+            )
+            if episodes_file is not None and st.button(f"📥 Import {condition} Readings", key="import_episodes"):
+                try:
+                    with st.spinner("Importing readings..."):
+                        show_import_report(import_episode_file(episodes_file, log_key, batch_columns))
+                except ValueError as e:
+                    st.error(f"❌ {str(e)}")
         
-        if st.button("✅ Log Asthma Episode"):
-            st.session_state.asthma_log.append({
-                "triggers": triggers,
-                "severity": severity,
-                "peak_flow": peak_flow,
-                "date": episode_date.strftime("%Y-%m-%d")
-            })
-            st.success(f"✅ Episode logged on {episode_date.strftime('%Y-%m-%d')}")
+        elif condition == "Diabetes":
+            glucose_level = st.number_input("Glucose Level (mg/dL)", min_value=50, max_value=400, step=1)
+            insulin_dose = st.number_input("Insulin Dose (units)", min_value=0, max_value=100, step=1)
+            episode_date = st.date_input("Date of Episode", value=datetime.today())
             
-            # Generate AI Health Advice
-            prompt = f"""
-            What are some ways to avoid asthma triggers like '{triggers}'?
-            How can I manage severity level {severity} episodes?
-            Patient Profile: {json.dumps(st.session_state.profile_data)}
-            """
+            if st.button("✅ Log Diabetes Episode"):
+                log_episodes("glucose_log", [{
+                    "glucose_level": glucose_level,
+                    "insulin_dose": insulin_dose,
+                    "date": episode_date.strftime("%Y-%m-%d")
+                }])
+                st.success(f"✅ Logged: Glucose {glucose_level} mg/dL, Insulin {insulin_dose} units on {episode_date.strftime('%Y-%m-%d')}")
+                
+                # Generate AI Health Advice
+                prompt = f"""
+                My glucose level is {glucose_level} mg/dL. I took {insulin_dose} units of insulin.
+                What does this mean? How should I adjust my insulin or diet?
+                Patient Profile: {json.dumps(st.session_state.profile_data)}
+                """
+                
+                try:
+                    advice = invoke_llm("diseases", prompt).strip()
+                    st.markdown(f"🧠 **AI Health Advice:** {advice}")
+                except ModelUnavailableError as e:
+                    st.warning(str(e))
+                except Exception as e:
+                    st.error(f"🚨 Error generating health advice: {str(e)}")
+        
+        elif condition == "Hypertension":
+            systolic = st.number_input("Systolic BP", min_value=90, max_value=200, step=1)
+            diastolic = st.number_input("Diastolic BP", min_value=60, max_value=130, step=1)
+            episode_date = st.date_input("Date of Episode", value=datetime.today())
             
-            try:
-                llm = get_llm("diseases")
-                advice = llm.invoke(prompt).strip()
-                st.markdown(f"🧠 **AI Health Advice:** {advice}")
-            except Exception as e:
-                st.error(f"🚨 Error generating health advice: {str(e)}")
-    
-    # Step 3: Historical Data Visualization
-    st.subheader("Step 3: Historical Data Visualization")
-    visualization_type = st.selectbox("Select Metric to Visualize", ["Glucose Levels", "Blood Pressure", "Peak Flow"])
-    
-    if visualization_type == "Glucose Levels" and st.session_state.glucose_log:
-        df_gluc = pd.DataFrame(st.session_state.glucose_log)
-        fig = px.line(df_gluc, x='date', y='glucose_level', title='Glucose Levels Over Time')
-        fig.update_layout(yaxis_title="Glucose (mg/dL)", xaxis_title="Date")
-        st.plotly_chart(fig, use_container_width=True)
-    
-    elif visualization_type == "Blood Pressure" and st.session_state.bp_log:
-        df_bp = pd.DataFrame(st.session_state.bp_log)
-        fig = px.line(df_bp, x='date', y=['systolic', 'diastolic'], title='Blood Pressure Over Time')
-        fig.update_layout(yaxis_title="Pressure (mmHg)", xaxis_title="Date")
-        st.plotly_chart(fig, use_container_width=True)
-    
-    elif visualization_type == "Peak Flow" and st.session_state.asthma_log:
-        df_asthma = pd.DataFrame(st.session_state.asthma_log)
-        fig = px.line(df_asthma, x='date', y='peak_flow', title='Peak Flow Over Time')
-        fig.update_layout(yaxis_title="Peak Flow (L/min)", xaxis_title="Date")
-        st.plotly_chart(fig, use_container_width=True)
-    
-    # Step 4: Reset Logs
-    st.subheader("Step 4: Reset Logged Episodes")
-    if st.button("🔄 Reset All Logs", key="reset_logs"):
-        st.session_state.glucose_log = []
-        st.session_state.bp_log = []
-        st.session_state.asthma_log = []
-        st.success("All logs have been reset.")
-    
-    # Export Logs Button
-    if st.session_state.glucose_log or st.session_state.bp_log or st.session_state.asthma_log:
-        logs_data = ""
+            if st.button("✅ Log Hypertension Episode"):
+                log_episodes("bp_log", [{
+                    "systolic": systolic,
+                    "diastolic": diastolic,
+                    "date": episode_date.strftime("%Y-%m-%d")
+                }])
+                st.success(f"✅ Logged: {systolic}/{diastolic} mmHg on {episode_date.strftime('%Y-%m-%d')}")
+                
+                # Generate AI Health Advice
+                prompt = f"""
+                My blood pressure is {systolic}/{diastolic} mmHg. What does that mean?
+                Patient Profile: {json.dumps(st.session_state.profile_data)}
+                """
+                
+                try:
+                    advice = invoke_llm("diseases", prompt).strip()
+                    st.markdown(f"🧠 **AI Health Advice:** {advice}")
+                except ModelUnavailableError as e:
+                    st.warning(str(e))
+                except Exception as e:
+                    st.error(f"🚨 Error generating health advice: {str(e)}")
         
-        if st.session_state.glucose_log:
-            logs_data += "Glucose Logs:\n" + "\n".join([
-                f"{log['date']}: {log['glucose_level']} mg/dL, Insulin {log['insulin_dose']} units"
-                for log in st.session_state.glucose_log
-            ]) + "\n"
+        elif condition == "Asthma":
+            triggers = st.text_area("Triggers Today (e.g., pollen, dust, exercise)")
+            severity = st.slider("Severity (1-10)", 1, 10, key="severity_slider")
+            peak_flow = st.number_input("Peak Flow (L/min)", min_value=100, max_value=800, step=1)
+            episode_date = st.date_input("Date of Episode", value=datetime.today())
+            
+            if st.button("✅ Log Asthma Episode"):
+                log_episodes("asthma_log", [{
+                    "triggers": triggers,
+                    "severity": severity,
+                    "peak_flow": peak_flow,
+                    "date": episode_date.strftime("%Y-%m-%d")
+                }])
+                st.success(f"✅ Episode logged on {episode_date.strftime('%Y-%m-%d')}")
+                
+                # Generate AI Health Advice
+                prompt = f"""
+                What are some ways to avoid asthma triggers like '{triggers}'?
+                How can I manage severity level {severity} episodes?
+                Patient Profile: {json.dumps(st.session_state.profile_data)}
+                """
+                
+                try:
+                    advice = invoke_llm("diseases", prompt).strip()
+                    st.markdown(f"🧠 **AI Health Advice:** {advice}")
+                except ModelUnavailableError as e:
+                    st.warning(str(e))
+                except Exception as e:
+                    st.error(f"🚨 Error generating health advice: {str(e)}")
         
-        if st.session_state.bp_log:
-            logs_data += "Blood Pressure Logs:\n" + "\n".join([
-                f"{log['date']}: {log['systolic']}/{log['diastolic']} mmHg"
-                for log in st.session_state.bp_log
-            ]) + "\n"
+        @st.fragment(key="episode_charts")
+        def episode_charts():
+            """Step 3: chart choice and date range rerun only the chart."""
+            # Step 3: Historical Data Visualization
+            st.subheader("Step 3: Historical Data Visualization")
+            visualization_type = st.selectbox("Select Metric to Visualize", ["Glucose Levels", "Blood Pressure", "Peak Flow"])
+            
+            # Chart -> (log, y column(s), title, y-axis title)
+            log_charts = {
+                "Glucose Levels": ("glucose_log", "glucose_level", "Glucose Levels Over Time", "Glucose (mg/dL)"),
+                "Blood Pressure": ("bp_log", ["systolic", "diastolic"], "Blood Pressure Over Time", "Pressure (mmHg)"),
+                "Peak Flow": ("asthma_log", "peak_flow", "Peak Flow Over Time", "Peak Flow (L/min)"),
+            }
+            # Chart -> (metric id, band colour, label) per reference band, as on the Reports page
+            log_bands = {
+                "Glucose Levels": [("glucose_levels", "green", "Normal Glucose Range")],
+                "Blood Pressure": [
+                    ("blood_pressure_systolic", "red", "Normal Systolic Range"),
+                    ("blood_pressure_diastolic", "blue", "Normal Diastolic Range"),
+                ],
+                "Peak Flow": [("peak_flow", "green", "Normal Peak Flow Range")],
+            }
+            chart_log, chart_y, chart_title, y_title = log_charts[visualization_type]
+            range_results = get_range_results()
+            bands = tuple(
+                (range_results[metric].low, range_results[metric].high, color, label)
+                for metric, color, label in log_bands[visualization_type]
+            )
+            log_start, log_end = date_range_selector("diseases")
+            
+            chart_records = range_episode_log(chart_log, log_start)
+            if chart_records:
+                def build_log_figure():
+                    df_log = pd.DataFrame(chart_records)
+                    df_log["date"] = pd.to_datetime(df_log["date"])
+                    if log_start is not None:
+                        df_log = df_log[df_log["date"] >= pd.to_datetime(log_start, unit="s")]
+                    if log_end is not None:
+                        df_log = df_log[df_log["date"] < pd.to_datetime(log_end, unit="s")]
+                    fig = line_chart(df_log, x='date', y=chart_y, title=chart_title)
+                    fig.update_layout(yaxis_title=y_title, xaxis_title="Date")
+                    for low, high, color, label in bands:
+                        fig.add_hrect(y0=low, y1=high, line_width=0, fillcolor=color, opacity=0.15, annotation_text=label)
+                    return fig
+                
+                fig = get_figure(
+                    stored_history_key(chart_log, episode_log_version(chart_log), log_start, log_end, bands),
+                    build_log_figure
+                )
+                st.plotly_chart(fig, use_container_width=True)
         
-        if st.session_state.asthma_log:
-            logs_data += "Asthma Logs:\n" + "\n".join([
-                f"{log['date']}: Triggers - {log['triggers']}, Severity - {log['severity']}, Peak Flow - {log['peak_flow']} L/min"
-                for log in st.session_state.asthma_log
-            ])
+        episode_charts()
         
-        st.download_button(
-            label="Export Logs",
-            data=logs_data,
-            file_name="disease_logs.txt",
-            mime="text/plain"
-        )
+        # Step 4: Reset Logs
+        st.subheader("Step 4: Reset Logged Episodes")
+        if st.button("🔄 Reset All Logs", key="reset_logs"):
+            # The projections are rebuilt from the database, so clear it first
+            get_health_db().clear(st.session_state.user_id, ("episodes",))
+            st.session_state.health_events.discard(EPISODE)
+            st.success("All logs have been reset.")
+        
+        # Export Logs Button
+        glucose_log, bp_log, asthma_log = (episode_log(log) for log in DISEASE_LOGS)
+        if glucose_log or bp_log or asthma_log:
+            logs_data = ""
+            
+            if glucose_log:
+                logs_data += "Glucose Logs:\n" + "\n".join([
+                    f"{log['date']}: {log['glucose_level']} mg/dL, Insulin {log['insulin_dose']} units"
+                    for log in glucose_log
+                ]) + "\n"
+            
+            if bp_log:
+                logs_data += "Blood Pressure Logs:\n" + "\n".join([
+                    f"{log['date']}: {log['systolic']}/{log['diastolic']} mmHg"
+                    for log in bp_log
+                ]) + "\n"
+            
+            if asthma_log:
+                logs_data += "Asthma Logs:\n" + "\n".join([
+                    f"{log['date']}: Triggers - {log['triggers']}, Severity - {log['severity']}, Peak Flow - {log['peak_flow']} L/min"
+                    for log in asthma_log
+                ])
+            
+            st.download_button(
+                label="Export Logs",
+                data=logs_data,
+                file_name="disease_logs.txt",
+                mime="text/plain"
+            )
+    
+    disease_log()
     
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -840,466 +1532,428 @@ elif page == "Reports":
     </p>
     """, unsafe_allow_html=True)
     
-    # Initialize session state analytics data if not exists
-    if "analytics_data" not in st.session_state:
-        st.session_state.analytics_data = {
-            "dates": [datetime.now().strftime("%Y-%m-%d")],
-            "heart_rates": [72],
-            "glucose_levels": [90],
-            "blood_pressure_systolic": [120],
-            "blood_pressure_diastolic": [80],
-            "peak_flow": [400],
-            "hba1c": [5.7],
-            "symptoms": ["Headache", "Fatigue", "Nausea"],
-            "symptom_frequency": [3, 2, 1],  # Example symptom frequencies
-        }
-    
-    # Ensure all lists in analytics_data are of the same length
-    def pad_or_truncate_lists(data_dict):
-        """Ensure all lists in the dictionary are of the same length."""
-        max_length = max(len(lst) for lst in data_dict.values())
-        
-        for key in data_dict:
-            current_length = len(data_dict[key])
-            if current_length < max_length:
-                data_dict[key].extend([None] * (max_length - current_length))
-            elif current_length > max_length:
-                data_dict[key] = data_dict[key][:max_length]
-        
-        return data_dict
-    
-    # Apply padding/truncation to analytics_data
-    st.session_state.analytics_data = pad_or_truncate_lists(st.session_state.analytics_data)
-    
-    # Step 1: Log New Metrics
-    st.subheader("Step 1: Log New Health Metrics")
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        metric_type = st.selectbox(
-            "Select Metric Type",
-            ["Heart Rate", "Blood Glucose", "Blood Pressure", "Peak Flow", "HbA1c"]
+    # Bulk import runs before the store is read so the page shows the new readings
+    with st.expander("📥 Import Readings from a Device Export"):
+        st.caption(
+            "CSV, JSON or JSON Lines with a date column plus either one column per metric "
+            "(e.g. heart_rate, glucose, systolic, diastolic, peak_flow, hba1c) or metric/value columns."
         )
-        
+        metrics_file = st.file_uploader("Device export", type=["csv", "json", "jsonl"], key="metrics_file")
+        if metrics_file is not None and st.button("📥 Import Readings", key="import_metrics"):
+            try:
+                with st.spinner("Importing readings..."):
+                    show_import_report(import_metric_file(metrics_file))
+            except ValueError as e:
+                st.error(f"❌ {str(e)}")
+    
+    # Each section is a fragment: a widget inside one reruns just that section, not the whole script
+    # Sections that read the metric store; logging a reading reruns exactly these
+    METRIC_VIEWS = ["metric_logging", "latest_metrics", "metric_charts", "metrics_summary", "report_export"]
+    
+    def log_metric_entry():
+        """Log the Step 1 inputs (read from their widget keys), then refresh the metric views."""
+        state = st.session_state
+        metric_type, log_date = state.log_metric_type, state.log_date
         if metric_type == "Heart Rate":
-            value = st.number_input("Heart Rate (bpm)", min_value=40, max_value=140, step=1)
+            log_metrics([("heart_rates", log_date, state.log_heart_rates)])
+            state.metric_logged = f"Logged Heart Rate: {state.log_heart_rates} bpm on {log_date.strftime('%Y-%m-%d')}"
         
         elif metric_type == "Blood Glucose":
-            value = st.number_input("Blood Glucose (mg/dL)", min_value=50, max_value=300, step=1)
+            log_metrics([("glucose_levels", log_date, state.log_glucose_levels)])
+            state.metric_logged = f"Logged Blood Glucose: {state.log_glucose_levels} mg/dL on {log_date.strftime('%Y-%m-%d')}"
         
         elif metric_type == "Blood Pressure":
-            systolic = st.number_input("Systolic BP (mmHg)", min_value=90, max_value=200, step=1)
-            diastolic = st.number_input("Diastolic BP (mmHg)", min_value=60, max_value=130, step=1)
+            systolic, diastolic = state.log_blood_pressure_systolic, state.log_blood_pressure_diastolic
+            log_metrics([
+                ("blood_pressure_systolic", log_date, systolic),
+                ("blood_pressure_diastolic", log_date, diastolic),
+            ])
+            state.metric_logged = f"Logged Blood Pressure: {systolic}/{diastolic} mmHg on {log_date.strftime('%Y-%m-%d')}"
         
         elif metric_type == "Peak Flow":
-            value = st.number_input("Peak Flow (L/min)", min_value=100, max_value=800, step=1)
+            log_metrics([("peak_flow", log_date, state.log_peak_flow)])
+            state.metric_logged = f"Logged Peak Flow: {state.log_peak_flow} L/min on {log_date.strftime('%Y-%m-%d')}"
         
         elif metric_type == "HbA1c":
-            value = st.number_input("HbA1c (%)", min_value=4.0, max_value=12.0, step=0.1)
-    
-    with col2:
-        log_date = st.date_input("Log Date", value=datetime.today())
+            log_metrics([("hba1c", log_date, state.log_hba1c)])
+            state.metric_logged = f"Logged HbA1c: {state.log_hba1c}% on {log_date.strftime('%Y-%m-%d')}"
+        st.rerun(METRIC_VIEWS)
+    
+    @st.fragment(key="metric_logging")
+    def metric_logging():
+        """Step 1: the metric inputs rerun only this section."""
+        st.subheader("Step 1: Log New Health Metrics")
+        col1, col2 = st.columns(2)
         
-        if st.button("✅ Log Metric"):
+        with col1:
+            metric_type = st.selectbox(
+                "Select Metric Type",
+                ["Heart Rate", "Blood Glucose", "Blood Pressure", "Peak Flow", "HbA1c"],
+                key="log_metric_type"
+            )
+            
             if metric_type == "Heart Rate":
-                st.session_state.analytics_data["heart_rates"].append(value)
-                st.session_state.analytics_data["dates"].append(log_date.strftime("%Y-%m-%d"))
-                st.success(f"Logged Heart Rate: {value} bpm on {log_date.strftime('%Y-%m-%d')}")
+                st.number_input("Heart Rate (bpm)", *METRIC_INPUT_RANGES["heart_rates"], step=1, key="log_heart_rates")
             
             elif metric_type == "Blood Glucose":
-                st.session_state.analytics_data["glucose_levels"].append(value)
-                st.session_state.analytics_data["dates"].append(log_date.strftime("%Y-%m-%d"))
-                st.success(f"Logged Blood Glucose: {value} mg/dL on {log_date.strftime('%Y-%m-%d')}")
+                st.number_input("Blood Glucose (mg/dL)", *METRIC_INPUT_RANGES["glucose_levels"], step=1, key="log_glucose_levels")
             
             elif metric_type == "Blood Pressure":
-                st.session_state.analytics_data["blood_pressure_systolic"].append(systolic)
-                st.session_state.analytics_data["blood_pressure_diastolic"].append(diastolic)
-                st.session_state.analytics_data["dates"].append(log_date.strftime("%Y-%m-%d"))
-                st.success(f"Logged Blood Pressure: {systolic}/{diastolic} mmHg on {log_date.strftime('%Y-%m-%d')}")
+                st.number_input("Systolic BP (mmHg)", *METRIC_INPUT_RANGES["blood_pressure_systolic"], step=1, key="log_blood_pressure_systolic")
+                st.number_input("Diastolic BP (mmHg)", *METRIC_INPUT_RANGES["blood_pressure_diastolic"], step=1, key="log_blood_pressure_diastolic")
             
             elif metric_type == "Peak Flow":
-                st.session_state.analytics_data["peak_flow"].append(value)
-                st.session_state.analytics_data["dates"].append(log_date.strftime("%Y-%m-%d"))
-                st.success(f"Logged Peak Flow: {value} L/min on {log_date.strftime('%Y-%m-%d')}")
+                st.number_input("Peak Flow (L/min)", *METRIC_INPUT_RANGES["peak_flow"], step=1, key="log_peak_flow")
             
             elif metric_type == "HbA1c":
-                st.session_state.analytics_data["hba1c"].append(value)
-                st.session_state.analytics_data["dates"].append(log_date.strftime("%Y-%m-%d"))
-                st.success(f"Logged HbA1c: {value}% on {log_date.strftime('%Y-%m-%d')}")
-    
-    # Step 2: Display Latest Metrics
-    st.subheader("### 📋 Latest Metrics")
-    
-    dates = st.session_state.analytics_data.get("dates", [])
-    heart_rates = st.session_state.analytics_data.get("heart_rates", [])
-    glucose_levels = st.session_state.analytics_data.get("glucose_levels", [])
-    peak_flow = st.session_state.analytics_data.get("peak_flow", [])
-    hba1c = st.session_state.analytics_data.get("hba1c", [])
-    
-    latest_date = dates[-1] if len(dates) > 0 else "N/A"
-    latest_hr = heart_rates[-1] if len(heart_rates) > 0 and isinstance(heart_rates[-1], (int, float)) else "N/A"
-    latest_glucose = glucose_levels[-1] if len(glucose_levels) > 0 and isinstance(glucose_levels[-1], (int, float)) else "N/A"
-    latest_peak = peak_flow[-1] if len(peak_flow) > 0 and isinstance(peak_flow[-1], (int, float)) else "N/A"
-    latest_hba1c = hba1c[-1] if len(hba1c) > 0 and isinstance(hba1c[-1], (int, float)) else "N/A"
-    
-    st.markdown(f"""
-    <div class="metric-card">
-        <strong>Date:</strong> {latest_date}<br>
-        <strong>Heart Rate:</strong> {latest_hr} bpm<br>
-        <strong>Blood Glucose:</strong> {latest_glucose} mg/dL<br>
-        <strong>Peak Flow:</strong> {latest_peak} L/min<br>
-        <strong>HbA1c:</strong> {latest_hba1c} %
-    </div>
-    """, unsafe_allow_html=True)
-    
-    # Step 3: Trend Analysis
-    st.subheader("### 📈 Trend Analysis")
-    
-    hr_trend = (
-        "↑" if len(heart_rates) > 1 and isinstance(heart_rates[-1], (int, float)) and isinstance(heart_rates[-2], (int, float)) and heart_rates[-1] > heart_rates[-2]
-        else "↓" if len(heart_rates) > 1 and isinstance(heart_rates[-1], (int, float)) and isinstance(heart_rates[-2], (int, float)) and heart_rates[-1] < heart_rates[-2]
-        else "-"
-    )
-    
-    glucose_trend = (
-        "↑" if len(glucose_levels) > 1 and isinstance(glucose_levels[-1], (int, float)) and isinstance(glucose_levels[-2], (int, float)) and glucose_levels[-1] > glucose_levels[-2]
-        else "↓" if len(glucose_levels) > 1 and isinstance(glucose_levels[-1], (int, float)) and isinstance(glucose_levels[-2], (int, float)) and glucose_levels[-1] < glucose_levels[-2]
-        else "-"
-    )
-    
-    peak_trend = (
-        "↑" if len(peak_flow) > 1 and isinstance(peak_flow[-1], (int, float)) and isinstance(peak_flow[-2], (int, float)) and peak_flow[-1] > peak_flow[-2]
-        else "↓" if len(peak_flow) > 1 and isinstance(peak_flow[-1], (int, float)) and isinstance(peak_flow[-2], (int, float)) and peak_flow[-1] < peak_flow[-2]
-        else "-"
-    )
-    
-    hba1c_trend = (
-        "↑" if len(hba1c) > 1 and isinstance(hba1c[-1], (int, float)) and isinstance(hba1c[-2], (int, float)) and hba1c[-1] > hba1c[-2]
-        else "↓" if len(hba1c) > 1 and isinstance(hba1c[-1], (int, float)) and isinstance(hba1c[-2], (int, float)) and hba1c[-1] < hba1c[-2]
-        else "-"
-    )
-    
-    st.markdown(f"""
-    <div class="metric-card">
-        <strong>Heart Rate Trend:</strong> {hr_trend}<br>
-        <strong>Glucose Trend:</strong> {glucose_trend}<br>
-        <strong>Peak Flow Trend:</strong> {peak_trend}<br>
-        <strong>HbA1c Trend:</strong> {hba1c_trend}
-    </div>
-    """, unsafe_allow_html=True)
-    
-    # Step 4: Generate AI-Driven Health Summary
-    st.subheader("Step 4: Generate AI-Driven Health Summary")
+                st.number_input("HbA1c (%)", *METRIC_INPUT_RANGES["hba1c"], step=0.1, key="log_hba1c")
+        
+        with col2:
+            st.date_input("Log Date", value=datetime.today(), key="log_date")
+            st.button("✅ Log Metric", on_click=log_metric_entry)
+            if "metric_logged" in st.session_state:
+                st.success(st.session_state.pop("metric_logged"))
+    
+    metric_logging()
+    
+    @st.fragment(key="latest_metrics")
+    def latest_metrics():
+        """Steps 2 and 3: latest readings and trends."""
+        # Step 2: Display Latest Metrics
+        st.subheader("### 📋 Latest Metrics")
+        
+        store = get_metric_store()
+        latest_date = store.latest_date()
+        latest_hr = store.latest_value("heart_rates")
+        latest_glucose = store.latest_value("glucose_levels")
+        latest_peak = store.latest_value("peak_flow")
+        latest_hba1c = store.latest_value("hba1c")
+        
+        st.markdown(f"""
+        <div class="metric-card">
+            <strong>Date:</strong> {latest_date}<br>
+            <strong>Heart Rate:</strong> {latest_hr} bpm<br>
+            <strong>Blood Glucose:</strong> {latest_glucose} mg/dL<br>
+            <strong>Peak Flow:</strong> {latest_peak} L/min<br>
+            <strong>HbA1c:</strong> {latest_hba1c} %
+        </div>
+        """, unsafe_allow_html=True)
+        
+        # Step 3: Trend Analysis
+        st.subheader("### 📈 Trend Analysis")
+        
+        hr_trend = trend_arrow(store["heart_rates"])
+        glucose_trend = trend_arrow(store["glucose_levels"])
+        peak_trend = trend_arrow(store["peak_flow"])
+        hba1c_trend = trend_arrow(store["hba1c"])
+        
+        st.markdown(f"""
+        <div class="metric-card">
+            <strong>Heart Rate Trend:</strong> {hr_trend} (avg {rolling_average(store["heart_rates"])} bpm)<br>
+            <strong>Glucose Trend:</strong> {glucose_trend} (avg {rolling_average(store["glucose_levels"])} mg/dL)<br>
+            <strong>Peak Flow Trend:</strong> {peak_trend} (avg {rolling_average(store["peak_flow"])} L/min)<br>
+            <strong>HbA1c Trend:</strong> {hba1c_trend} (avg {rolling_average(store["hba1c"])} %)<br>
+            <em>Trends fit the last {TREND_WINDOW} readings; averages cover the same window.</em>
+        </div>
+        """, unsafe_allow_html=True)
     
-    ai_summary = None  # Initialize ai_summary to avoid NameError
+    latest_metrics()
     
-    if st.button("🧠 Generate AI Report Summary"):
-        try:
-            profile_info = json.dumps(st.session_state.profile_data) if st.session_state.profile_complete else "{}"
-            
-            heart_rates = st.session_state.analytics_data.get("heart_rates", [])
-            glucose_levels = st.session_state.analytics_data.get("glucose_levels", [])
-            peak_flow = st.session_state.analytics_data.get("peak_flow", [])
-            hba1c = st.session_state.analytics_data.get("hba1c", [])
-            
-            recent_hr = ', '.join(map(str, [x for x in heart_rates[-7:] if isinstance(x, (int, float))]))
-            recent_glucose = ', '.join(map(str, [x for x in glucose_levels[-7:] if isinstance(x, (int, float))]))
-            recent_peak = ', '.join(map(str, [x for x in peak_flow[-7:] if isinstance(x, (int, float))]))
-            recent_hba1c = ', '.join(map(str, [x for x in hba1c[-7:] if isinstance(x, (int, float))]))
-            
-            prompt = f"""
-            You are a professional healthcare AI assistant tasked with providing a personalized health summary.
-            
-            Patient Profile: {profile_info}
-            Recent Metrics:
-            - Heart Rate (bpm): [{recent_hr}]
-            - Blood Glucose (mg/dL): [{recent_glucose}]
-            - Peak Flow (L/min): [{recent_peak}]
-            - HbA1c (%): [{recent_hba1c}]
-            
-            Instructions:
-            1. Analyze trends over time and note if values are increasing, decreasing, or stable.
-            2. Interpret what these trends may mean in terms of health implications.
-            3. Provide simple, easy-to-understand explanations without medical jargon.
-            4. Suggest practical lifestyle changes (e.g., diet, exercise).
-            5. Mention when a medical checkup is recommended.
-            
-            Output format:
-            ### 🔍 Trend Overview
-            - Heart Rate: [Stable/Increasing/Decreasing]
-            - Blood Glucose: [Stable/Increasing/Decreasing]
-            - Peak Flow: [Stable/Increasing/Decreasing]
-            - HbA1c: [Stable/Increasing/Decreasing]
-            
-            ### 🩺 Health Implications
-            Explain what the trend might indicate about the patient's current condition.
-            
-            ### 💡 Recommendations
-            Provide 2-3 lifestyle suggestions tailored to the patient's data.
-            
-            ### ⚠️ Important Notes
-            Include any warnings or reminders about consulting a doctor.
-            """
-            
-            llm = get_llm("reports")
-            
-            with st.spinner("🧠 Generating AI-driven health summary..."):
-                response = llm.invoke(prompt).strip()
-            
-            if not response or "error" in response.lower():
-                response = "I'm unable to generate a health summary at this time due to technical issues. Please try again later."
+    @st.fragment(key="ai_report_summary")
+    def ai_summary_section():
+        """Step 4: the AI summary button and its progress rerun only this section."""
+        # Step 4: Generate AI-Driven Health Summary
+        st.subheader("Step 4: Generate AI-Driven Health Summary")
+        
+        if st.button("🧠 Generate AI Report Summary"):
+            try:
+                profile = st.session_state.profile_data if st.session_state.profile_complete else None
+                prompt = summary_prompt(profile, get_metric_store(), get_range_results())
+                
+                # Runs in the background; the summary is kept for the PDF export when it finishes
+                if not (is_duplicate_submission("reports", prompt) and "ai_summary" in st.session_state):
+                    submit_generation("reports", prompt, SUMMARY_FALLBACK, validate=is_usable_summary)
             
-            st.markdown("### 🧠 AI Health Analysis")
-            st.markdown(response)
-            ai_summary = response  # Assign generated summary to ai_summary
+            except Exception as e:
+                st.error(f"🚨 Error generating AI summary: {str(e)}")
         
-        except Exception as e:
-            st.error(f"🚨 Error generating AI summary: {str(e)}")
+        show_generation("reports", "ai_summary", "### 🧠 AI Health Analysis", "🚨 Error generating AI summary")
     
-    # Step 5: Visualize Historical Data
-    st.subheader("Step 5: Visualize Historical Data")
+    ai_summary_section()
     
-    # Ensure session state analytics data exists
-    if "analytics_data" not in st.session_state:
-        st.session_state.analytics_data = {
-            "dates": [datetime.now().strftime("%Y-%m-%d")],
-            "heart_rates": [72],
-            "glucose_levels": [90],
-            "blood_pressure_systolic": [120],
-            "blood_pressure_diastolic": [80],
-            "peak_flow": [400],
-            "hba1c": [5.7],
-            "symptoms": ["Headache", "Fatigue", "Nausea"],
-            "symptom_frequency": [3, 2, 1],  # Example symptom frequencies
-        }
-    
-    # Ensure all lists in analytics_data are the same length
-    def pad_or_truncate_lists(data_dict):
-        """Ensure all lists in the dictionary are of the same length."""
-        max_length = max(len(lst) for lst in data_dict.values())
+    @st.fragment(key="metric_charts")
+    def metric_charts():
+        """Step 5: chart type, range and resolution rerun only this section."""
+        # Step 5: Visualize Historical Data
+        st.subheader("Step 5: Visualize Historical Data")
         
-        for key in data_dict:
-            current_length = len(data_dict[key])
-            if current_length < max_length:
-                data_dict[key].extend([None] * (max_length - current_length))
-            elif current_length > max_length:
-                data_dict[key] = data_dict[key][:max_length]
+        # Visualization Type Selection
+        visualization_type = st.selectbox(
+            "Select Metric to Visualize",
+            [
+                "Heart Rate Trend",
+                "Blood Pressure Dual-Line",
+                "Blood Glucose Trend with Reference Line",
+                "Symptom Frequency Pie Chart",
+            ]
+        )
         
-        return data_dict
-    
-    # Apply padding/truncation to analytics_data
-    st.session_state.analytics_data = pad_or_truncate_lists(st.session_state.analytics_data)
-    
-    # Visualization Type Selection
-    visualization_type = st.selectbox(
-        "Select Metric to Visualize",
-        [
-            "Heart Rate Trend",
-            "Blood Pressure Dual-Line",
-            "Blood Glucose Trend with Reference Line",
-            "Symptom Frequency Pie Chart",
-        ]
-    )
-    
-    # Heart Rate Trend Line Chart
-    if visualization_type == "Heart Rate Trend":
-        heart_rates = st.session_state.analytics_data.get("heart_rates", [])
-        dates = st.session_state.analytics_data.get("dates", [])
+        # The range also applies to the metrics export below, so changing it reruns that too
+        range_col, resolution_col = st.columns(2)
+        with range_col:
+            range_start, range_end = date_range_selector("reports", on_change=lambda: st.rerun(["metric_charts", "report_export"]))
+        st.session_state.reports_view_range = (range_start, range_end)
+        with resolution_col:
+            resolution = st.radio("Resolution", ["Raw", "Daily mean", "Weekly mean"], horizontal=True, key="reports_resolution")
+        freq = {"Raw": None, "Daily mean": "D", "Weekly mean": "W"}[resolution]
+        view = (range_start, range_end, freq)
         
-        # Ensure both lists are the same length before creating DataFrame
-        if len(heart_rates) != len(dates):
-            st.error("🚨 Data inconsistency detected. Please log metrics again.")
-        else:
-            df_hr = pd.DataFrame({"Date": dates, "Heart Rate (bpm)": heart_rates})
-            fig_hr = px.line(
-                df_hr,
-                x="Date",
-                y="Heart Rate (bpm)",
-                title="Heart Rate Trend Over Time",
-                labels={"Heart Rate (bpm)": "Heart Rate (bpm)"},
-            )
-            fig_hr.update_traces(mode="lines+markers", hovertemplate="Date: %{x}<br>Heart Rate: %{y} bpm")
-            fig_hr.add_hline(
-                y=100,  # Example normal range upper limit
-                line_dash="dash",
-                line_color="red",
-                annotation_text="Normal Range Limit",
-                annotation_position="top right",
-            )
-            st.plotly_chart(fig_hr, use_container_width=True)
-    
-    # Blood Pressure Dual-Line Chart
-    elif visualization_type == "Blood Pressure Dual-Line":
-        bp_systolic = st.session_state.analytics_data.get("blood_pressure_systolic", [])
-        bp_diastolic = st.session_state.analytics_data.get("blood_pressure_diastolic", [])
-        dates = st.session_state.analytics_data.get("dates", [])
+        # Figures are cached per session and rebuilt only when their data version or view changes
+        store = range_metric_store(range_start, range_end)
+        range_results = get_range_results()
+        hr_range = range_results["heart_rates"]
+        systolic_range = range_results["blood_pressure_systolic"]
+        diastolic_range = range_results["blood_pressure_diastolic"]
+        glucose_range = range_results["glucose_levels"]
         
-        # Ensure all lists are the same length before creating DataFrame
-        if len(bp_systolic) != len(dates) or len(bp_diastolic) != len(dates):
-            st.error("🚨 Data inconsistency detected. Please log metrics again.")
-        else:
-            df_bp = pd.DataFrame(
-                {"Date": dates, "Systolic BP (mmHg)": bp_systolic, "Diastolic BP (mmHg)": bp_diastolic}
-            )
-            fig_bp = px.line(
-                df_bp,
-                x="Date",
-                y=["Systolic BP (mmHg)", "Diastolic BP (mmHg)"],
-                title="Blood Pressure Trends Over Time",
-                labels={"value": "Pressure (mmHg)"},
-            )
-            fig_bp.update_traces(mode="lines+markers", hovertemplate="Date: %{x}<br>Pressure: %{y} mmHg")
-            fig_bp.add_hrect(
-                y0=120,
-                y1=140,
-                line_width=0,
-                fillcolor="red",
-                opacity=0.2,
-                annotation_text="Normal Systolic Range",
-            )
-            fig_bp.add_hrect(
-                y0=80,
-                y1=90,
-                line_width=0,
-                fillcolor="blue",
-                opacity=0.2,
-                annotation_text="Normal Diastolic Range",
-            )
-            st.plotly_chart(fig_bp, use_container_width=True)
-    
-    # Blood Glucose Trend Line Chart with Reference Line
-    elif visualization_type == "Blood Glucose Trend with Reference Line":
-        glucose_levels = st.session_state.analytics_data.get("glucose_levels", [])
-        dates = st.session_state.analytics_data.get("dates", [])
+        # Heart Rate Trend Line Chart
+        if visualization_type == "Heart Rate Trend":
+            if not len(store["heart_rates"]):
+                st.info("ℹ️ No heart rate readings logged yet.")
+            else:
+                def build_hr_figure():
+                    df_hr = series_frame(store["heart_rates"], "Heart Rate (bpm)", *view)
+                    fig_hr = line_chart(
+                        df_hr,
+                        x="Date",
+                        y="Heart Rate (bpm)",
+                        title="Heart Rate Trend Over Time",
+                        labels={"Heart Rate (bpm)": "Heart Rate (bpm)"},
+                    )
+                    fig_hr.update_traces(mode="lines+markers", hovertemplate="Date: %{x}<br>Heart Rate: %{y} bpm")
+                    fig_hr.add_hrect(
+                        y0=hr_range.low,
+                        y1=hr_range.high,
+                        line_width=0,
+                        fillcolor="green",
+                        opacity=0.15,
+                        annotation_text="Normal Range",
+                        annotation_position="top right",
+                    )
+                    return fig_hr
+                
+                fig_hr = get_figure(
+                    ("heart_rate", store["heart_rates"].version, hr_range.low, hr_range.high, view),
+                    build_hr_figure
+                )
+                st.plotly_chart(fig_hr, use_container_width=True)
         
-        # Ensure both lists are the same length before creating DataFrame
-        if len(glucose_levels) != len(dates):
-            st.error("🚨 Data inconsistency detected. Please log metrics again.")
-        else:
-            df_gluc = pd.DataFrame({"Date": dates, "Blood Glucose (mg/dL)": glucose_levels})
-            fig_gluc = px.line(
-                df_gluc,
-                x="Date",
-                y="Blood Glucose (mg/dL)",
-                title="Blood Glucose Trend Over Time",
-                labels={"Blood Glucose (mg/dL)": "Blood Glucose (mg/dL)"},
-            )
-            fig_gluc.update_traces(mode="lines+markers", hovertemplate="Date: %{x}<br>Glucose: %{y} mg/dL")
-            fig_gluc.add_hline(
-                y=140,  # Example reference line for normal glucose level
-                line_dash="dash",
-                line_color="green",
-                annotation_text="Normal Glucose Limit",
-                annotation_position="top right",
-            )
-            st.plotly_chart(fig_gluc, use_container_width=True)
+        # Blood Pressure Dual-Line Chart
+        elif visualization_type == "Blood Pressure Dual-Line":
+            if not len(store["blood_pressure_systolic"]):
+                st.info("ℹ️ No blood pressure readings logged yet.")
+            else:
+                def build_bp_figure():
+                    # Each series keeps its own timestamps, so plot them in long format
+                    df_bp = pd.concat([
+                        series_frame(store["blood_pressure_systolic"], "value", *view).assign(variable="Systolic BP (mmHg)"),
+                        series_frame(store["blood_pressure_diastolic"], "value", *view).assign(variable="Diastolic BP (mmHg)"),
+                    ])
+                    fig_bp = line_chart(
+                        df_bp,
+                        x="Date",
+                        y="value",
+                        color="variable",
+                        title="Blood Pressure Trends Over Time",
+                        labels={"value": "Pressure (mmHg)", "variable": ""},
+                    )
+                    fig_bp.update_traces(mode="lines+markers", hovertemplate="Date: %{x}<br>Pressure: %{y} mmHg")
+                    fig_bp.add_hrect(
+                        y0=systolic_range.low,
+                        y1=systolic_range.high,
+                        line_width=0,
+                        fillcolor="red",
+                        opacity=0.2,
+                        annotation_text="Normal Systolic Range",
+                    )
+                    fig_bp.add_hrect(
+                        y0=diastolic_range.low,
+                        y1=diastolic_range.high,
+                        line_width=0,
+                        fillcolor="blue",
+                        opacity=0.2,
+                        annotation_text="Normal Diastolic Range",
+                    )
+                    return fig_bp
+                
+                fig_bp = get_figure(
+                    (
+                        "blood_pressure",
+                        store["blood_pressure_systolic"].version,
+                        store["blood_pressure_diastolic"].version,
+                        systolic_range.low, systolic_range.high, diastolic_range.low, diastolic_range.high,
+                        view,
+                    ),
+                    build_bp_figure
+                )
+                st.plotly_chart(fig_bp, use_container_width=True)
+        
+        # Blood Glucose Trend Line Chart with Reference Line
+        elif visualization_type == "Blood Glucose Trend with Reference Line":
+            if not len(store["glucose_levels"]):
+                st.info("ℹ️ No blood glucose readings logged yet.")
+            else:
+                def build_glucose_figure():
+                    df_gluc = series_frame(store["glucose_levels"], "Blood Glucose (mg/dL)", *view)
+                    fig_gluc = line_chart(
+                        df_gluc,
+                        x="Date",
+                        y="Blood Glucose (mg/dL)",
+                        title="Blood Glucose Trend Over Time",
+                        labels={"Blood Glucose (mg/dL)": "Blood Glucose (mg/dL)"},
+                    )
+                    fig_gluc.update_traces(mode="lines+markers", hovertemplate="Date: %{x}<br>Glucose: %{y} mg/dL")
+                    fig_gluc.add_hrect(
+                        y0=glucose_range.low,
+                        y1=glucose_range.high,
+                        line_width=0,
+                        fillcolor="green",
+                        opacity=0.15,
+                        annotation_text="Normal Glucose Range",
+                        annotation_position="top right",
+                    )
+                    return fig_gluc
+                
+                fig_gluc = get_figure(
+                    ("glucose", store["glucose_levels"].version, glucose_range.low, glucose_range.high, view),
+                    build_glucose_figure
+                )
+                st.plotly_chart(fig_gluc, use_container_width=True)
+        
+        # Symptom Frequency Pie Chart
+        elif visualization_type == "Symptom Frequency Pie Chart":
+            symptom_counts = st.session_state.symptom_counts
+            
+            if not symptom_counts:
+                st.info("ℹ️ Analyze symptoms on the Symptoms page to see their frequency here.")
+            else:
+                def build_pie_figure():
+                    df_symptoms = pd.DataFrame({"Symptom": list(symptom_counts), "Frequency": list(symptom_counts.values())})
+                    fig_pie = px.pie(
+                        df_symptoms,
+                        names="Symptom",
+                        values="Frequency",
+                        title="Symptom Frequency Distribution",
+                        hole=0.3,  # Donut chart style
+                    )
+                    fig_pie.update_traces(
+                        textposition="inside",
+                        textinfo="percent+label",
+                        hovertemplate="Symptom: %{label}<br>Frequency: %{value}",
+                    )
+                    return fig_pie
+                
+                # The counts are small, so they serve as their own version
+                fig_pie = get_figure(("symptoms", tuple(symptom_counts.items())), build_pie_figure)
+                st.plotly_chart(fig_pie, use_container_width=True)
+    
+    metric_charts()
+    
+    @st.fragment(key="metrics_summary")
+    def metrics_summary():
+        """Status cards against the patient's reference ranges."""
+        # Metrics Summary Section
+        st.subheader("Metrics Summary")
+        
+        # Key Health Indicators with Trend Deltas
+        store = get_metric_store()
+        range_results = get_range_results()
+        hr_range = range_results["heart_rates"]
+        systolic_range = range_results["blood_pressure_systolic"]
+        diastolic_range = range_results["blood_pressure_diastolic"]
+        glucose_range = range_results["glucose_levels"]
+        hr_trend = trend_arrow(store["heart_rates"])
+        glucose_trend = trend_arrow(store["glucose_levels"])
+        bp_trend = trend_arrow(store["blood_pressure_systolic"])
+        latest_hr = store.latest_value("heart_rates", None)
+        latest_glucose = store.latest_value("glucose_levels", None)
+        latest_systolic = store.latest_value("blood_pressure_systolic", None)
+        latest_diastolic = store.latest_value("blood_pressure_diastolic", None)
+        
+        # Status of the latest reading against the patient's reference ranges
+        hr_status, hr_color = STATUS_LABELS[hr_range.latest_status]
+        glucose_status, glucose_color = STATUS_LABELS[glucose_range.latest_status]
+        # Systolic decides unless it is normal (0) or missing, then diastolic does
+        bp_status, bp_color = STATUS_LABELS[systolic_range.latest_status or diastolic_range.latest_status]
+        
+        st.markdown(
+            f"""
+            <div style="display: flex; justify-content: space-between; margin-top: 20px;">
+                <div style="background-color: {hr_color}; padding: 10px; border-radius: 5px; text-align: center;">
+                    <strong>Heart Rate</strong><br>
+                    Value: {latest_hr if latest_hr is not None else 'N/A'} bpm<br>
+                    Avg ({TREND_WINDOW}): {rolling_average(store["heart_rates"])} bpm<br>
+                    Trend: {hr_trend}<br>
+                    In range: {time_in_range(hr_range)} ({hr_range.low:g}-{hr_range.high:g})<br>
+                    Status: {hr_status}
+                </div>
+                <div style="background-color: {glucose_color}; padding: 10px; border-radius: 5px; text-align: center;">
+                    <strong>Blood Glucose</strong><br>
+                    Value: {latest_glucose if latest_glucose is not None else 'N/A'} mg/dL<br>
+                    Avg ({TREND_WINDOW}): {rolling_average(store["glucose_levels"])} mg/dL<br>
+                    Trend: {glucose_trend}<br>
+                    In range: {time_in_range(glucose_range)} ({glucose_range.low:g}-{glucose_range.high:g})<br>
+                    Status: {glucose_status}
+                </div>
+                <div style="background-color: {bp_color}; padding: 10px; border-radius: 5px; text-align: center;">
+                    <strong>Blood Pressure</strong><br>
+                    Value: {latest_systolic if latest_systolic is not None else 'N/A'}/{latest_diastolic if latest_diastolic is not None else 'N/A'} mmHg<br>
+                    Avg ({TREND_WINDOW}): {rolling_average(store["blood_pressure_systolic"])}/{rolling_average(store["blood_pressure_diastolic"])} mmHg<br>
+                    Trend: {bp_trend}<br>
+                    In range: {time_in_range(systolic_range)} ({systolic_range.low:g}-{systolic_range.high:g} systolic)<br>
+                    Status: {bp_status}
+                </div>
+            </div>
+            """,
+            unsafe_allow_html=True,
+        )
+    
+    metrics_summary()
     
-    # Symptom Frequency Pie Chart
-    elif visualization_type == "Symptom Frequency Pie Chart":
-        symptoms = st.session_state.analytics_data.get("symptoms", [])
-        symptom_frequency = st.session_state.analytics_data.get("symptom_frequency", [])
+    @st.fragment(key="report_export")
+    def report_export():
+        """Step 6: downloads; the format choice reruns only this section."""
+        # Step 6: Export Report
+        st.subheader("Step 6: Export Report")
         
-        # Ensure both lists are the same length before creating DataFrame
-        if len(symptoms) != len(symptom_frequency):
-            st.error("🚨 Data inconsistency detected. Please log metrics again.")
-        else:
-            df_symptoms = pd.DataFrame({"Symptom": symptoms, "Frequency": symptom_frequency})
-            fig_pie = px.pie(
-                df_symptoms,
-                names="Symptom",
-                values="Frequency",
-                title="Symptom Frequency Distribution",
-                hole=0.3,  # Donut chart style
+        if st.session_state.profile_complete:
+            # Export PDF
+            st.download_button(
+                label="📄 Export Report as PDF",
+                data=export_health_report(ai_summary=st.session_state.get("ai_summary")),
+                file_name="health_report.pdf",
+                mime="application/pdf"
             )
-            fig_pie.update_traces(
-                textposition="inside",
-                textinfo="percent+label",
-                hovertemplate="Symptom: %{label}<br>Frequency: %{value}",
+            
+            # Export metrics: the file is only built when the button is clicked
+            export_format = st.radio("Metrics export format", list(EXPORT_FORMATS), horizontal=True, key="export_format")
+            extension, mime = EXPORT_FORMATS[export_format]
+            range_start, range_end = st.session_state.reports_view_range
+            # Ranges reaching past the loaded window are streamed from the database
+            if in_loaded_history(range_start):
+                store = get_metric_store()
+            else:
+                store = StoredHistory(get_health_db(), st.session_state.user_id)
+            st.download_button(
+                label=f"💾 Export Metrics as {export_format}",
+                data=lambda: export_metrics(store, export_format, range_start, range_end),
+                file_name=f"health_metrics.{extension}",
+                mime=mime
             )
-            st.plotly_chart(fig_pie, use_container_width=True)
-    
-    # Metrics Summary Section
-    st.subheader("Metrics Summary")
-    
-    # Key Health Indicators with Trend Deltas
-    heart_rates = st.session_state.analytics_data.get("heart_rates", [])
-    glucose_levels = st.session_state.analytics_data.get("glucose_levels", [])
-    bp_systolic = st.session_state.analytics_data.get("blood_pressure_systolic", [])
-    bp_diastolic = st.session_state.analytics_data.get("blood_pressure_diastolic", [])
-    
-    # Helper function to determine metric status
-    def get_metric_status(value, low, high):
-        """Return color and status based on value range."""
-        if value is None:
-            return "⚠️ No Data", "gray"
-        elif low <= value <= high:
-            return "✅ Normal", "green"
         else:
-            return "⚠️ Abnormal", "red"
-    
-    hr_status, hr_color = get_metric_status(heart_rates[-1], 60, 100) if heart_rates else ("-", "gray")
-    glucose_status, glucose_color = get_metric_status(glucose_levels[-1], 70, 140) if glucose_levels else ("-", "gray")
-    bp_status, bp_color = get_metric_status(bp_systolic[-1], 90, 120) if bp_systolic else ("-", "gray")
-    
-    st.markdown(
-        f"""
-        <div style="display: flex; justify-content: space-between; margin-top: 20px;">
-            <div style="background-color: {hr_color}; padding: 10px; border-radius: 5px; text-align: center;">
-                <strong>Heart Rate</strong><br>
-                Value: {heart_rates[-1] if heart_rates else 'N/A'} bpm<br>
-                Trend: {hr_trend}<br>
-                Status: {hr_status}
-            </div>
-            <div style="background-color: {glucose_color}; padding: 10px; border-radius: 5px; text-align: center;">
-                <strong>Blood Glucose</strong><br>
-                Value: {glucose_levels[-1] if glucose_levels else 'N/A'} mg/dL<br>
-                Trend: {glucose_trend}<br>
-                Status: {glucose_status}
-            </div>
-            <div style="background-color: {bp_color}; padding: 10px; border-radius: 5px; text-align: center;">
-                <strong>Blood Pressure</strong><br>
-                Value: {bp_systolic[-1] if bp_systolic else 'N/A'}/{bp_diastolic[-1] if bp_diastolic else 'N/A'} mmHg<br>
-                Trend: {hr_trend}<br>
-                Status: {bp_status}
-            </div>
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
-    
-    # Step 6: Export Report
-    st.subheader("Step 6: Export Report")
+            st.warning("⚠️ Complete your profile to enable report export.")
     
-    if st.session_state.profile_complete:
-        # Export PDF
-        pdf_data = export_health_report(ai_summary=ai_summary) if ai_summary else b""
-        st.download_button(
-            label="📄 Export Report as PDF",
-            data=pdf_data,
-            file_name="health_report.pdf",
-            mime="application/pdf"
-        )
-        
-        # Export CSV
-        csv_data = ""
-        metrics_df = pd.DataFrame({
-            "Date": dates,
-            "Heart Rate (bpm)": heart_rates,
-            "Blood Glucose (mg/dL)": glucose_levels,
-            "Systolic BP (mmHg)": st.session_state.analytics_data.get("blood_pressure_systolic", []),
-            "Diastolic BP (mmHg)": st.session_state.analytics_data.get("blood_pressure_diastolic", []),
-            "Peak Flow (L/min)": peak_flow,
-            "HbA1c (%)": hba1c
-        })
-        csv_data = metrics_df.to_csv(index=False)
-        st.download_button(
-            label="💾 Export Metrics as CSV",
-            data=csv_data,
-            file_name="health_metrics.csv",
-            mime="text/csv"
-        )
-    else:
-        st.warning("⚠️ Complete your profile to enable report export.")
+    report_export()
     
     # Footer
     lang = st.session_state.language
@@ -1308,6 +1962,12 @@ elif page == "Reports":
     # Debug Mode
     with st.expander("🔧 Debug Mode"):
         st.write("Session State:", st.session_state)
+        st.write("LLM Service:", get_model_service().stats())
+        st.write("Background Jobs:", get_job_manager().stats())
+        st.write("Storage:", get_health_db().stats())
+        st.write("Figure Cache:", st.session_state.figure_cache.stats())
+        st.write("Report Cache:", get_report_cache().stats())
+        st.write("Chart Cache:", get_chart_cache().stats())
     
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -0,0 +1,282 @@
+# batch_reports.py
+# Headless monthly PDF reports for every patient, built in parallel on a process pool
+"""
+Generate one PDF health report per patient for a calendar month.
+
+    python batch_reports.py --month 2026-09 --workers 8
+    python batch_reports.py --patients patients.txt --ai
+    LLM_BACKEND=mock python batch_reports.py --ai
+
+Patients come from the health database (every stored user) or from a file
+with one user id per line. Reports are written to --out as
+<user id>_<month>.pdf and every outcome is appended to progress.jsonl there,
+so an interrupted run picks up where it stopped. Settings are read from the
+same environment variables as the app (HEALTH_DB_PATH, CHART_CACHE_DIR,
+LLM_BACKEND, LLM_RATE_RPS, ...).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from health_db import HealthDB
+from health_events import EpisodeProjection, EventLog, MetricProjection, history_entries
+from health_report import (
+    SUMMARY_FALLBACK, content_key, is_usable_summary, render_pdf, report_content, summary_prompt
+)
+from llm_config import DEFAULT_GEN_PARAMS, MODEL_MAP
+from reference_ranges import age_group_for, classify_store, patient_conditions, reference_ranges
+from report_charts import ChartCache, chart_specs
+from resilience import CircuitOpenError
+
+PROGRESS_FILE = "progress.jsonl"
+# Outcomes that are not retried when a run is resumed
+FINISHED = ("done", "no_data")
+
+# Per-process state, set up once by init_worker
+_worker = {}
+
+
+def get_setting(name, default=None):
+    return os.environ.get(name, default)
+
+
+def month_bounds(month):
+    """:return: (date, date) First day of a "YYYY-MM" month and first day of the next."""
+    start = date.fromisoformat(f"{month}-01")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def previous_month(today=None):
+    first = (today or date.today()).replace(day=1)
+    return (first - timedelta(days=1)).strftime("%Y-%m")
+
+
+def report_file_name(user_id, month):
+    """File name for a report; characters unsafe in paths are replaced."""
+    return f"{re.sub(r'[^A-Za-z0-9_.-]', '_', user_id)}_{month}.pdf"
+
+
+def build_model_service(workers):
+    """
+    ModelService for the "reports" task, configured like the app's. The rate
+    budget is split evenly across worker processes so the whole batch stays
+    within LLM_RATE_RPS and LLM_RATE_TPM.
+    """
+    from llm_backends import MockBackend
+    from llm_cache import ResponseCache
+    from llm_service import ClientPool, ModelService
+    from rate_limit import RateLimiter
+    from resilience import CircuitBreaker, ResiliencePolicy
+
+    model_map = {"reports": get_setting("REPORT_MODEL_ID", MODEL_MAP["reports"])}
+    if str(get_setting("LLM_BACKEND", "watsonx")).lower() == "mock":
+        pool = MockBackend(
+            model_map,
+            latency_ms_median=float(get_setting("MOCK_LATENCY_MS_MEDIAN", 400)),
+            latency_ms_p95=float(get_setting("MOCK_LATENCY_MS_P95", 1200)),
+            tokens_per_second=float(get_setting("MOCK_TOKENS_PER_SECOND", 40)),
+            error_rate=float(get_setting("MOCK_ERROR_RATE", 0.0)),
+            seed=get_setting("MOCK_SEED"),
+        )
+    else:
+        credentials = {"url": os.environ["WATSONX_URL"], "apikey": os.environ["WATSONX_APIKEY"]}
+        pool = ClientPool(credentials, os.environ["WATSONX_PROJECT_ID"], model_map)
+    cache = ResponseCache(
+        get_setting("LLM_CACHE_PATH", ".cache/llm_responses.sqlite3"),
+        ttl=int(get_setting("LLM_CACHE_TTL", 86400)),
+        max_entries=int(get_setting("LLM_CACHE_MAX_ENTRIES", 5000)),
+    )
+    # A batch job can afford to queue; it must not give up after the app's short wait
+    rate_limiter = RateLimiter(
+        requests_per_second=float(get_setting("LLM_RATE_RPS", 2)) / workers,
+        tokens_per_minute=float(get_setting("LLM_RATE_TPM", 60000)) / workers,
+        max_queue=int(get_setting("LLM_QUEUE_MAX", 50)),
+        max_wait=float(get_setting("BATCH_LLM_MAX_WAIT", 600)),
+    )
+    resilience = ResiliencePolicy(
+        timeouts={"reports": float(get_setting("LLM_TIMEOUT_REPORTS", 60))},
+        max_retries=int(get_setting("LLM_MAX_RETRIES", 2)),
+        base_delay=float(get_setting("LLM_RETRY_BASE_DELAY", 0.5)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(get_setting("LLM_BREAKER_THRESHOLD", 5)),
+            reset_timeout=float(get_setting("LLM_BREAKER_RESET", 30)),
+        ),
+    )
+    return ModelService(pool, DEFAULT_GEN_PARAMS, cache=cache, rate_limiter=rate_limiter, resilience=resilience)
+
+
+def init_worker(db_path, chart_dir, ai, workers):
+    """Open the per-process database handle, chart cache and (optionally) model service."""
+    _worker["db"] = HealthDB(db_path)
+    _worker["charts"] = ChartCache(chart_dir)
+    _worker["model"] = build_model_service(workers) if ai else None
+
+
+def build_report(user_id, month, out_dir):
+    """
+    Build one patient's report for a month (runs in a worker process).
+    :return: (dict) Progress record: user_id, month, status ("done", "no_data" or "failed"), file, key, seconds.
+    """
+    started = time.perf_counter()
+    record = {"user_id": user_id, "month": month}
+    try:
+        db = _worker["db"]
+        start, end = month_bounds(month)
+        entries = history_entries(db, user_id, start, end)
+        if not entries:
+            return {**record, "status": "no_data", "seconds": round(time.perf_counter() - started, 3)}
+
+        events = EventLog({"metrics": MetricProjection(), "episodes": EpisodeProjection()})
+        events.append(entries)
+        store = events["metrics"].store
+        profile = db.load_profile(user_id) or {}
+        logged = [log for log, records in events["episodes"].logs.items() if records]
+        conditions = patient_conditions(profile.get("medical_history", ""), logged)
+        range_results = classify_store(store, reference_ranges(age_group_for(profile.get("age")), conditions))
+
+        summary = None
+        if _worker["model"] is not None:
+            prompt = summary_prompt(profile, store, range_results, as_of=end - timedelta(days=1))
+            try:
+                summary = _worker["model"].invoke("reports", prompt, session_id=user_id).strip()
+            except CircuitOpenError:
+                # The model is unavailable; the report goes out with the standard fallback text
+                summary = ""
+            if not is_usable_summary(summary):
+                summary = SUMMARY_FALLBACK
+
+        charts = chart_specs(store, range_results)
+        content = report_content(profile or None, store, range_results, summary, charts)
+        pdf = render_pdf(content, _worker["charts"].paths(charts))
+
+        path = os.path.join(out_dir, report_file_name(user_id, month))
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(pdf)
+        os.replace(temp_path, path)
+        return {
+            **record,
+            "status": "done",
+            "file": os.path.basename(path),
+            "key": content_key(content),
+            "readings": sum(len(series) for series in store.series.values()),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+    except Exception as e:
+        return {**record, "status": "failed", "error": f"{type(e).__name__}: {e}",
+                "seconds": round(time.perf_counter() - started, 3)}
+
+
+def read_patient_file(path):
+    """User ids from a file with one id per line; blank lines and # comments are ignored."""
+    with open(path, encoding="utf-8") as f:
+        lines = (line.split("#", 1)[0].strip() for line in f)
+        return list(dict.fromkeys(line for line in lines if line))
+
+
+def finished_patients(out_dir, month):
+    """User ids the progress file records as finished for this month (with their report still on disk)."""
+    path = os.path.join(out_dir, PROGRESS_FILE)
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if record.get("month") != month:
+                continue
+            done = record.get("status") in FINISHED and (
+                "file" not in record or os.path.exists(os.path.join(out_dir, record["file"]))
+            )
+            if done:
+                finished.add(record["user_id"])
+            else:
+                finished.discard(record["user_id"])
+    return finished
+
+
+def run_batch(user_ids, month, out_dir, db_path, chart_dir, workers, ai=False, resume=True, log=print):
+    """
+    Build reports for user_ids on a pool of `workers` processes.
+    :param resume: (bool) Skip patients already finished for this month according to the progress file.
+    :return: (dict) Counts per status plus elapsed seconds and reports per second.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    skipped = finished_patients(out_dir, month) if resume else set()
+    pending = [user_id for user_id in user_ids if user_id not in skipped]
+    totals = {"done": 0, "no_data": 0, "failed": 0, "resumed": len(user_ids) - len(pending)}
+    log(f"{len(user_ids)} patients for {month}: {totals['resumed']} already finished, {len(pending)} to build "
+        f"on {workers} worker(s)")
+    started = time.perf_counter()
+    if pending:
+        # spawn: workers must not inherit the parent's SQLite connections or threads
+        context = multiprocessing.get_context("spawn")
+        with open(os.path.join(out_dir, PROGRESS_FILE), "a", encoding="utf-8") as progress, \
+                ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                    initargs=(db_path, chart_dir, ai, workers)) as pool:
+            futures = [pool.submit(build_report, user_id, month, out_dir) for user_id in pending]
+            for count, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                progress.write(json.dumps(record) + "\n")
+                progress.flush()
+                totals[record["status"]] += 1
+                detail = record.get("error") or record.get("file") or ""
+                log(f"[{count}/{len(pending)}] {record['user_id']}: {record['status']} {detail} ({record['seconds']}s)")
+    elapsed = time.perf_counter() - started
+    built = totals["done"] + totals["no_data"] + totals["failed"]
+    totals["seconds"] = round(elapsed, 2)
+    totals["reports_per_second"] = round(built / elapsed, 2) if elapsed and built else 0.0
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate monthly PDF health reports for every patient.")
+    parser.add_argument("--month", default=previous_month(), help="Report month as YYYY-MM (default: last month)")
+    parser.add_argument("--db", default=get_setting("HEALTH_DB_PATH", ".cache/health.sqlite3"),
+                        help="Health database (default: HEALTH_DB_PATH or .cache/health.sqlite3)")
+    parser.add_argument("--patients", help="File with one user id per line (default: every user in the database)")
+    parser.add_argument("--out", default="reports", help="Output directory (default: reports)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: number of CPUs)")
+    parser.add_argument("--ai", action="store_true", help="Add an AI-driven summary to each report")
+    parser.add_argument("--force", action="store_true", help="Rebuild reports already finished for this month")
+    args = parser.parse_args(argv)
+
+    try:
+        month_bounds(args.month)
+    except ValueError:
+        parser.error(f"invalid --month {args.month!r}; expected YYYY-MM")
+    if not os.path.exists(args.db):
+        parser.error(f"database not found: {args.db}")
+
+    if args.patients:
+        user_ids = read_patient_file(args.patients)
+    else:
+        user_ids = HealthDB(args.db).user_ids()
+
+    totals = run_batch(
+        user_ids,
+        args.month,
+        args.out,
+        args.db,
+        get_setting("CHART_CACHE_DIR", ".cache/charts"),
+        max(1, args.workers),
+        ai=args.ai,
+        resume=not args.force,
+    )
+    print(json.dumps(totals))
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+# bulk_import.py
+# Chunked parsing and vectorized validation of device exports (CSV, JSON, JSON Lines)
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+from metrics_store import EPOCH, METRICS
+
+CHUNK_ROWS = 20000
+DATE_COLUMNS = ("date", "timestamp", "datetime", "time")
+
+# Common device-export headers, on top of metric ids and display names
+METRIC_ALIASES = {
+    "heart_rate": "heart_rates",
+    "hr": "heart_rates",
+    "pulse": "heart_rates",
+    "glucose": "glucose_levels",
+    "glucose_level": "glucose_levels",
+    "systolic": "blood_pressure_systolic",
+    "diastolic": "blood_pressure_diastolic",
+    "pef": "peak_flow",
+}
+
+
+def metric_aliases():
+    """Map lower-case header or metric label -> metric id."""
+    aliases = dict(METRIC_ALIASES)
+    for metric, (name, unit) in METRICS.items():
+        aliases[metric] = metric
+        aliases[name.lower()] = metric
+        aliases[f"{name} ({unit})".lower()] = metric
+    return aliases
+
+
+def read_chunks(source, filename, chunk_rows=CHUNK_ROWS):
+    """
+    Yield DataFrames of at most `chunk_rows` rows with lower-case column names.
+    A plain JSON array has to be parsed whole; CSV and JSON Lines are streamed.
+    :param source: (file-like) Uploaded file.
+    :param filename: (str) Used to pick the parser from the extension.
+    """
+    name = filename.lower()
+    if name.endswith(".csv"):
+        chunks = pd.read_csv(source, chunksize=chunk_rows)
+    elif name.endswith((".jsonl", ".ndjson")):
+        chunks = pd.read_json(source, lines=True, chunksize=chunk_rows)
+    elif name.endswith(".json"):
+        data = pd.read_json(source)
+        chunks = (data.iloc[start:start + chunk_rows] for start in range(0, len(data), chunk_rows))
+    else:
+        raise ValueError(f"Unsupported file type: {filename} (use .csv, .json or .jsonl)")
+    for chunk in chunks:
+        chunk.columns = [str(column).strip().lower() for column in chunk.columns]
+        yield chunk
+
+
+def find_date_column(columns):
+    for column in DATE_COLUMNS:
+        if column in columns:
+            return column
+    raise ValueError(f"No date column found (expected one of: {', '.join(DATE_COLUMNS)})")
+
+
+def guess_date_format(column, sample=50):
+    """
+    Format string of the first recognisable date among the leading values, or
+    "mixed" (slow, per-element parsing) when none is recognised.
+    """
+    for value in column.dropna().astype(str).head(sample):
+        fmt = guess_datetime_format(value.strip())
+        if fmt is not None:
+            return fmt
+    return "mixed"
+
+
+def _to_datetime(column, fmt):
+    parsed = pd.to_datetime(column, format=fmt, errors="coerce")
+    if getattr(parsed.dt, "tz", None) is not None:
+        # Keep the wall-clock time the device recorded
+        parsed = parsed.dt.tz_localize(None)
+    return parsed
+
+
+def parse_dates(column, fmt):
+    """
+    Vectorized date parse with `fmt`. Entries that do not match it (a file
+    whose format changes part way) are re-parsed per element ("mixed");
+    entries that still fail become NaT.
+    """
+    parsed = _to_datetime(column, fmt)
+    missed = parsed.isna().to_numpy() & _present(column)
+    if fmt != "mixed" and missed.any():
+        parsed[missed] = _to_datetime(column[missed], "mixed")
+    return parsed
+
+
+def parse_timestamps(column, fmt):
+    """Vectorized parse to seconds since EPOCH; unparseable entries become NaN."""
+    parsed = parse_dates(column, fmt)
+    return ((parsed - pd.Timestamp(EPOCH)) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+
+
+def _present(column):
+    """Cells that hold something (not NaN and not blank)."""
+    return column.notna().to_numpy() & (column.astype(str).str.strip() != "").to_numpy()
+
+
+def _new_report():
+    # "bad_dates" rows have no readable date; "invalid" ones have a date but a bad value
+    return {"rows": 0, "imported": 0, "invalid": 0, "bad_dates": 0, "duplicates": 0}
+
+
+def import_metrics(source, filename, ranges, existing_timestamps=None, chunk_rows=CHUNK_ROWS):
+    """
+    Parse and validate metric readings from a device export.
+
+    Accepts long format (date, metric, value) or wide format (date plus one
+    column per metric). Rows with bad dates, non-numeric values, unknown
+    metrics or values outside `ranges` are rejected; rows whose date cannot be
+    read are counted apart as "bad_dates". Readings are deduplicated
+    by (metric, timestamp), both within the file and against stored data.
+    :param source: (file-like) Uploaded file.
+    :param filename: (str) Original file name.
+    :param ranges: (dict) Metric id -> (min, max), the same bounds as the manual inputs.
+    :param existing_timestamps: (callable) (metric, start_ts, end_ts) -> timestamps already stored.
+    :return: (dict, dict) Metric id -> (timestamps, values) sorted arrays, and an import report.
+    """
+    aliases = metric_aliases()
+    metric_ids = list(ranges)
+    lows = np.array([ranges[metric][0] for metric in metric_ids], dtype=np.float64)
+    highs = np.array([ranges[metric][1] for metric in metric_ids], dtype=np.float64)
+    report = _new_report()
+    parts = {metric: ([], []) for metric in metric_ids}
+    date_format = None
+
+    for chunk in read_chunks(source, filename, chunk_rows):
+        report["rows"] += len(chunk)
+        date_column = chunk[find_date_column(chunk.columns)]
+        # The format is guessed once and reused so later chunks parse just as fast;
+        # rows in another format fall back to per-element parsing
+        date_format = date_format or guess_date_format(date_column)
+        timestamps = parse_timestamps(date_column, date_format)
+        dated = ~np.isnan(timestamps)
+        report["bad_dates"] += int(np.count_nonzero(~dated))
+
+        if "metric" in chunk.columns and "value" in chunk.columns:
+            columns = [(chunk["metric"].astype(str).str.strip().str.lower().map(aliases), chunk["value"])]
+        else:
+            columns = [
+                (pd.Series(aliases[column], index=chunk.index), chunk[column])
+                for column in chunk.columns if column in aliases
+            ]
+
+        for metrics, raw in columns:
+            present = _present(raw)
+            codes = pd.Categorical(metrics, categories=metric_ids).codes
+            values = pd.to_numeric(raw, errors="coerce").to_numpy(dtype=np.float64)
+            known = codes >= 0
+            valid = present & known & dated & ~np.isnan(values)
+            in_range = np.zeros(len(values), dtype=bool)
+            in_range[valid] = (values[valid] >= lows[codes[valid]]) & (values[valid] <= highs[codes[valid]])
+            report["invalid"] += int(np.count_nonzero(present & dated & ~in_range))
+            for code, metric in enumerate(metric_ids):
+                keep = in_range & (codes == code)
+                if keep.any():
+                    parts[metric][0].append(timestamps[keep])
+                    parts[metric][1].append(values[keep])
+
+    readings = {}
+    for metric, (ts_parts, value_parts) in parts.items():
+        if not ts_parts:
+            continue
+        ts = np.concatenate(ts_parts)
+        values = np.concatenate(value_parts)
+        # First reading per timestamp wins; np.unique also sorts by time
+        ts, first = np.unique(ts, return_index=True)
+        values = values[first]
+        report["duplicates"] += sum(len(part) for part in ts_parts) - len(ts)
+        if existing_timestamps is not None and len(ts):
+            stored = np.fromiter(existing_timestamps(metric, ts[0], ts[-1]), dtype=np.float64)
+            new = ~np.isin(ts, stored)
+            report["duplicates"] += int(np.count_nonzero(~new))
+            ts, values = ts[new], values[new]
+        if len(ts):
+            readings[metric] = (ts, values)
+            report["imported"] += len(ts)
+    return readings, report
+
+
+def episode_key(record, columns, text_columns=()):
+    """Identity of an episode record for deduplication: its date and every field, so one day can hold several."""
+    return (
+        (record["date"],)
+        + tuple(record.get(column) for column in columns)
+        + tuple(record.get(column, "") for column in text_columns)
+    )
+
+
+def import_episodes(source, filename, columns, text_columns=(), existing_records=(), chunk_rows=CHUNK_ROWS):
+    """
+    Parse and validate disease episode records from a device export.
+
+    Rows are duplicates when they repeat a stored record (same date and
+    fields) or an earlier row of the file at the same time of day, so
+    several readings on one day are all imported.
+    :param columns: (dict) Column id -> (label, min, max); every one is required.
+        Headers may use the id or the label.
+    :param text_columns: (tuple) Optional free-text columns copied as-is.
+    :param existing_records: (iterable) Records already logged in this log.
+    :return: (list, dict) Records sorted by date (same shape as manual logs), and an import report.
+    """
+    report = _new_report()
+    stored = {episode_key(record, columns, text_columns) for record in existing_records}
+    seen = set()
+    records = []
+    date_format = None
+
+    for chunk in read_chunks(source, filename, chunk_rows):
+        report["rows"] += len(chunk)
+        labels = {label.lower(): column for column, (label, _, _) in columns.items()}
+        chunk = chunk.rename(columns=labels)
+        missing = [column for column in columns if column not in chunk.columns]
+        if missing:
+            raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+        date_column = chunk[find_date_column(chunk.columns)]
+        date_format = date_format or guess_date_format(date_column)
+        dates = parse_dates(date_column, date_format)
+        dated = dates.notna().to_numpy()
+        report["bad_dates"] += int(np.count_nonzero(~dated))
+        valid = dated.copy()
+        values = {}
+        for column, (_, low, high) in columns.items():
+            # Records hold whole numbers like the manual inputs; fractional readings are
+            # rounded (not truncated) before the range check
+            numbers = np.rint(pd.to_numeric(chunk[column], errors="coerce").to_numpy(dtype=np.float64))
+            # NaN fails both comparisons, so non-numeric cells are rejected too
+            valid &= (numbers >= low) & (numbers <= high)
+            values[column] = numbers
+        report["invalid"] += int(np.count_nonzero(dated & ~valid))
+
+        day_strings = dates.dt.strftime("%Y-%m-%d").to_numpy()
+        times = dates.dt.strftime("%H:%M:%S").to_numpy()
+        texts = {
+            column: chunk[column].fillna("").astype(str).to_numpy() if column in chunk.columns else None
+            for column in text_columns
+        }
+        for i in np.flatnonzero(valid):
+            record = {column: int(values[column][i]) for column in columns}
+            for column, text in texts.items():
+                record[column] = text[i] if text is not None else ""
+            record["date"] = day_strings[i]
+            key = episode_key(record, columns, text_columns)
+            if key in stored or (times[i], key) in seen:
+                report["duplicates"] += 1
+                continue
+            seen.add((times[i], key))
+            records.append(record)
+
+    records.sort(key=lambda record: record["date"])
+    report["imported"] = len(records)
+    return records, report
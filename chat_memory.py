@@ -0,0 +1,93 @@
+# chat_memory.py
+# Bounded conversational memory for the Chat page
+from collections import deque
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English text)."""
+    return max(1, len(text) // 4)
+
+
+class ConversationMemory:
+    """
+    Keeps the most recent chat turns within a token budget and folds older turns
+    into a rolling summary.
+
+    Turns pushed out of the recent window wait in `pending` until `fold` merges
+    them into the summary, so each summarization only sends the previous summary
+    plus the newly evicted turns, never the whole history.
+    """
+
+    def __init__(self, token_budget=800, summary_token_budget=250):
+        """
+        :param token_budget: (int) Max estimated tokens of verbatim recent turns.
+        :param summary_token_budget: (int) Max estimated tokens of the rolling summary.
+        """
+        self.token_budget = token_budget
+        self.summary_token_budget = summary_token_budget
+        self.summary = ""
+        self.recent = deque()
+        self.pending = []
+        self._recent_tokens = 0
+
+    def add(self, role, text):
+        """Append a turn and evict the oldest turns that no longer fit the budget."""
+        self.recent.append((role, text))
+        self._recent_tokens += estimate_tokens(text)
+        while self._recent_tokens > self.token_budget and len(self.recent) > 1:
+            old_role, old_text = self.recent.popleft()
+            self._recent_tokens -= estimate_tokens(old_text)
+            self.pending.append((old_role, old_text))
+
+    def fold(self, summarize):
+        """
+        Merge evicted turns into the rolling summary.
+        :param summarize: (callable) summarize(previous_summary, turns) -> new summary text.
+        """
+        if not self.pending:
+            return
+        summary = summarize(self.summary, self.pending).strip()
+        max_chars = self.summary_token_budget * 4
+        self.summary = summary[:max_chars]
+        self.pending = []
+
+    def build_context(self):
+        """Return the summary and recent turns formatted for the prompt."""
+        parts = []
+        if self.summary:
+            parts.append(f"Conversation summary so far: {self.summary}")
+        if self.recent:
+            parts.append("\n".join(format_turn(role, text) for role, text in self.recent))
+        return "\n\n".join(parts)
+
+    def clear(self):
+        self.summary = ""
+        self.recent.clear()
+        self.pending = []
+        self._recent_tokens = 0
+
+
+def format_turn(role, text):
+    """Format a turn with the speaker labels the stop sequences expect."""
+    return f"{'Human' if role == 'user' else 'Assistant'}: {text}"
+
+
+def build_summary_prompt(previous_summary, turns):
+    """
+    Prompt that updates a rolling summary with newly evicted turns.
+    :param previous_summary: (str) Current summary (may be empty).
+    :param turns: (list) (role, text) tuples to fold in.
+    :return: (str) Prompt text.
+    """
+    transcript = "\n".join(format_turn(role, text) for role, text in turns)
+    return f"""
+You maintain a short running summary of a conversation between a patient and a medical assistant AI.
+Keep symptoms, conditions, medications, advice already given and open questions. Use at most 150 words.
+
+Current summary: {previous_summary or "(none)"}
+
+New conversation turns:
+{transcript}
+
+Updated summary:
+"""
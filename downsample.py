@@ -0,0 +1,64 @@
+# downsample.py
+# Shrink long time series before they are sent to the browser as Plotly JSON
+import numpy as np
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Pick `threshold` points with Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept. Every bucket in between contributes the
+    point that forms the largest triangle with the previous pick and the mean
+    of the next bucket, which preserves peaks and dips far better than striding.
+    :param x: (np.ndarray) Sorted numeric x values.
+    :param y: (np.ndarray) y values.
+    :param threshold: (int) Number of points to keep.
+    :return: (np.ndarray) Indices of the kept points, increasing.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # threshold - 2 buckets over the interior points 1 .. n - 2
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_frame(df, x, columns, max_points):
+    """
+    Sort a DataFrame by x and keep at most about `max_points` rows per column.
+    With several y columns the kept rows are the union of each column's picks,
+    so every line keeps its own extremes.
+    :param df: (pd.DataFrame) Source data.
+    :param x: (str) Column holding dates or numbers.
+    :param columns: (list) y columns that will be plotted.
+    :param max_points: (int) Target points per column; 0 or None disables downsampling.
+    :return: (pd.DataFrame) The sorted, possibly reduced frame.
+    """
+    df = df.sort_values(x, kind="stable")
+    if not max_points or len(df) <= max_points:
+        return df
+    xs = df[x].to_numpy()
+    if np.issubdtype(xs.dtype, np.datetime64):
+        xs = xs.astype("datetime64[ns]").astype(np.int64)
+    keep = np.unique(np.concatenate([
+        lttb_indices(xs, df[column].to_numpy(dtype=np.float64), max_points)
+        for column in columns
+    ]))
+    return df.iloc[keep]
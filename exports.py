@@ -0,0 +1,152 @@
+# exports.py
+# Chunked CSV and Parquet export of metric history, built only when a download is requested
+import csv
+import heapq
+import io
+import itertools
+from operator import itemgetter
+import numpy as np
+from health_events import episode_readings
+from metrics_store import EPOCH, METRICS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is offered only when pyarrow is installed
+    pa = pq = None
+
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_COLUMNS = ("Date", "Metric", "Value", "Unit")
+
+# Format -> (file extension, MIME type)
+EXPORT_FORMATS = {"CSV": ("csv", "text/csv")}
+if pq is not None:
+    EXPORT_FORMATS["Parquet"] = ("parquet", "application/vnd.apache.parquet")
+
+
+class StoredHistory:
+    """
+    A user's readings read straight from HealthDB, for export ranges older than
+    the session's MetricStore holds, including those logged as disease episodes.
+    Stands in for the store in the writers below.
+    """
+
+    def __init__(self, db, user_id):
+        self.db = db
+        self.user_id = user_id
+
+    def chunks(self, metric, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+        """
+        (timestamps, values) chunks of one metric in time order: the metrics table
+        merged with the readings the metric gets from logged episodes.
+        """
+        episode_ts, episode_values = episode_readings(self.db, self.user_id, metric, start, end)
+        if not episode_ts:
+            yield from self.db.iter_metrics(self.user_id, metric, start, end, chunk_rows)
+            return
+        stored = (
+            reading
+            for timestamps, values in self.db.iter_metrics(self.user_id, metric, start, end, chunk_rows)
+            for reading in zip(timestamps, values)
+        )
+        merged = heapq.merge(stored, zip(episode_ts, episode_values), key=itemgetter(0))
+        while True:
+            chunk = list(itertools.islice(merged, chunk_rows))
+            if not chunk:
+                return
+            yield [ts for ts, _ in chunk], [value for _, value in chunk]
+
+
+def _metric_chunks(store, metric, start, end, chunk_rows):
+    if isinstance(store, StoredHistory):
+        yield from store.chunks(metric, start, end, chunk_rows)
+        return
+    timestamps, values = store.query(metric, start, end)
+    for lo in range(0, len(values), chunk_rows):
+        yield timestamps[lo:lo + chunk_rows], values[lo:lo + chunk_rows]
+
+
+def iter_chunks(store, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Yield readings in [start, end) as column chunks of at most `chunk_rows` rows,
+    metric by metric in time order. Only one chunk is materialised at a time.
+    :param store: (MetricStore | StoredHistory) Where the readings are read from.
+    :return: (generator) (metric id, times, values) with times as datetime64[s], so
+        sub-daily readings keep their time of day.
+    """
+    for metric in METRICS:
+        for timestamps, values in _metric_chunks(store, metric, start, end, chunk_rows):
+            ts = np.array(timestamps, dtype=np.float64)
+            times = np.datetime64(EPOCH, "s") + np.rint(ts).astype("timedelta64[s]")
+            yield metric, times, np.array(values, dtype=np.float64)
+
+
+def _format_value(value):
+    # Whole readings are written without a trailing ".0", as they were entered
+    return int(value) if value.is_integer() else value
+
+
+def write_csv(store, out, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Write readings in [start, end) as CSV (Date, Metric, Value, Unit).
+    :param out: (file-like) Binary stream to write to.
+    :return: (int) Number of data rows written.
+    """
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    rows = 0
+    for metric, times, values in iter_chunks(store, start, end, chunk_rows):
+        name, unit = METRICS[metric]
+        dates = np.datetime_as_string(times).tolist()
+        writer.writerows((date, name, _format_value(value), unit) for date, value in zip(dates, values.tolist()))
+        rows += len(values)
+    # Hand the stream back to the caller open
+    text.detach()
+    return rows
+
+
+def write_parquet(store, out, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Write readings in [start, end) as Parquet, one row group per chunk.
+    :param out: (file-like) Binary stream to write to.
+    :return: (int) Number of data rows written.
+    """
+    if pq is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+    schema = pa.schema([
+        ("Date", pa.timestamp("s")),
+        ("Metric", pa.dictionary(pa.int8(), pa.string())),
+        ("Value", pa.float64()),
+        ("Unit", pa.dictionary(pa.int8(), pa.string())),
+    ])
+    rows = 0
+    with pq.ParquetWriter(out, schema) as writer:
+        for metric, times, values in iter_chunks(store, start, end, chunk_rows):
+            name, unit = METRICS[metric]
+            writer.write_batch(pa.record_batch([
+                pa.array(times, pa.timestamp("s")),
+                pa.DictionaryArray.from_arrays(np.zeros(len(values), dtype=np.int8), [name]),
+                pa.array(values, pa.float64()),
+                pa.DictionaryArray.from_arrays(np.zeros(len(values), dtype=np.int8), [unit]),
+            ], schema=schema))
+            rows += len(values)
+    return rows
+
+
+WRITERS = {"CSV": write_csv, "Parquet": write_parquet}
+
+
+def export_metrics(store, fmt="CSV", start=None, end=None):
+    """
+    Build an export file for readings in [start, end).
+    Rows are encoded chunk by chunk straight into the output buffer, so no
+    intermediate DataFrame or row list is built.
+    :param fmt: (str) Key of EXPORT_FORMATS.
+    :return: (bytes) File contents.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    out = io.BytesIO()
+    WRITERS[fmt](store, out, start, end)
+    return out.getvalue()
@@ -0,0 +1,51 @@
+# figure_cache.py
+# Per-session memo of built Plotly figures
+from collections import OrderedDict
+
+
+class FigureCache:
+    """
+    LRU map from a figure key to a built figure.
+
+    Keys combine the chart type, the version counters of the data it plots and
+    any display options, so a figure is rebuilt only after its data changes.
+    """
+
+    def __init__(self, max_entries=16):
+        """
+        :param max_entries: (int) Figures kept per session.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()
+
+    def get(self, key, build):
+        """
+        Return the cached figure for key, calling build() on a miss.
+        :param key: (tuple) Hashable (chart, data version(s), options).
+        :param build: (callable) Builds the figure from scratch.
+        """
+        figure = self._figures.get(key)
+        if figure is not None:
+            self._figures.move_to_end(key)
+            self.hits += 1
+            return figure
+        self.misses += 1
+        figure = build()
+        self._figures[key] = figure
+        if len(self._figures) > self.max_entries:
+            self._figures.popitem(last=False)
+        return figure
+
+    def clear(self):
+        self._figures.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "figures": len(self._figures),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,248 @@
+# health_db.py
+# Durable per-user storage for profiles, metric readings, episode logs and chat history
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS profiles ("
+    "user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS metrics ("
+    "user_id TEXT NOT NULL, metric TEXT NOT NULL, ts REAL NOT NULL, value REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_metrics_user_ts ON metrics(user_id, ts)",
+    "CREATE TABLE IF NOT EXISTS episodes ("
+    "user_id TEXT NOT NULL, log TEXT NOT NULL, date TEXT NOT NULL, data TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_episodes_user_log_date ON episodes(user_id, log, date)",
+    "CREATE TABLE IF NOT EXISTS messages ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, role TEXT NOT NULL, "
+    "content TEXT NOT NULL, created_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages(user_id, id)",
+)
+
+
+class HealthDB:
+    """
+    SQLite store in WAL mode so page reads never wait on writes.
+
+    Writes are queued and committed in batches by a background thread (every
+    `flush_interval` seconds or once `batch_size` statements are pending).
+    Reads flush the queue first, so a user always sees their own writes. Every
+    read is bounded by user and date or row count, letting a session load only
+    the window it displays.
+    """
+
+    def __init__(self, path, flush_interval=0.5, batch_size=200):
+        """
+        :param path: (str) SQLite database file.
+        :param flush_interval: (float) Longest time a queued write waits before commit.
+        :param batch_size: (int) Pending statements that trigger an early commit.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.batches = 0
+        self.rows_written = 0
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._wake = threading.Event()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._write_conn = self._connect()
+        for statement in SCHEMA:
+            self._write_conn.execute(statement)
+        self._write_conn.commit()
+        self._read_conn = self._connect()
+
+        threading.Thread(target=self._writer, name="health-db-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # Writes
+
+    def _enqueue(self, sql, rows):
+        with self._pending_lock:
+            self._pending.append((sql, rows))
+            pending = sum(len(rows) for _, rows in self._pending)
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def _writer(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # Leave the batch for the next pass rather than killing the writer
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        """Commit every queued write in one transaction."""
+        with self._write_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                with self._write_conn:
+                    for sql, rows in batch:
+                        self._write_conn.executemany(sql, rows)
+            except sqlite3.Error:
+                with self._pending_lock:
+                    self._pending[:0] = batch
+                raise
+            self.batches += 1
+            self.rows_written += sum(len(rows) for _, rows in batch)
+
+    def save_profile(self, user_id, data):
+        self._enqueue(
+            "INSERT OR REPLACE INTO profiles (user_id, data, updated_at) VALUES (?, ?, ?)",
+            [(user_id, json.dumps(data), time.time())],
+        )
+
+    def add_metrics(self, user_id, readings):
+        """
+        Queue metric readings.
+        :param readings: (iterable) (metric id, timestamp, value) tuples.
+        """
+        self._enqueue(
+            "INSERT INTO metrics (user_id, metric, ts, value) VALUES (?, ?, ?, ?)",
+            [(user_id, metric, ts, value) for metric, ts, value in readings],
+        )
+
+    def add_episodes(self, user_id, log, records):
+        """
+        Queue disease episode records.
+        :param log: (str) Log name (e.g. "glucose_log").
+        :param records: (list) Dicts with a "date" key ("YYYY-MM-DD").
+        """
+        self._enqueue(
+            "INSERT INTO episodes (user_id, log, date, data) VALUES (?, ?, ?, ?)",
+            [(user_id, log, record["date"], json.dumps(record)) for record in records],
+        )
+
+    def add_message(self, user_id, role, content):
+        """
+        Store a chat turn right away (after any queued writes) rather than batching it;
+        turns are infrequent and callers key on the id.
+        :return: (int) The message's id.
+        """
+        self.flush()
+        with self._write_lock, self._write_conn:
+            cursor = self._write_conn.execute(
+                "INSERT INTO messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, role, content, time.time()),
+            )
+            self.rows_written += 1
+        return cursor.lastrowid
+
+    def clear(self, user_id, tables=("profiles", "metrics", "episodes", "messages")):
+        """Delete a user's rows from the given tables."""
+        for table in tables:
+            self._enqueue(f"DELETE FROM {table} WHERE user_id = ?", [(user_id,)])
+
+    # Reads
+
+    def _query(self, sql, params):
+        self.flush()
+        with self._read_lock:
+            return self._read_conn.execute(sql, params).fetchall()
+
+    def user_ids(self):
+        """Every user with a profile or any stored data, sorted."""
+        rows = self._query(
+            "SELECT user_id FROM profiles UNION SELECT user_id FROM metrics "
+            "UNION SELECT user_id FROM episodes ORDER BY user_id",
+            (),
+        )
+        return [user_id for (user_id,) in rows]
+
+    def load_profile(self, user_id):
+        rows = self._query("SELECT data FROM profiles WHERE user_id = ?", (user_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def load_metrics(self, user_id, since_ts=None):
+        """Return (metric id, timestamp, value) rows at or after since_ts, oldest first."""
+        return self._query(
+            "SELECT metric, ts, value FROM metrics WHERE user_id = ? AND ts >= ? ORDER BY ts, rowid",
+            (user_id, since_ts if since_ts is not None else float("-inf")),
+        )
+
+    def iter_metrics(self, user_id, metric, start_ts=None, end_ts=None, batch_size=5000):
+        """
+        Yield one metric's readings in [start_ts, end_ts) oldest first, reading `batch_size` rows at a time.
+        :return: (generator) (timestamps, values) lists of at most batch_size readings.
+        """
+        after = (float("-inf") if start_ts is None else start_ts, -1)
+        end_ts = float("inf") if end_ts is None else end_ts
+        while True:
+            rows = self._query(
+                "SELECT ts, rowid, value FROM metrics WHERE user_id = ? AND metric = ? "
+                "AND (ts > ? OR (ts = ? AND rowid > ?)) AND ts < ? ORDER BY ts, rowid LIMIT ?",
+                (user_id, metric, after[0], after[0], after[1], end_ts, batch_size),
+            )
+            if rows:
+                yield [ts for ts, _, _ in rows], [value for _, _, value in rows]
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][:2]
+
+    def metric_timestamps(self, user_id, metric, start_ts, end_ts):
+        """Timestamps stored for one metric between start_ts and end_ts inclusive."""
+        rows = self._query(
+            "SELECT ts FROM metrics WHERE user_id = ? AND ts BETWEEN ? AND ? AND metric = ?",
+            (user_id, start_ts, end_ts, metric),
+        )
+        return [ts for (ts,) in rows]
+
+    def load_episodes(self, user_id, log, since_date=None):
+        """Return a log's records dated on or after since_date ("YYYY-MM-DD"), oldest first."""
+        rows = self._query(
+            "SELECT data FROM episodes WHERE user_id = ? AND log = ? AND date >= ? ORDER BY date, rowid",
+            (user_id, log, since_date or ""),
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def load_messages(self, user_id, limit=None):
+        """Return the newest `limit` (id, role, content) chat turns, oldest first; all turns if limit is None."""
+        rows = self._query(
+            "SELECT id, role, content FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, -1 if limit is None else limit),
+        )
+        return rows[::-1]
+
+    def iter_messages(self, user_id, batch_size=500):
+        """Yield every (role, content) chat turn, oldest first, reading `batch_size` rows at a time."""
+        after_id = 0
+        while True:
+            rows = self._query(
+                "SELECT id, role, content FROM messages WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (user_id, after_id, batch_size),
+            )
+            for _, role, content in rows:
+                yield role, content
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
+    def stats(self):
+        """Return write-batching counters for the debug panel."""
+        with self._pending_lock:
+            pending = sum(len(rows) for _, rows in self._pending)
+        return {
+            "pending_rows": pending,
+            "batches_committed": self.batches,
+            "rows_written": self.rows_written,
+        }
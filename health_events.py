@@ -0,0 +1,184 @@
+# health_events.py
+# Append-only log of health events with incrementally maintained per-view projections
+import itertools
+from collections import namedtuple
+from metrics_store import MetricStore, format_timestamp, to_timestamp
+
+READING = "reading"
+EPISODE = "episode"
+
+# source is a metric id for readings and a log name for episodes; data is the
+# reading value or the episode record dict
+HealthEvent = namedtuple("HealthEvent", "seq kind source ts data")
+
+# Episode log -> {record field: metric id}; these fields are readings in their own right
+EPISODE_METRICS = {
+    "glucose_log": {"glucose_level": "glucose_levels"},
+    "bp_log": {"systolic": "blood_pressure_systolic", "diastolic": "blood_pressure_diastolic"},
+    "asthma_log": {"peak_flow": "peak_flow"},
+}
+
+# Shared by all projections so a rebuilt log never repeats an earlier version
+_versions = itertools.count(1)
+
+
+class MetricProjection:
+    """
+    MetricStore view for the dashboard, exports and AI context. Readings map
+    straight to their series; episodes contribute the fields in EPISODE_METRICS.
+    """
+
+    def __init__(self, initial=MetricStore):
+        """
+        :param initial: (callable) Returns the store events are applied to (e.g. one seeded with defaults).
+        """
+        self.initial = initial
+        self.store = initial()
+
+    def apply(self, events):
+        # Group by metric so each series takes one bulk extend per batch
+        columns = {}
+        for event in events:
+            if event.kind == READING:
+                pairs = ((event.source, event.data),)
+            else:
+                pairs = (
+                    (metric, event.data[field])
+                    for field, metric in EPISODE_METRICS.get(event.source, {}).items()
+                    if field in event.data
+                )
+            for metric, value in pairs:
+                timestamps, values = columns.setdefault(metric, ([], []))
+                timestamps.append(event.ts)
+                values.append(value)
+        for metric, (timestamps, values) in columns.items():
+            self.store.extend(metric, timestamps, values)
+
+    def rebuild(self, events):
+        self.store = self.initial()
+        self.apply(events)
+
+
+class EpisodeProjection:
+    """Per-log episode records in logging order, for the disease charts and log export."""
+
+    def __init__(self, logs=tuple(EPISODE_METRICS)):
+        self.log_names = logs
+        self.logs = {log: [] for log in logs}
+        self.versions = {log: next(_versions) for log in logs}
+
+    def apply(self, events):
+        for event in events:
+            if event.kind == EPISODE:
+                self.logs[event.source].append(event.data)
+                self.versions[event.source] = next(_versions)
+
+    def rebuild(self, events):
+        self.logs = {log: [] for log in self.log_names}
+        self.versions = {log: next(_versions) for log in self.log_names}
+        self.apply(events)
+
+
+class EventLog:
+    """
+    Single append-only record of everything a user logs.
+
+    Each reading or episode becomes one event. Registered projections are
+    updated on every append with just the new events, so a view costs O(new
+    events) to refresh rather than a rebuild. Events are not kept once
+    applied: the durable copy is in HealthDB, and discarding a kind of event
+    (a user reset) rebuilds the projections from `history` instead.
+    """
+
+    def __init__(self, projections, history=None):
+        """
+        :param projections: (dict) View name -> projection with apply(events) and rebuild(events).
+        :param history: (callable) Returns the stored (kind, source, when, data) entries this log mirrors,
+            in time order (see history_entries); replayed by discard().
+        """
+        self.projections = projections
+        self.history = history
+        self.count = 0
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, name):
+        return self.projections[name]
+
+    def _events(self, entries):
+        return [
+            HealthEvent(next(self._seq), kind, source, to_timestamp(when), data)
+            for kind, source, when, data in entries
+        ]
+
+    def append(self, entries):
+        """
+        Append events and update every projection.
+        :param entries: (iterable) (kind, source, when, data) tuples; when is anything to_timestamp accepts.
+        :return: (list) The new HealthEvents.
+        """
+        events = self._events(entries)
+        self.count += len(events)
+        for projection in self.projections.values():
+            projection.apply(events)
+        return events
+
+    def add_readings(self, readings):
+        """:param readings: (iterable) (metric id, when, value) tuples."""
+        return self.append((READING, metric, when, float(value)) for metric, when, value in readings)
+
+    def add_episodes(self, log, records):
+        """:param records: (iterable) Episode dicts with a "date" key ("YYYY-MM-DD")."""
+        return self.append((EPISODE, log, record["date"], record) for record in records)
+
+    def discard(self, kind):
+        """Drop every event of one kind and rebuild the projections from the rest of the stored history."""
+        entries = self.history() if self.history is not None else ()
+        events = self._events(entry for entry in entries if entry[0] != kind)
+        self.count = len(events)
+        for projection in self.projections.values():
+            projection.rebuild(events)
+
+
+def history_entries(db, user_id, start=None, end=None):
+    """
+    A user's stored readings and episodes dated in [start, end), as append() entries in time order.
+    :param db: (HealthDB) Durable storage.
+    :param start: (date) First day, or None for all history.
+    :param end: (date) Day after the last, or None for no bound.
+    """
+    since_ts = to_timestamp(start) if start is not None else None
+    end_ts = to_timestamp(end) if end is not None else float("inf")
+    entries = [(READING, metric, ts, value) for metric, ts, value in db.load_metrics(user_id, since_ts) if ts < end_ts]
+    for log in EPISODE_METRICS:
+        records = db.load_episodes(user_id, log, start.strftime("%Y-%m-%d") if start is not None else None)
+        entries.extend(
+            (EPISODE, log, record["date"], record) for record in records
+            if end is None or record["date"] < end.strftime("%Y-%m-%d")
+        )
+    entries.sort(key=lambda entry: to_timestamp(entry[2]))
+    return entries
+
+
+def episode_readings(db, user_id, metric, start=None, end=None):
+    """
+    Readings one metric gets from a user's stored episodes (see EPISODE_METRICS),
+    as MetricProjection applies them.
+    :param start: (float) Seconds since EPOCH, or None for all history.
+    :param end: (float) Exclusive upper bound, or None for no bound.
+    :return: (list, list) Timestamps and values in time order.
+    """
+    since = format_timestamp(start) if start is not None else None
+    readings = []
+    for log, fields in EPISODE_METRICS.items():
+        for field, target in fields.items():
+            if target != metric:
+                continue
+            for record in db.load_episodes(user_id, log, since):
+                ts = to_timestamp(record["date"])
+                if field in record and (start is None or ts >= start) and (end is None or ts < end):
+                    readings.append((ts, float(record[field])))
+    readings.sort(key=lambda reading: reading[0])
+    return [ts for ts, _ in readings], [value for _, value in readings]
@@ -0,0 +1,284 @@
+# health_report.py
+# PDF health report rendering from a plain content snapshot, with a content-hashed render cache
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from fpdf import FPDF
+from metrics_store import METRICS, format_timestamp, to_timestamp
+from report_charts import CHART_SIZE
+
+# Metrics listed under "Latest Health Metrics", in display order
+REPORT_METRICS = ("heart_rates", "glucose_levels", "peak_flow", "hba1c")
+
+# Trends are read from each series' rolling statistics over this many readings
+TREND_WINDOW = 7
+TREND_WORDS = {"up": "increasing", "down": "decreasing", "flat": "stable"}
+# The AI summary describes this many calendar days of readings
+SUMMARY_DAYS = 7
+# Stored instead of a failed or unusable AI summary
+SUMMARY_FALLBACK = (
+    "I'm unable to generate a health summary at this time due to technical issues. Please try again later."
+)
+
+# Height / width of embedded chart images
+CHART_ASPECT = CHART_SIZE[1] / CHART_SIZE[0]
+
+# The core PDF fonts only cover latin-1; common typographic characters get ASCII stand-ins
+PDF_REPLACEMENTS = str.maketrans({
+    "‘": "'", "’": "'", "“": '"', "”": '"',
+    "–": "-", "—": "-", "•": "-", "…": "...",
+    "↑": "up", "↓": "down",
+})
+
+
+def pdf_text(text):
+    """Make text safe for the latin-1 core fonts; other characters (e.g. emoji) are dropped."""
+    return str(text).translate(PDF_REPLACEMENTS).encode("latin-1", "ignore").decode("latin-1")
+
+
+def describe_series(series, as_of=None):
+    """
+    One-line summary for prompts: daily means over the last SUMMARY_DAYS days plus rolling statistics.
+    :param as_of: (date) Last day of the summary window (defaults to today).
+    """
+    window = series.stats.window(TREND_WINDOW)
+    if not window.n:
+        return "no readings"
+    since = to_timestamp((as_of or datetime.now().date()) - timedelta(days=SUMMARY_DAYS - 1))
+    daily = series.aggregate("D", since)
+    parts = [f"latest {series.latest()[1]:g}"]
+    if len(daily["count"]):
+        daily_means = ", ".join(
+            f"{format_timestamp(day, '%m-%d')}: {mean:.1f}" for day, mean in zip(daily["start"], daily["mean"])
+        )
+        parts.append(f"last {SUMMARY_DAYS} days {int(daily['count'].sum())} readings with daily means [{daily_means}]")
+    else:
+        parts.append(f"no readings in the last {SUMMARY_DAYS} days")
+    parts.append(f"mean of last {window.n} readings {window.mean:.1f}")
+    if window.std is not None:
+        parts.append(f"std dev {window.std:.1f}")
+        parts.append(f"slope {window.slope:+.2f} per reading")
+    parts.append(f"range {window.min:g}-{window.max:g}")
+    parts.append(f"smoothed {series.stats.ewma:.1f}")
+    parts.append(f"trend {TREND_WORDS[window.trend()]}")
+    return ", ".join(parts)
+
+
+def summary_prompt(profile, store, range_results, as_of=None):
+    """
+    Prompt for the AI-driven health summary.
+    :param profile: (dict) Profile data, or None if the profile is incomplete.
+    :param as_of: (date) Last day the summary covers (defaults to today).
+    """
+    recent = {
+        metric: f"{describe_series(store[metric], as_of)}; {range_results[metric].summary()}"
+        for metric in REPORT_METRICS
+    }
+    return f"""
+            You are a professional healthcare AI assistant tasked with providing a personalized health summary.
+            
+            Patient Profile: {json.dumps(profile or {})}
+            Recent Metrics:
+            - Heart Rate (bpm): {recent["heart_rates"]}
+            - Blood Glucose (mg/dL): {recent["glucose_levels"]}
+            - Peak Flow (L/min): {recent["peak_flow"]}
+            - HbA1c (%): {recent["hba1c"]}
+            
+            Instructions:
+            1. Analyze trends over time and note if values are increasing, decreasing, or stable.
+            2. Interpret what these trends may mean in terms of health implications.
+            3. Provide simple, easy-to-understand explanations without medical jargon.
+            4. Suggest practical lifestyle changes (e.g., diet, exercise).
+            5. Mention when a medical checkup is recommended.
+            
+            Output format:
+            ### 🔍 Trend Overview
+            - Heart Rate: [Stable/Increasing/Decreasing]
+            - Blood Glucose: [Stable/Increasing/Decreasing]
+            - Peak Flow: [Stable/Increasing/Decreasing]
+            - HbA1c: [Stable/Increasing/Decreasing]
+            
+            ### 🩺 Health Implications
+            Explain what the trend might indicate about the patient's current condition.
+            
+            ### 💡 Recommendations
+            Provide 2-3 lifestyle suggestions tailored to the patient's data.
+            
+            ### ⚠️ Important Notes
+            Include any warnings or reminders about consulting a doctor.
+            """
+
+
+def is_usable_summary(text):
+    return bool(text) and "error" not in text.lower()
+
+
+def report_content(profile, store, range_results, ai_summary=None, charts=()):
+    """
+    Snapshot everything the report shows as JSON-serializable data.
+    Rendering reads only this snapshot, so it can run on any thread or process.
+    :param profile: (dict) Profile data, or None if the profile is incomplete.
+    :param store: (MetricStore) Metric history.
+    :param range_results: (dict) Metric id -> RangeResult.
+    :param ai_summary: (str) AI-generated summary (optional).
+    :param charts: (list) Chart specs from report_charts.chart_specs(); their keys follow the data versions.
+    :return: (dict) Report content.
+    """
+    return {
+        "profile": {
+            field: str(profile.get(field, "N/A"))
+            for field in ("age", "gender", "comorbidities")
+        } if profile else None,
+        "latest_date": store.latest_date(),
+        "latest": [
+            (METRICS[metric][0], str(store.latest_value(metric)), METRICS[metric][1])
+            for metric in REPORT_METRICS
+        ],
+        "ranges": [(METRICS[metric][0], result.summary()) for metric, result in range_results.items()],
+        "ai_summary": ai_summary or None,
+        "charts": [{"title": spec["title"], "key": spec["key"]} for spec in charts],
+    }
+
+
+def content_key(content):
+    """Stable hash of a report snapshot; equal content always gives the same key."""
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def render_pdf(content, chart_paths=None):
+    """
+    Generate the PDF health report.
+    :param content: (dict) Snapshot from report_content().
+    :param chart_paths: (dict) Chart key -> PNG file; charts without an image are left out.
+    :return: (bytes) PDF file content.
+    """
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+
+    # Title
+    pdf.set_font("Arial", style="B", size=16)
+    pdf.cell(0, 10, "HealthAI Report", ln=True, align="C")
+    pdf.ln(10)
+
+    # Date
+    pdf.set_font("Arial", size=12)
+    pdf.cell(0, 10, f"Report Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", ln=True)
+    pdf.ln(5)
+
+    # Profile
+    profile = content["profile"]
+    if profile:
+        pdf.set_font("Arial", style="B", size=14)
+        pdf.cell(0, 10, "Patient Profile", ln=True)
+        pdf.set_font("Arial", size=12)
+        pdf.cell(0, 10, pdf_text(f"Age: {profile['age']}"), ln=True)
+        pdf.cell(0, 10, pdf_text(f"Gender: {profile['gender']}"), ln=True)
+        pdf.cell(0, 10, pdf_text(f"Comorbidities: {profile['comorbidities']}"), ln=True)
+        pdf.ln(5)
+
+    # Latest metrics
+    pdf.set_font("Arial", style="B", size=14)
+    pdf.cell(0, 10, "Latest Health Metrics", ln=True)
+    pdf.set_font("Arial", size=12)
+    pdf.cell(0, 10, f"Date: {content['latest_date']}", ln=True)
+    for name, value, unit in content["latest"]:
+        pdf.cell(0, 10, pdf_text(f"{name}: {value} {unit}"), ln=True)
+    pdf.ln(5)
+
+    # Time in range
+    pdf.set_font("Arial", style="B", size=14)
+    pdf.cell(0, 10, "Time in Reference Range", ln=True)
+    pdf.set_font("Arial", size=12)
+    for name, summary in content["ranges"]:
+        pdf.multi_cell(0, 10, pdf_text(f"{name}: {summary}"))
+    pdf.ln(5)
+
+    # AI summary
+    if content["ai_summary"]:
+        pdf.set_font("Arial", style="B", size=14)
+        pdf.cell(0, 10, "AI-Driven Health Summary", ln=True)
+        pdf.set_font("Arial", size=12)
+        pdf.multi_cell(0, 10, pdf_text(content["ai_summary"]))
+        pdf.ln(5)
+
+    # Trend charts, starting on a new page and breaking pages between charts
+    charts = [chart for chart in content["charts"] if chart["key"] in (chart_paths or {})]
+    if charts:
+        pdf.add_page()
+        pdf.set_font("Arial", style="B", size=14)
+        pdf.cell(0, 10, "Trend Charts", ln=True)
+        width = pdf.w - pdf.l_margin - pdf.r_margin
+        height = width * CHART_ASPECT
+        for chart in charts:
+            if pdf.get_y() + height > pdf.h - pdf.b_margin:
+                pdf.add_page()
+            pdf.image(chart_paths[chart["key"]], x=pdf.l_margin, y=pdf.get_y(), w=width, h=height)
+            pdf.set_y(pdf.get_y() + height + 4)
+
+    # Footer
+    pdf.set_font("Arial", size=10)
+    pdf.cell(0, 10, "This report is generated by HealthAI. For more details, consult your healthcare provider.", ln=True)
+
+    return pdf.output(dest="S").encode("latin-1")
+
+
+class ReportCache:
+    """
+    Thread-safe LRU map from content hash to rendered report bytes.
+
+    Downloads render on the server's request threads, so concurrent requests
+    for the same report wait for one render instead of each starting their own.
+    """
+
+    def __init__(self, max_entries=64):
+        """
+        :param max_entries: (int) Rendered reports kept across all sessions.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._reports = OrderedDict()
+        self._lock = threading.Lock()
+        self._rendering = {}
+
+    def get(self, key, render):
+        """
+        Return the cached report for key, calling render() on a miss.
+        :param key: (str) Content hash from content_key().
+        :param render: (callable) Renders the report bytes.
+        """
+        with self._lock:
+            report = self._reports.get(key)
+            if report is not None:
+                self._reports.move_to_end(key)
+                self.hits += 1
+                return report
+            self.misses += 1
+            # One lock per key, so identical requests share a single render
+            key_lock = self._rendering.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                report = self._reports.get(key)
+            if report is None:
+                report = render()
+                with self._lock:
+                    self._reports[key] = report
+                    if len(self._reports) > self.max_entries:
+                        self._reports.popitem(last=False)
+                    self._rendering.pop(key, None)
+        return report
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "reports": len(self._reports),
+                "bytes": sum(len(report) for report in self._reports.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
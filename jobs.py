@@ -0,0 +1,123 @@
+# jobs.py
+# Background execution of long-running generations, keyed per session
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """A unit of background work plus its progress and result."""
+
+    def __init__(self, session_id, name, signature=None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.name = name
+        self.signature = signature
+        self.status = "queued"
+        self.partial = ""
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def elapsed(self):
+        """Seconds since submission (or total time once finished)."""
+        return (self.finished_at or time.time()) - self.submitted_at
+
+
+class JobManager:
+    """
+    Runs jobs on a shared thread pool so generations never block the Streamlit
+    script thread.
+
+    Each session keeps its latest job per name, so results survive reruns and
+    page switches until the retention window passes. Submitting a job whose
+    signature matches one that is still running returns the running job.
+    """
+
+    def __init__(self, max_workers=4, retention_seconds=3600, timing_window=200):
+        """
+        :param max_workers: (int) Concurrent jobs across all sessions.
+        :param retention_seconds: (int) How long finished jobs are kept.
+        :param timing_window: (int) Number of recent run times kept for stats.
+        """
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.run_times = deque(maxlen=timing_window)
+        self.queue_waits = deque(maxlen=timing_window)
+
+    def submit(self, session_id, name, fn, signature=None):
+        """
+        Queue fn(job) for background execution.
+        :param session_id: (str) Owner session.
+        :param name: (str) Job slot within the session (e.g. "symptoms").
+        :param fn: (callable) Receives the Job (may update job.partial) and returns the result.
+        :param signature: (hashable) Identifies the inputs; an identical running job is reused.
+        :return: (Job) The queued or reused job.
+        """
+        with self._lock:
+            self._prune()
+            current = self._jobs.get((session_id, name))
+            if current is not None and current.active and current.signature == signature:
+                return current
+            job = Job(session_id, name, signature)
+            self._jobs[(session_id, name)] = job
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        job.started_at = time.time()
+        job.status = "running"
+        try:
+            job.result = fn(job)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        job.finished_at = time.time()
+        with self._lock:
+            if job.status == "done":
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.queue_waits.append(job.started_at - job.submitted_at)
+            self.run_times.append(job.finished_at - job.started_at)
+
+    def get(self, session_id, name):
+        """Return the session's latest job for a slot, or None."""
+        return self._jobs.get((session_id, name))
+
+    def _prune(self):
+        """Drop finished jobs older than the retention window (caller holds the lock)."""
+        cutoff = time.time() - self.retention_seconds
+        expired = [key for key, job in self._jobs.items() if not job.active and job.finished_at < cutoff]
+        for key in expired:
+            del self._jobs[key]
+
+    def stats(self):
+        """Return queue depth and run-time metrics for the debug panel."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+            run_times = sorted(self.run_times)
+            waits = list(self.queue_waits)
+        return {
+            "queued": sum(1 for job in jobs if job.status == "queued"),
+            "running": sum(1 for job in jobs if job.status == "running"),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retained_jobs": len(jobs),
+            "avg_run_s": round(sum(run_times) / len(run_times), 3) if run_times else 0.0,
+            "p95_run_s": round(run_times[min(len(run_times) - 1, int(len(run_times) * 0.95))], 3) if run_times else 0.0,
+            "avg_queue_wait_s": round(sum(waits) / len(waits), 3) if waits else 0.0,
+        }
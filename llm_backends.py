@@ -0,0 +1,136 @@
+# llm_backends.py
+# Model backend interface and a local stand-in for offline runs
+import hashlib
+import math
+import random
+import threading
+import time
+
+
+class LLMBackend:
+    """
+    Interface every model backend implements.
+
+    `get(task, params)` returns a client exposing LangChain-style `invoke(prompt)`
+    and `stream(prompt)`; ModelService only talks to backends through it.
+    """
+
+    name = "base"
+
+    def __init__(self, model_map):
+        """
+        :param model_map: (dict) Task name -> model id.
+        """
+        self.model_map = model_map
+
+    def get(self, task, params):
+        raise NotImplementedError
+
+    def warm(self, tasks, params, background=True):
+        """Prepare clients ahead of the first request (optional)."""
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+class MockBackendError(ConnectionError):
+    """Injected failure from the mock backend."""
+
+
+class MockLLM:
+    """
+    Deterministic stand-in for a Watsonx model.
+
+    The same prompt always yields the same text. Latency is drawn from a
+    log-normal distribution, streaming paces words at `tokens_per_second`, and
+    a fraction of calls fail with injected errors.
+    """
+
+    def __init__(self, backend, task, params):
+        self.backend = backend
+        self.task = task
+        self.max_new_tokens = int(params.get("max_new_tokens", 300))
+
+    def _response(self, prompt):
+        digest = hashlib.sha256(f"{self.task}:{prompt}".encode("utf-8")).hexdigest()
+        words = (
+            f"### 🧪 Offline {self.task} response\n"
+            f"This is a deterministic mock answer (ref {digest[:8]}). "
+            "It is not a substitute for professional medical advice. "
+            "- Stay hydrated and rest.\n- Track your symptoms daily.\n- Consult a doctor if symptoms persist."
+        ).split(" ")
+        return " ".join(words[: self.max_new_tokens])
+
+    def invoke(self, prompt):
+        text = self._response(prompt)
+        self.backend.before_call()
+        time.sleep(len(text.split(" ")) / self.backend.tokens_per_second)
+        return text
+
+    def stream(self, prompt):
+        text = self._response(prompt)
+        self.backend.before_call()
+        delay = 1.0 / self.backend.tokens_per_second
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(delay)
+            yield word if i == len(words) - 1 else word + " "
+
+
+class MockBackend(LLMBackend):
+    """Local backend selected with LLM_BACKEND = "mock" for CI, laptops and load tests."""
+
+    name = "mock"
+
+    def __init__(self, model_map, latency_ms_median=400, latency_ms_p95=1200,
+                 tokens_per_second=40, error_rate=0.0, seed=None):
+        """
+        :param model_map: (dict) Task name -> model id (kept for cache keys).
+        :param latency_ms_median: (float) Median time before the first token.
+        :param latency_ms_p95: (float) 95th percentile time before the first token.
+        :param tokens_per_second: (float) Generation speed.
+        :param error_rate: (float) Fraction of calls that raise MockBackendError.
+        :param seed: (int) Seed for latency and error sampling.
+        """
+        super().__init__(model_map)
+        self.latency_ms_median = latency_ms_median
+        self.latency_ms_p95 = max(latency_ms_p95, latency_ms_median)
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def sample_latency(self):
+        """Draw a first-token latency in seconds from a log-normal distribution (none for a median <= 0)."""
+        if self.latency_ms_median <= 0:
+            return 0.0
+        mu = math.log(self.latency_ms_median)
+        sigma = math.log(self.latency_ms_p95 / self.latency_ms_median) / 1.645
+        with self._lock:
+            return self._rng.lognormvariate(mu, sigma) / 1000.0
+
+    def before_call(self):
+        """Simulate time-to-first-token and inject failures."""
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        time.sleep(self.sample_latency())
+        if fail:
+            raise MockBackendError("Injected mock backend failure")
+
+    def get(self, task, params):
+        return MockLLM(self, task, params)
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "calls": self.calls,
+            "injected_errors": self.errors,
+            "latency_ms_median": self.latency_ms_median,
+            "latency_ms_p95": self.latency_ms_p95,
+            "tokens_per_second": self.tokens_per_second,
+        }
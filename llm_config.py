@@ -0,0 +1,21 @@
+# llm_config.py
+# Model ids and generation parameters shared by the app and the batch report job
+from ibm_watson_machine_learning.metanames import GenTextParamsMetaNames as GenParams
+
+# Model id per task
+MODEL_MAP = {
+    "chat": "ibm/granite-3-3-8b-instruct",
+    "symptoms": "ibm/granite-3-3-8b-instruct",
+    "treatment": "ibm/granite-3-3-8b-instruct",
+    "diseases": "ibm/granite-3-3-8b-instruct",
+    "reports": "ibm/granite-3-3-8b-instruct",
+}
+
+# Generation parameters shared by every task
+DEFAULT_GEN_PARAMS = {
+    GenParams.DECODING_METHOD: "greedy",
+    GenParams.TEMPERATURE: 1.2,
+    GenParams.MIN_NEW_TOKENS: 5,
+    GenParams.MAX_NEW_TOKENS: 300,
+    GenParams.STOP_SEQUENCES: ["Human:", "Observation"],
+}
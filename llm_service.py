@@ -0,0 +1,419 @@
+# llm_service.py
+# Shared Watsonx model layer used by every page of the Health Assistant
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from ibm_watsonx_ai import APIClient, Credentials
+from langchain_ibm import WatsonxLLM
+from llm_backends import LLMBackend
+from llm_cache import make_cache_key
+from resilience import CircuitOpenError
+
+# Shown when the circuit breaker is open and no cached answer exists
+DEGRADED_RESPONSE = (
+    "⚠️ The AI assistant is temporarily unavailable. Your information has been saved; "
+    "please try again in a few minutes. If you feel unwell, contact a healthcare provider."
+)
+
+
+class ModelUnavailableError(CircuitOpenError):
+    """
+    Raised instead of an answer while the circuit is open and nothing is cached.
+    Its message is DEGRADED_RESPONSE, for pages to show without storing it as a reply.
+    """
+
+    def __init__(self, message=DEGRADED_RESPONSE):
+        super().__init__(message)
+
+
+class ClientPool(LLMBackend):
+    """
+    Process-wide registry of WatsonxLLM clients keyed by task and generation params.
+
+    All pooled clients share a single APIClient, so the IAM token exchange and the
+    underlying HTTP session happen once per process instead of once per click.
+    A daemon thread touches the token periodically so the SDK refreshes it before
+    it expires, off the request path.
+    """
+
+    name = "watsonx"
+
+    def __init__(self, credentials, project_id, model_map, token_refresh_interval=300):
+        """
+        :param credentials: (dict) Watsonx "url" and "apikey".
+        :param project_id: (str) Watsonx project id.
+        :param model_map: (dict) Task name -> model id.
+        :param token_refresh_interval: (int) Seconds between background token checks.
+        """
+        super().__init__(model_map)
+        self.credentials = credentials
+        self.project_id = project_id
+        self.token_refresh_interval = token_refresh_interval
+        self._api_client = None
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+        self.hits = 0
+        self.misses = 0
+        self.token_refreshes = 0
+        self.created_at = time.time()
+
+    def _get_api_client(self):
+        """Create the shared APIClient on first use (caller holds the lock)."""
+        if self._api_client is None:
+            self._api_client = APIClient(
+                credentials=Credentials(
+                    url=self.credentials.get("url"),
+                    api_key=self.credentials.get("apikey"),
+                ),
+                project_id=self.project_id,
+            )
+            self._start_token_refresher()
+        return self._api_client
+
+    def _start_token_refresher(self):
+        """Keep the IAM token fresh in the background so requests never wait on it."""
+        def refresh_loop():
+            while True:
+                time.sleep(self.token_refresh_interval)
+                try:
+                    # Reading the token makes the SDK refresh it when it is close to expiry
+                    _ = self._api_client.token
+                    self.token_refreshes += 1
+                except Exception:
+                    # The next request will retry the refresh on its own
+                    pass
+
+        self._refresher = threading.Thread(target=refresh_loop, name="watsonx-token-refresh", daemon=True)
+        self._refresher.start()
+
+    @staticmethod
+    def _key(task, params):
+        return task, json.dumps(params, sort_keys=True, default=str)
+
+    def get(self, task, params):
+        """
+        Return the pooled client for a task, creating it on the first request.
+        :param task: (str) Task name from the model map (e.g. "chat").
+        :param params: (dict) Watsonx generation parameters.
+        :return: (WatsonxLLM) Shared client instance.
+        """
+        key = self._key(task, params)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.hits += 1
+                return client
+
+            self.misses += 1
+            client = WatsonxLLM(
+                model_id=self.model_map[task],
+                watsonx_client=self._get_api_client(),
+                project_id=self.project_id,
+                params=params,
+            )
+            self._clients[key] = client
+            return client
+
+    def warm(self, tasks, params, background=True):
+        """
+        Build clients for the given tasks ahead of the first request.
+        :param tasks: (iterable) Task names to warm.
+        :param params: (dict) Generation parameters the pages will use.
+        :param background: (bool) Warm in a daemon thread instead of blocking the caller.
+        """
+        def warm_all():
+            for task in tasks:
+                try:
+                    self.get(task, params)
+                except Exception:
+                    # Warming is best-effort; the page will surface the real error
+                    pass
+
+        if background:
+            threading.Thread(target=warm_all, name="watsonx-pool-warm", daemon=True).start()
+        else:
+            warm_all()
+
+    def stats(self):
+        """Return pool counters for the debug panel."""
+        total = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "clients": len(self._clients),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "token_refreshes": self.token_refreshes,
+            "uptime_s": round(time.time() - self.created_at, 1),
+        }
+
+
+class ModelService:
+    """
+    Entry point the pages use to call the model.
+
+    Wraps the client pool with the persistent response cache. Only greedy
+    decoding is cached, since sampled generations are not reproducible.
+    Time-to-first-token and total generation time are recorded per request.
+    Concurrent requests with the same cache key are coalesced (single-flight):
+    one caller generates and the others wait on its future. While the circuit
+    breaker is open, callers get a stale cached answer or a
+    ModelUnavailableError immediately.
+    """
+
+    def __init__(self, pool, default_params, cache=None, rate_limiter=None, resilience=None, timing_window=200):
+        """
+        :param pool: (LLMBackend) Model backend, e.g. the shared Watsonx ClientPool.
+        :param default_params: (dict) Generation parameters used when a call passes none.
+        :param cache: (ResponseCache) Optional persistent response cache.
+        :param rate_limiter: (RateLimiter) Optional process-wide admission control.
+        :param resilience: (ResiliencePolicy) Optional timeouts, retries and circuit breaker.
+        :param timing_window: (int) Number of recent request timings kept for stats.
+        """
+        self.pool = pool
+        self.default_params = default_params
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.resilience = resilience
+        self.degraded = 0
+        self.timings = deque(maxlen=timing_window)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.coalesced = 0
+
+    def _record_timing(self, task, started, first_token_at, cached, streamed):
+        finished = time.perf_counter()
+        self.timings.append({
+            "task": task,
+            "ttft_s": round((first_token_at or finished) - started, 3),
+            "total_s": round(finished - started, 3),
+            "cached": cached,
+            "streamed": streamed,
+        })
+
+    def cache_key(self, task, prompt, params=None):
+        """Return the cache key for a request."""
+        return make_cache_key(self.pool.model_map[task], params or self.default_params, prompt, backend=self.pool.name)
+
+    def _admit(self, session_id, prompt, params):
+        """Wait for the rate limiter (if any) before a call reaches Watsonx."""
+        if self.rate_limiter is None:
+            return
+        tokens = len(prompt) // 4 + int(params.get("max_new_tokens", 0))
+        self.rate_limiter.acquire(session_id, tokens)
+
+    def _generate(self, task, prompt, params, session_id):
+        """Run one blocking generation through the rate limiter and resilience policy."""
+        if self.resilience is None:
+            self._admit(session_id, prompt, params)
+            return self.pool.get(task, params).invoke(prompt)
+        return self.resilience.call(
+            task,
+            lambda: self.pool.get(task, params).invoke(prompt),
+            before_attempt=lambda: self._admit(session_id, prompt, params),
+        )
+
+    def _open_stream(self, task, prompt, params, session_id):
+        """Start a streamed generation through the rate limiter and resilience policy."""
+        if self.resilience is None:
+            self._admit(session_id, prompt, params)
+            return iter(self.pool.get(task, params).stream(prompt))
+        return self.resilience.stream(
+            task,
+            lambda: self.pool.get(task, params).stream(prompt),
+            before_attempt=lambda: self._admit(session_id, prompt, params),
+        )
+
+    def _degraded(self, key):
+        """Answer served while the circuit is open: a stale cache entry, else ModelUnavailableError."""
+        self.degraded += 1
+        stale = self.cache.stale(key) if self.cache is not None else None
+        if stale is None:
+            raise ModelUnavailableError()
+        return stale
+
+    def _join_in_flight(self, key):
+        """
+        Register a request under its key. Returns (future, leader): the leader runs the
+        generation and resolves the future; followers wait on the leader's future.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _wait_in_flight(self, task, future):
+        """A follower's wait for the leader's result, bounded by the resilience deadline when there is one."""
+        timeout = self.resilience.deadline(task) if self.resilience is not None else None
+        return future.result(timeout=timeout)
+
+    def _finish_in_flight(self, key, future, response=None, error=None):
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(response)
+
+    def invoke(self, task, prompt, params=None, use_cache=True, session_id="anonymous"):
+        """
+        Generate a completion, serving repeated deterministic prompts from the cache.
+        Identical concurrent requests share one in-flight generation.
+        :param task: (str) Task name from the model map.
+        :param prompt: (str) Prompt text.
+        :param params: (dict) Generation parameters (defaults to `default_params`).
+        :param use_cache: (bool) Set False to bypass the cache for this call.
+        :param session_id: (str) Caller's session, for fair rate-limit queueing.
+        :return: (str) Model response.
+        """
+        params = params or self.default_params
+        cacheable = use_cache and self.cache is not None and params.get("decoding_method") == "greedy"
+        key = self.cache_key(task, prompt, params)
+        started = time.perf_counter()
+
+        if cacheable:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record_timing(task, started, None, cached=True, streamed=False)
+                return cached
+
+        future, leader = self._join_in_flight(key)
+        if not leader:
+            return self._wait_in_flight(task, future)
+
+        response = error = None
+        try:
+            try:
+                response = self._generate(task, prompt, params, session_id)
+            except CircuitOpenError:
+                response = self._degraded(key)
+                return response
+            self._record_timing(task, started, None, cached=False, streamed=False)
+            if cacheable and response.strip():
+                self.cache.put(key, response)
+            return response
+        except BaseException as e:
+            # Followers get an ordinary error even if the leader was interrupted (e.g. a rerun)
+            error = e if isinstance(e, Exception) else RuntimeError("The shared model call was interrupted")
+            raise
+        finally:
+            self._finish_in_flight(key, future, response=response, error=error)
+
+    def stream(self, task, prompt, params=None, use_cache=True, session_id="anonymous"):
+        """
+        Generate a completion chunk by chunk through the LangChain stream interface.
+        A cache hit, or a request that joins an identical in-flight generation,
+        is yielded as a single chunk.
+        :param task: (str) Task name from the model map.
+        :param prompt: (str) Prompt text.
+        :param params: (dict) Generation parameters (defaults to `default_params`).
+        :param use_cache: (bool) Set False to bypass the cache for this call.
+        :param session_id: (str) Caller's session, for fair rate-limit queueing.
+        :return: (generator) Text chunks in arrival order.
+        """
+        params = params or self.default_params
+        cacheable = use_cache and self.cache is not None and params.get("decoding_method") == "greedy"
+        key = self.cache_key(task, prompt, params)
+        started = time.perf_counter()
+
+        if cacheable:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record_timing(task, started, None, cached=True, streamed=True)
+                yield cached
+                return
+
+        future, leader = self._join_in_flight(key)
+        if not leader:
+            yield self._wait_in_flight(task, future)
+            return
+
+        try:
+            source = self._open_stream(task, prompt, params, session_id)
+        except Exception as e:
+            self._finish_in_flight(key, future, error=e)
+            raise
+        state = {"first_token_at": None, "chunks": []}
+        completed = False
+        try:
+            for chunk in source:
+                if state["first_token_at"] is None:
+                    state["first_token_at"] = time.perf_counter()
+                state["chunks"].append(chunk)
+                yield chunk
+            completed = True
+        except CircuitOpenError:
+            # Raised before the first chunk, so nothing has been shown yet
+            try:
+                response = self._degraded(key)
+            except ModelUnavailableError as e:
+                self._finish_in_flight(key, future, error=e)
+                raise
+            self._finish_in_flight(key, future, response=response)
+            yield response
+        except Exception as e:
+            self._finish_in_flight(key, future, error=e)
+            raise
+        finally:
+            if completed:
+                self._complete_stream(task, key, future, source, state, started, cacheable)
+            elif not future.done():
+                # The consumer went away (e.g. a Streamlit rerun interrupted the page);
+                # finish the generation in the background for anyone waiting on it.
+                threading.Thread(
+                    target=self._complete_stream,
+                    args=(task, key, future, source, state, started, cacheable),
+                    daemon=True,
+                ).start()
+
+    def _complete_stream(self, task, key, future, source, state, started, cacheable):
+        """Drain what is left of a stream, then cache and publish the full response."""
+        try:
+            for chunk in source:
+                if state["first_token_at"] is None:
+                    state["first_token_at"] = time.perf_counter()
+                state["chunks"].append(chunk)
+        except Exception as e:
+            self._finish_in_flight(key, future, error=e)
+            return
+        self._record_timing(task, started, state["first_token_at"], cached=False, streamed=True)
+
+        response = "".join(state["chunks"])
+        if cacheable and response.strip():
+            self.cache.put(key, response)
+        self._finish_in_flight(key, future, response=response)
+
+    def timing_stats(self):
+        """Summarize recent request timings."""
+        generated = [t for t in self.timings if not t["cached"]]
+        if not generated:
+            return {"requests": len(self.timings), "generated": 0}
+        totals = sorted(t["total_s"] for t in generated)
+        streamed = [t["ttft_s"] for t in generated if t["streamed"]]
+        return {
+            "requests": len(self.timings),
+            "generated": len(generated),
+            "avg_total_s": round(sum(totals) / len(totals), 3),
+            "p95_total_s": totals[min(len(totals) - 1, int(len(totals) * 0.95))],
+            "avg_ttft_s": round(sum(streamed) / len(streamed), 3) if streamed else None,
+        }
+
+    def stats(self):
+        """Return pool and cache counters for the debug panel."""
+        return {
+            "pool": self.pool.stats(),
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "timings": self.timing_stats(),
+            "rate_limiter": self.rate_limiter.stats() if self.rate_limiter is not None else None,
+            "resilience": self.resilience.stats() if self.resilience is not None else None,
+            "degraded": self.degraded,
+            "in_flight": len(self._inflight),
+            "coalesced": self.coalesced,
+        }
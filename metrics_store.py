@@ -0,0 +1,267 @@
+# metrics_store.py
+# Columnar per-metric time series for the Reports dashboard
+import hashlib
+import itertools
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, time as dt_time
+import numpy as np
+from rolling_stats import RollingStats
+
+# Metric id -> (display name, unit)
+METRICS = {
+    "heart_rates": ("Heart Rate", "bpm"),
+    "glucose_levels": ("Blood Glucose", "mg/dL"),
+    "blood_pressure_systolic": ("Systolic BP", "mmHg"),
+    "blood_pressure_diastolic": ("Diastolic BP", "mmHg"),
+    "peak_flow": ("Peak Flow", "L/min"),
+    "hba1c": ("HbA1c", "%"),
+}
+
+
+# Versions come from one process-wide counter, so a replaced series or store
+# never repeats a version another one already used
+_versions = itertools.count(1)
+
+# Timestamps are wall-clock seconds since 1970-01-01 (no timezone), so pandas
+# reads them back with pd.to_datetime(..., unit="s") unchanged.
+EPOCH = datetime(1970, 1, 1)
+DAY = 86400.0
+
+
+def to_timestamp(when):
+    """Convert a date, naive datetime, "YYYY-MM-DD" string or stored timestamp to seconds since EPOCH."""
+    if isinstance(when, (int, float)):
+        return float(when)
+    if isinstance(when, str):
+        when = datetime.strptime(when, "%Y-%m-%d")
+    elif not isinstance(when, datetime):
+        when = datetime.combine(when, dt_time())
+    return (when.replace(tzinfo=None) - EPOCH).total_seconds()
+
+
+def format_timestamp(ts, fmt="%Y-%m-%d"):
+    return (EPOCH + timedelta(seconds=ts)).strftime(fmt)
+
+
+def bucket_starts(timestamps, freq="D"):
+    """
+    Start of the day ("D") or Monday-based week ("W") containing each timestamp.
+    :param timestamps: (np.ndarray) Seconds since EPOCH.
+    """
+    days = np.floor(timestamps / DAY)
+    if freq == "W":
+        # 1970-01-01 was a Thursday
+        days -= (days + 3) % 7
+    elif freq != "D":
+        raise ValueError(f"Unsupported aggregation frequency: {freq}")
+    return days * DAY
+
+
+class MetricSeries:
+    """
+    One metric's readings as two parallel typed arrays (epoch seconds, value).
+    Appends are O(1) and each series keeps its own timestamps. `stats` holds
+    rolling statistics that are updated with every append.
+
+    Date-range queries bisect the timestamps. While readings arrive in time
+    order (the usual case) the arrays are the index; after an out-of-order
+    append a sorted copy is built once per version. The rolling windows must
+    see readings in time order too, so a reading older than the newest one
+    rebuilds `stats` from the sorted readings.
+    """
+
+    def __init__(self, windows=(7, 30)):
+        self.windows = windows
+        self.timestamps = array("d")
+        self.values = array("d")
+        self.stats = RollingStats(windows)
+        self.version = next(_versions)
+        self._in_order = True
+        self._newest = None
+        self._sorted = None
+        self._sorted_version = None
+        self._fingerprint = None
+        self._fingerprint_version = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, when, value):
+        ts = to_timestamp(when)
+        late = self._newest is not None and ts < self._newest
+        if late:
+            self._in_order = False
+        else:
+            self._newest = ts
+        self.timestamps.append(ts)
+        self.values.append(float(value))
+        self.version = next(_versions)
+        if late:
+            self._rebuild_stats()
+        else:
+            self.stats.push(float(value))
+
+    def extend(self, timestamps, values):
+        """
+        Append many readings in one operation.
+        :param timestamps: (iterable) Seconds since EPOCH.
+        :param values: (iterable) Reading values, same length as timestamps.
+        """
+        timestamps = array("d", timestamps)
+        values = array("d", values)
+        late = False
+        if timestamps:
+            new = np.array(timestamps)
+            late = (self._newest is not None and new[0] < self._newest) or bool(np.any(np.diff(new) < 0))
+            if late:
+                self._in_order = False
+            newest = float(new.max())
+            self._newest = newest if self._newest is None else max(self._newest, newest)
+        self.timestamps.extend(timestamps)
+        self.values.extend(values)
+        self.version = next(_versions)
+        if late:
+            self._rebuild_stats()
+        else:
+            for value in values:
+                self.stats.push(value)
+
+    def _rebuild_stats(self):
+        """Recompute the rolling statistics from the readings in time order."""
+        self.stats = RollingStats(self.windows)
+        for value in self.ordered()[1]:
+            self.stats.push(value)
+
+    def ordered(self):
+        """(timestamps, values) in time order; shares the live arrays when appends were in order."""
+        if self._in_order:
+            return self.timestamps, self.values
+        if self._sorted_version != self.version:
+            order = np.argsort(np.array(self.timestamps), kind="stable")
+            self._sorted = (
+                array("d", np.array(self.timestamps)[order].tobytes()),
+                array("d", np.array(self.values)[order].tobytes()),
+            )
+            self._sorted_version = self.version
+        return self._sorted
+
+    def fingerprint(self):
+        """
+        Hash of the readings, for caches that outlive the process (versions
+        only identify data within one process). Computed once per version.
+        """
+        if self._fingerprint_version != self.version:
+            digest = hashlib.sha256(self.timestamps.tobytes())
+            digest.update(self.values.tobytes())
+            self._fingerprint = digest.hexdigest()
+            self._fingerprint_version = self.version
+        return self._fingerprint
+
+    def query(self, start=None, end=None):
+        """
+        Readings with start <= timestamp < end, in time order, in O(log n) plus the result size.
+        :param start: (float) Seconds since EPOCH, or None for the first reading.
+        :param end: (float) Exclusive upper bound, or None for no bound.
+        :return: (array, array) Timestamps and values (copies).
+        """
+        timestamps, values = self.ordered()
+        lo = 0 if start is None else bisect_left(timestamps, start)
+        hi = len(timestamps) if end is None else bisect_left(timestamps, end)
+        return timestamps[lo:hi], values[lo:hi]
+
+    def aggregate(self, freq="D", start=None, end=None):
+        """
+        Daily ("D") or weekly ("W") aggregates over a date range.
+        :return: (dict) Arrays "start" (bucket start timestamp), "mean", "min", "max" and "count".
+        """
+        timestamps, values = self.query(start, end)
+        if not timestamps:
+            empty = np.array([], dtype=np.float64)
+            return {"start": empty, "mean": empty, "min": empty, "max": empty, "count": empty.astype(np.int64)}
+        values = np.array(values)
+        buckets = bucket_starts(np.array(timestamps), freq)
+        first = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        counts = np.diff(np.append(first, len(values)))
+        return {
+            "start": buckets[first],
+            "mean": np.add.reduceat(values, first) / counts,
+            "min": np.minimum.reduceat(values, first),
+            "max": np.maximum.reduceat(values, first),
+            "count": counts,
+        }
+
+    def latest(self):
+        """Return (timestamp, value) of the newest reading by time, or None."""
+        if not self.values:
+            return None
+        timestamps, values = self.ordered()
+        return timestamps[-1], values[-1]
+
+    def reset(self):
+        self.timestamps = array("d")
+        self.values = array("d")
+        self.stats = RollingStats(self.windows)
+        self.version = next(_versions)
+        self._in_order = True
+        self._newest = None
+        self._sorted = None
+
+
+class MetricStore:
+    """Holds one MetricSeries per metric id in METRICS."""
+
+    def __init__(self, windows=(7, 30)):
+        """
+        :param windows: (tuple) Rolling-statistics window sizes, in readings.
+        """
+        self.series = {metric: MetricSeries(windows) for metric in METRICS}
+
+    def __getitem__(self, metric):
+        return self.series[metric]
+
+    def append(self, metric, when, value):
+        """
+        Log a reading for one metric.
+        :param metric: (str) Metric id from METRICS.
+        :param when: (date | datetime | str) Reading date.
+        :param value: (float) Reading value.
+        """
+        self.series[metric].append(when, value)
+
+    def extend(self, metric, timestamps, values):
+        """Bulk-append readings for one metric (see MetricSeries.extend)."""
+        self.series[metric].extend(timestamps, values)
+
+    def latest(self, metric):
+        return self.series[metric].latest()
+
+    def query(self, metric, start=None, end=None):
+        """Readings of one metric in [start, end) (see MetricSeries.query)."""
+        return self.series[metric].query(start, end)
+
+    def aggregate(self, metric, freq="D", start=None, end=None):
+        """Daily or weekly aggregates of one metric (see MetricSeries.aggregate)."""
+        return self.series[metric].aggregate(freq, start, end)
+
+    def latest_value(self, metric, default="N/A"):
+        """Newest value for display, with whole numbers shown without a decimal."""
+        latest = self.series[metric].latest()
+        if latest is None:
+            return default
+        value = latest[1]
+        return int(value) if value.is_integer() else value
+
+    def latest_date(self, default="N/A"):
+        """Date of the newest reading across all metrics."""
+        stamps = [series.latest()[0] for series in self.series.values() if len(series)]
+        return format_timestamp(max(stamps)) if stamps else default
+
+    @property
+    def version(self):
+        """Changes whenever any series is appended to or reset."""
+        return tuple(series.version for series in self.series.values())
+
+    def reset(self):
+        for series in self.series.values():
+            series.reset()
@@ -0,0 +1,144 @@
+# rate_limit.py
+# Process-wide rate limiting for Watsonx calls across all Streamlit sessions
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request cannot be admitted within the configured wait."""
+
+
+class TokenBucket:
+    """Continuously refilling token bucket. Not thread-safe; RateLimiter holds the lock."""
+
+    def __init__(self, rate, per_seconds):
+        """
+        :param rate: (float) Units allowed per window; also the burst capacity.
+        :param per_seconds: (float) Window length in seconds.
+        """
+        self.capacity = float(rate)
+        self.refill_per_second = float(rate) / per_seconds
+        self.available = float(rate)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing / self.refill_per_second)
+
+    def consume(self, amount):
+        self.available -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Admits model calls under a requests/second and a tokens/minute budget.
+
+    Waiting callers sit in a bounded queue with one FIFO per session; sessions
+    are served round-robin so one busy session cannot starve the others. A
+    caller that cannot be admitted within `max_wait` seconds, or that finds the
+    queue full, gets RateLimitExceeded immediately.
+    """
+
+    def __init__(self, requests_per_second=2, tokens_per_minute=60000, max_queue=50, max_wait=20):
+        """
+        :param requests_per_second: (float) Request budget.
+        :param tokens_per_minute: (float) Prompt + completion token budget.
+        :param max_queue: (int) Max number of waiting callers.
+        :param max_wait: (float) Max seconds a caller waits before failing.
+        """
+        self.requests = TokenBucket(requests_per_second, 1.0)
+        self.tokens = TokenBucket(tokens_per_minute, 60.0)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()
+        self._depth = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.wait_times = deque(maxlen=500)
+
+    def _next_ticket(self):
+        """Head of the first session queue in round-robin order."""
+        for queue in self._queues.values():
+            if queue:
+                return queue[0]
+        return None
+
+    def _remove(self, session_id, ticket):
+        queue = self._queues[session_id]
+        queue.remove(ticket)
+        self._depth -= 1
+        # Move the session to the back of the rotation (or drop it when idle)
+        del self._queues[session_id]
+        if queue:
+            self._queues[session_id] = queue
+
+    def acquire(self, session_id, tokens):
+        """
+        Block until the request may run.
+        :param session_id: (str) Caller's session, used for fair ordering.
+        :param tokens: (int) Estimated prompt + completion tokens.
+        :return: (float) Seconds spent waiting.
+        """
+        ticket = object()
+        started = time.monotonic()
+        deadline = started + self.max_wait
+
+        with self._cond:
+            if self._depth >= self.max_queue:
+                self.rejected += 1
+                raise RateLimitExceeded(
+                    "⏳ The assistant is handling a lot of requests right now. Please try again in a moment."
+                )
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._depth += 1
+            self.max_depth = max(self.max_depth, self._depth)
+
+            while True:
+                now = time.monotonic()
+                if self._next_ticket() is ticket:
+                    delay = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                    if delay == 0:
+                        self.requests.consume(1)
+                        self.tokens.consume(tokens)
+                        self._remove(session_id, ticket)
+                        self.admitted += 1
+                        waited = now - started
+                        self.wait_times.append(waited)
+                        self._cond.notify_all()
+                        return waited
+                else:
+                    # Not our turn yet; sleep until the queue moves or the deadline passes
+                    delay = 0.0
+
+                remaining = deadline - now
+                if remaining <= 0 or delay > remaining:
+                    self._remove(session_id, ticket)
+                    self.rejected += 1
+                    self._cond.notify_all()
+                    raise RateLimitExceeded(
+                        "⏳ The assistant is busy right now. Please try again in a few seconds."
+                    )
+                self._cond.wait(timeout=delay or remaining)
+
+    def stats(self):
+        """Return queue and wait-time metrics for the debug panel."""
+        with self._cond:
+            waits = sorted(self.wait_times)
+            return {
+                "queue_depth": self._depth,
+                "max_queue_depth": self.max_depth,
+                "waiting_sessions": sum(1 for queue in self._queues.values() if queue),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "avg_wait_s": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "p95_wait_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+            }
@@ -0,0 +1,162 @@
+# reference_ranges.py
+# Reference ranges by age group and condition, and vectorized classification of metric series
+import numpy as np
+
+# Metric id -> (low, high) normal band for an adult without known conditions
+DEFAULT_RANGES = {
+    "heart_rates": (60, 100),
+    "glucose_levels": (70, 140),
+    "blood_pressure_systolic": (90, 120),
+    "blood_pressure_diastolic": (60, 80),
+    "peak_flow": (400, 700),
+    "hba1c": (4.0, 5.7),
+}
+
+# Overrides per age group (labels match the age group selectors)
+AGE_GROUP_RANGES = {
+    "Child (0-12)": {
+        "heart_rates": (70, 120),
+        "blood_pressure_systolic": (90, 110),
+        "blood_pressure_diastolic": (55, 75),
+        "peak_flow": (150, 400),
+    },
+    "Teen (13-19)": {
+        "blood_pressure_systolic": (90, 120),
+        "peak_flow": (300, 600),
+    },
+    "Adult (20-64)": {},
+    "Senior (65+)": {
+        "blood_pressure_systolic": (90, 130),
+        "peak_flow": (300, 550),
+    },
+}
+
+# Treatment targets per condition; applied after the age group
+CONDITION_RANGES = {
+    "Diabetes": {
+        "glucose_levels": (80, 180),
+        "hba1c": (4.0, 7.0),
+    },
+    "Hypertension": {
+        "blood_pressure_systolic": (90, 130),
+        "blood_pressure_diastolic": (60, 80),
+    },
+    "Asthma": {},
+}
+
+# Medical-history keywords (lower case) and episode logs that imply each condition
+CONDITION_KEYWORDS = {
+    "diabet": "Diabetes",
+    "hypertension": "Hypertension",
+    "high blood pressure": "Hypertension",
+    "asthma": "Asthma",
+}
+CONDITION_LOGS = {"Diabetes": "glucose_log", "Hypertension": "bp_log", "Asthma": "asthma_log"}
+
+STATUS_LOW, STATUS_NORMAL, STATUS_HIGH = -1, 0, 1
+
+
+def age_group_for(age):
+    """Map an age in years to an age group label (None if unknown)."""
+    if not age:
+        return None
+    if age <= 12:
+        return "Child (0-12)"
+    if age <= 19:
+        return "Teen (13-19)"
+    if age <= 64:
+        return "Adult (20-64)"
+    return "Senior (65+)"
+
+
+def patient_conditions(medical_history="", logged=()):
+    """
+    Conditions named in a free-text medical history or with logged episodes.
+    :param logged: (iterable) Names of episode logs holding at least one record.
+    :return: (tuple) Sorted keys of CONDITION_RANGES.
+    """
+    history = str(medical_history).lower()
+    conditions = {condition for keyword, condition in CONDITION_KEYWORDS.items() if keyword in history}
+    conditions.update(condition for condition, log in CONDITION_LOGS.items() if log in logged)
+    return tuple(sorted(conditions))
+
+
+def reference_ranges(age_group=None, conditions=()):
+    """
+    Resolve the normal band for every metric.
+    :param age_group: (str) Key of AGE_GROUP_RANGES, or None for the adult defaults.
+    :param conditions: (iterable) Keys of CONDITION_RANGES; later entries win on overlap.
+    :return: (dict) Metric id -> (low, high).
+    """
+    ranges = dict(DEFAULT_RANGES)
+    ranges.update(AGE_GROUP_RANGES.get(age_group, {}))
+    for condition in conditions:
+        ranges.update(CONDITION_RANGES.get(condition, {}))
+    return ranges
+
+
+class RangeResult:
+    """Classification of one series against its reference band."""
+
+    def __init__(self, low, high, status):
+        """
+        :param low: (float) Lower bound of the band.
+        :param high: (float) Upper bound of the band.
+        :param status: (np.ndarray) Per-reading STATUS_* codes in time order.
+        """
+        self.low = low
+        self.high = high
+        self.status = status
+        self.count = len(status)
+        self.below = int(np.count_nonzero(status == STATUS_LOW))
+        self.above = int(np.count_nonzero(status == STATUS_HIGH))
+        self.in_range = self.count - self.below - self.above
+        # An excursion is a run of consecutive readings on the same side of the band
+        previous = np.concatenate(([STATUS_NORMAL], status[:-1]))
+        self.low_excursions = int(np.count_nonzero((status == STATUS_LOW) & (previous != STATUS_LOW)))
+        self.high_excursions = int(np.count_nonzero((status == STATUS_HIGH) & (previous != STATUS_HIGH)))
+
+    @property
+    def time_in_range(self):
+        """Fraction of readings inside the band, or None without readings."""
+        return self.in_range / self.count if self.count else None
+
+    @property
+    def latest_status(self):
+        return int(self.status[-1]) if self.count else None
+
+    def summary(self):
+        """Short text for prompts and reports."""
+        if not self.count:
+            return f"reference {self.low:g}-{self.high:g}, no readings"
+        return (
+            f"reference {self.low:g}-{self.high:g}, {self.time_in_range:.0%} of {self.count} readings in range, "
+            f"{self.low_excursions} low and {self.high_excursions} high excursions"
+        )
+
+
+def classify(timestamps, values, low, high):
+    """
+    Classify a whole series in one vectorized pass.
+    :param timestamps: (array-like) Reading times; readings are put in time order first.
+    :param values: (array-like) Reading values.
+    :return: (RangeResult)
+    """
+    # Copies, so the store's array('d') buffers are not left exported (and unresizable)
+    values = np.array(values, dtype=np.float64)
+    order = np.argsort(np.array(timestamps, dtype=np.float64), kind="stable")
+    values = values[order]
+    status = np.where(values < low, STATUS_LOW, np.where(values > high, STATUS_HIGH, STATUS_NORMAL))
+    return RangeResult(low, high, status)
+
+
+def classify_store(store, ranges):
+    """
+    Classify every series in a MetricStore.
+    :param ranges: (dict) Metric id -> (low, high), e.g. from reference_ranges().
+    :return: (dict) Metric id -> RangeResult.
+    """
+    return {
+        metric: classify(store[metric].timestamps, store[metric].values, low, high)
+        for metric, (low, high) in ranges.items()
+    }
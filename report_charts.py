@@ -0,0 +1,151 @@
+# report_charts.py
+# Trend charts for the PDF report, rendered once per data version into an on-disk PNG cache
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+from downsample import lttb_indices
+from metrics_store import METRICS
+
+# Chart title -> metric ids plotted together
+REPORT_CHARTS = (
+    ("Heart Rate", ("heart_rates",)),
+    ("Blood Pressure", ("blood_pressure_systolic", "blood_pressure_diastolic")),
+    ("Blood Glucose", ("glucose_levels",)),
+    ("Peak Flow", ("peak_flow",)),
+    ("HbA1c", ("hba1c",)),
+)
+# Points per line after LTTB; plenty for a chart a few inches wide
+CHART_POINTS = 400
+# Part of every chart key, so changing the chart layout invalidates cached images
+CHART_STYLE = 1
+CHART_SIZE = (7.5, 2.6)  # inches
+CHART_DPI = 150
+COLORS = ("#8e44ad", "#e84393")
+
+
+def chart_specs(store, range_results):
+    """
+    Describe the report's charts without drawing them.
+    :param store: (MetricStore) Metric history.
+    :param range_results: (dict) Metric id -> RangeResult, for the reference bands.
+    :return: (list) Dicts with "title", "metrics", "bands", "series" and "key"; the key
+        changes only when a plotted series (or its band) changes, and is the same in every
+        process. "series" holds a copy of each metric's (timestamps, values) in time order,
+        taken with the key, so a chart drawn later (e.g. on a download thread) matches its
+        key even if readings are logged in between.
+    """
+    specs = []
+    for title, metrics in REPORT_CHARTS:
+        if not any(len(store[metric]) for metric in metrics):
+            continue
+        bands = [
+            (range_results[metric].low, range_results[metric].high) if metric in range_results else None
+            for metric in metrics
+        ]
+        fingerprints = [store[metric].fingerprint() for metric in metrics]
+        identity = json.dumps([CHART_STYLE, title, metrics, fingerprints, bands, CHART_POINTS])
+        series = []
+        for metric in metrics:
+            timestamps, values = store[metric].ordered()
+            series.append((timestamps[:], values[:]))
+        specs.append({
+            "title": title,
+            "metrics": list(metrics),
+            "bands": bands,
+            "series": series,
+            "key": hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32],
+        })
+    return specs
+
+
+def render_chart(spec, path):
+    """Draw one chart spec from its data snapshot and save it as a PNG."""
+    figure = Figure(figsize=CHART_SIZE, dpi=CHART_DPI)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    for metric, band, (timestamps, values), color in zip(spec["metrics"], spec["bands"], spec["series"], COLORS):
+        name, unit = METRICS[metric]
+        timestamps = np.array(timestamps)
+        values = np.array(values)
+        keep = lttb_indices(timestamps, values, CHART_POINTS)
+        dates = (timestamps[keep] * 1e6).astype("datetime64[us]")
+        axes.plot(dates, values[keep], color=color, linewidth=1.2, marker="o" if len(keep) < 30 else None,
+                  markersize=3, label=f"{name} ({unit})")
+        if band is not None:
+            axes.axhspan(band[0], band[1], color=color, alpha=0.08, linewidth=0)
+    locator = AutoDateLocator()
+    axes.xaxis.set_major_locator(locator)
+    axes.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+    axes.set_title(spec["title"], fontsize=10, loc="left")
+    axes.tick_params(labelsize=7)
+    axes.grid(alpha=0.3)
+    axes.legend(fontsize=7, loc="upper left", frameon=False)
+    figure.tight_layout()
+    canvas.draw()
+    # Plain RGB: FPDF splits an alpha channel out pixel by pixel, which is far slower to embed
+    Image.frombuffer("RGBA", canvas.get_width_height(), canvas.buffer_rgba()).convert("RGB").save(path, format="PNG")
+
+
+class ChartCache:
+    """
+    Directory of rendered chart PNGs named by chart key.
+
+    The directory is shared by every session and process, so a chart is drawn
+    once per data version however many reports embed it. Files are written
+    under a temporary name and renamed, so readers never see a partial image.
+    """
+
+    def __init__(self, directory, max_entries=500):
+        """
+        :param directory: (str) Cache directory (created if missing).
+        :param max_entries: (int) Images kept; the least recently rendered are removed first.
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, spec):
+        """Return the PNG path for a chart spec, rendering it from the spec's snapshot on a miss."""
+        path = os.path.join(self.directory, f"{spec['key']}.png")
+        if os.path.exists(path):
+            self.hits += 1
+            return path
+        self.misses += 1
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        render_chart(spec, temp_path)
+        os.replace(temp_path, path)
+        self._prune()
+        return path
+
+    def paths(self, specs):
+        """:return: (dict) Chart key -> PNG path for every spec."""
+        return {spec["key"]: self.path(spec) for spec in specs}
+
+    def _prune(self):
+        with self._lock:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".png")]
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,238 @@
+# resilience.py
+# Timeouts, retries and a circuit breaker around model calls
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import requests
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is rejecting calls."""
+
+
+class CallTimeoutError(TimeoutError):
+    """
+    Raised when a model call misses its deadline. `running` is True when the
+    worker had already started the call and is still busy with it.
+    """
+
+    def __init__(self, message, running):
+        super().__init__(message)
+        self.running = running
+
+
+# Worker threads that run model calls so the caller can stop waiting on a timeout
+_call_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-call")
+
+_STREAM_END = object()
+
+TRANSIENT_STATUS_MARKERS = ("429", "500", "502", "503", "504", "timed out", "temporarily unavailable")
+
+
+def is_transient_error(error):
+    """Return True for failures worth retrying (timeouts, connection drops, 429/5xx)."""
+    if isinstance(error, (TimeoutError, ConnectionError, requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in TRANSIENT_STATUS_MARKERS)
+
+
+def is_service_error(error):
+    """Return True when the service answered with an error response, as opposed to a local failure."""
+    return getattr(getattr(error, "response", None), "status_code", None) is not None
+
+
+def call_with_timeout(fn, timeout):
+    """
+    Run fn() on a worker thread and wait at most `timeout` seconds for it.
+    A call still queued for a worker is cancelled; a running one cannot be
+    killed, but the caller is released on time.
+    """
+    future = _call_executor.submit(fn)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        running = not future.cancel()
+        raise CallTimeoutError(f"Model call exceeded {timeout}s", running) from None
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+
+    After `failure_threshold` consecutive transient failures the circuit opens
+    and calls are rejected for `reset_timeout` seconds. Then a single trial call
+    is let through: success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may proceed right now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def cancel_trial(self):
+        """Release a half-open trial slot when the call never reached the service."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self.failures, "times_opened": self.times_opened}
+
+
+class ResiliencePolicy:
+    """
+    Per-task timeouts plus jittered exponential-backoff retries, guarded by a
+    circuit breaker shared across tasks.
+    """
+
+    def __init__(self, timeouts=None, default_timeout=60, max_retries=2, base_delay=0.5,
+                 max_delay=8.0, breaker=None):
+        """
+        :param timeouts: (dict) Task name -> timeout in seconds.
+        :param default_timeout: (float) Timeout for tasks missing from `timeouts`.
+        :param max_retries: (int) Retries after the first attempt for transient errors.
+        :param base_delay: (float) First backoff delay in seconds.
+        :param max_delay: (float) Cap on a single backoff delay.
+        :param breaker: (CircuitBreaker) Shared breaker; a default one is created if omitted.
+        """
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = 0
+        self.timeouts_hit = 0
+
+    def timeout_for(self, task):
+        return self.timeouts.get(task, self.default_timeout)
+
+    def deadline(self, task):
+        """Longest call() can take: every attempt timing out, with the longest backoff between them."""
+        backoffs = sum(min(self.max_delay, self.base_delay * (2 ** attempt)) for attempt in range(self.max_retries))
+        return self.timeout_for(task) * (self.max_retries + 1) + backoffs
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff delay for a retry attempt (0-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _attempts(self, task, before_attempt, fn):
+        """Run fn with retries; shared by call() and the first chunk of stream()."""
+        timeout = self.timeout_for(task)
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("The AI service is temporarily unavailable.")
+            if before_attempt is not None:
+                try:
+                    before_attempt()
+                except BaseException:
+                    self.breaker.cancel_trial()
+                    raise
+            try:
+                result = call_with_timeout(fn, timeout)
+            except Exception as e:
+                if isinstance(e, TimeoutError):
+                    self.timeouts_hit += 1
+                if not is_transient_error(e):
+                    if is_service_error(e):
+                        # The service answered, so it is reachable even if the request was bad
+                        self.breaker.record_success()
+                    else:
+                        # A local failure says nothing about the service
+                        self.breaker.cancel_trial()
+                    raise
+                self.breaker.record_failure()
+                # Retrying while the timed-out call still holds a worker would only pile up load
+                if attempt >= self.max_retries or getattr(e, "running", False):
+                    raise
+                self.retries += 1
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            return result
+
+    def call(self, task, fn, before_attempt=None):
+        """
+        Call fn() under the task's timeout, retrying transient failures.
+        :param task: (str) Task name, used to pick the timeout.
+        :param fn: (callable) The model call.
+        :param before_attempt: (callable) Hook run before every attempt (e.g. rate limiting).
+        :return: fn's result.
+        """
+        result = self._attempts(task, before_attempt, fn)
+        self.breaker.record_success()
+        return result
+
+    def stream(self, task, open_stream, before_attempt=None):
+        """
+        Stream chunks with retries up to the first chunk and a per-chunk timeout after.
+        A stream cannot be retried once text has been shown, so later failures are raised.
+        :param task: (str) Task name, used to pick the timeout.
+        :param open_stream: (callable) Returns a fresh chunk iterator.
+        :param before_attempt: (callable) Hook run before every attempt.
+        :return: (generator) Text chunks.
+        """
+        holder = {}
+
+        def first_chunk():
+            holder["source"] = iter(open_stream())
+            return next(holder["source"], _STREAM_END)
+
+        chunk = self._attempts(task, before_attempt, first_chunk)
+        timeout = self.timeout_for(task)
+        # Text is flowing, so the service is up
+        self.breaker.record_success()
+        while chunk is not _STREAM_END:
+            yield chunk
+            try:
+                chunk = call_with_timeout(lambda: next(holder["source"], _STREAM_END), timeout)
+            except Exception as e:
+                if isinstance(e, TimeoutError):
+                    self.timeouts_hit += 1
+                if is_transient_error(e):
+                    self.breaker.record_failure()
+                raise
+
+    def stats(self):
+        return {
+            "breaker": self.breaker.stats(),
+            "retries": self.retries,
+            "timeouts": self.timeouts_hit,
+        }
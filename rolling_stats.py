@@ -0,0 +1,128 @@
+# rolling_stats.py
+# Incremental per-metric statistics, updated in O(1) on every reading
+import math
+from collections import deque
+
+
+class RollingWindow:
+    """
+    Mean, standard deviation, least-squares slope and min/max over the last
+    `size` readings.
+
+    Running sums make each push O(1); min/max use monotonic deques (amortized
+    O(1)). The slope is in value units per reading, so several readings on
+    the same day still count as a trend.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = deque()
+        self.count = 0  # readings pushed so far; used as the x coordinate
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._sum_xy = 0.0
+        self._min = deque()  # (x, value), values increasing
+        self._max = deque()  # (x, value), values decreasing
+
+    def push(self, value):
+        x = self.count
+        self.count += 1
+        self.values.append(value)
+        self._sum += value
+        self._sum_sq += value * value
+        self._sum_xy += x * value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((x, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((x, value))
+
+        if len(self.values) > self.size:
+            old = self.values.popleft()
+            old_x = x - self.size
+            self._sum -= old
+            self._sum_sq -= old * old
+            self._sum_xy -= old_x * old
+        first_x = self.count - len(self.values)
+        while self._min[0][0] < first_x:
+            self._min.popleft()
+        while self._max[0][0] < first_x:
+            self._max.popleft()
+
+    @property
+    def n(self):
+        return len(self.values)
+
+    @property
+    def mean(self):
+        return self._sum / self.n if self.n else None
+
+    @property
+    def std(self):
+        """Sample standard deviation, or None with fewer than two readings."""
+        if self.n < 2:
+            return None
+        variance = (self._sum_sq - self._sum * self._sum / self.n) / (self.n - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    @property
+    def slope(self):
+        """Least-squares change per reading, or None with fewer than two readings."""
+        n = self.n
+        if n < 2:
+            return None
+        # x runs over first_x .. first_x + n - 1
+        first_x = self.count - n
+        sum_x = n * first_x + n * (n - 1) / 2
+        sum_xx = n * first_x * first_x + first_x * n * (n - 1) + (n - 1) * n * (2 * n - 1) / 6
+        denominator = n * sum_xx - sum_x * sum_x
+        return (n * self._sum_xy - sum_x * self._sum) / denominator
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else None
+
+    def trend(self, tolerance=0.02):
+        """
+        Direction of the fitted line across the window: "up", "down" or "flat".
+        :param tolerance: (float) Changes smaller than this fraction of the mean count as flat.
+        """
+        slope = self.slope
+        if slope is None:
+            return "flat"
+        change = slope * (self.n - 1)
+        if abs(change) <= tolerance * abs(self.mean):
+            return "flat"
+        return "up" if change > 0 else "down"
+
+
+class RollingStats:
+    """EWMA and all-time min/max plus one RollingWindow per configured size."""
+
+    def __init__(self, windows=(7, 30), alpha=0.3):
+        """
+        :param windows: (tuple) Window sizes in readings.
+        :param alpha: (float) EWMA smoothing factor (weight of the newest reading).
+        """
+        self.alpha = alpha
+        self.windows = {size: RollingWindow(size) for size in windows}
+        self.ewma = None
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def push(self, value):
+        self.count += 1
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for window in self.windows.values():
+            window.push(value)
+
+    def window(self, size):
+        return self.windows[size]
@@ -0,0 +1,31 @@
+# tests/test_exports.py
+from io import BytesIO
+
+from bulk_import import import_metrics
+from exports import StoredHistory, export_metrics
+from health_db import HealthDB
+from health_events import EpisodeProjection, EventLog, MetricProjection, history_entries
+from metrics_store import DAY, MetricStore
+
+
+def test_stored_history_export_matches_session_projection(tmp_path):
+    db = HealthDB(str(tmp_path / "health.db"))
+    db.add_metrics("u", [("glucose_levels", 1000 * DAY, 100), ("glucose_levels", 1002 * DAY, 102)])
+    db.add_episodes("u", "glucose_log", [{"date": "1972-09-28", "glucose_level": 150, "insulin_dose": 2}])
+
+    events = EventLog({"metrics": MetricProjection(), "episodes": EpisodeProjection()})
+    events.append(history_entries(db, "u"))
+
+    stored = export_metrics(StoredHistory(db, "u"))
+    assert stored == export_metrics(events["metrics"].store)
+    assert b"150" in stored
+
+
+def test_csv_export_round_trips_sub_daily_readings():
+    store = MetricStore()
+    store.append("heart_rates", 1000 * DAY + 8 * 3600, 60)
+    store.append("heart_rates", 1000 * DAY + 20 * 3600, 64)
+
+    readings, report = import_metrics(BytesIO(export_metrics(store)), "export.csv", {"heart_rates": (20, 250)})
+    assert report["imported"] == 2 and report["duplicates"] == 0
+    assert list(readings["heart_rates"][0]) == [1000 * DAY + 8 * 3600, 1000 * DAY + 20 * 3600]
@@ -0,0 +1,30 @@
+# tests/test_metrics_store.py
+from datetime import date, timedelta
+from metrics_store import DAY, MetricSeries, to_timestamp
+
+
+def test_rolling_stats_follow_time_order_after_backfill():
+    today = date(2024, 6, 30)
+    series = MetricSeries()
+    for i in range(7):
+        series.append(today - timedelta(days=6 - i), 60 + 5 * i)
+    old = to_timestamp(today - timedelta(days=400))
+    series.extend([old + i * DAY for i in range(30)], [120.0] * 30)
+
+    week = series.stats.window(7)
+    assert list(week.values) == [60.0 + 5 * i for i in range(7)]
+    assert week.trend() == "up"
+    assert series.stats.ewma < 90
+    assert series.latest() == (to_timestamp(today), 90.0)
+
+
+def test_late_single_reading_rebuilds_windows():
+    series = MetricSeries(windows=(3,))
+    for day, value in ((2, 10.0), (3, 20.0), (4, 30.0)):
+        series.append(date(2024, 1, day), value)
+    series.append(date(2024, 1, 1), 99.0)
+
+    assert list(series.stats.window(3).values) == [10.0, 20.0, 30.0]
+    assert series.stats.max == 99.0
+    series.append(date(2024, 1, 5), 40.0)
+    assert list(series.stats.window(3).values) == [20.0, 30.0, 40.0]